@@ -1,14 +1,26 @@
 import os
+import time
 import logging
+import collections
 
+import jpart.output
 import jpart.utility
 
 _MAX_CACHED_RESOURCES = 100
 
+# The share of the capacity for names that have only been seen once, and the
+# number of evicted names to remember (also as a share of the capacity)
+_TWO_QUEUE_IN_RATIO = 0.25
+_TWO_QUEUE_OUT_RATIO = 0.5
+
 _LOGGER = logging.getLogger(__name__)
 
 
-def default_fault_handler(output_path, name):
+def default_fault_handler(output_path, name, created_paths=None):
+    """Open the named file under the output path. If a
+    `jpart.utility.CreatedPaths` is given, directories that we've already
+    created are not checked again.
+    """
 
     filepath = os.path.join(output_path, name)
     output_path = os.path.dirname(filepath)
@@ -16,40 +28,273 @@ def default_fault_handler(output_path, name):
 
     _LOGGER.info("Opening: [{}]".format(filename))
 
-    if os.path.exists(output_path) is False:
+    if created_paths is not None:
+        created_paths.ensure(output_path)
+
+    elif os.path.exists(output_path) is False:
         os.makedirs(output_path)
 
     f = jpart.utility.RESOURCE_APPEND_OPENER(filepath)
     return f
 
 
+class LruPolicy(object):
+    """Evict whatever was used least recently."""
+
+    def __init__(self, capacity):
+        self._order = collections.OrderedDict()
+
+    @property
+    def names(self):
+        """The cached names, in the order that they'd be evicted."""
+
+        return list(self._order)
+
+    def hit(self, name):
+        self._order.move_to_end(name)
+
+    def insert(self, name):
+        self._order[name] = None
+
+    def evict(self):
+        name, _ = self._order.popitem(last=False)
+        return name
+
+    def remove(self, name):
+        del self._order[name]
+
+
+class TwoQueuePolicy(object):
+    """Scan-resistant "2Q" policy. New names go into a small FIFO and are
+    evicted from there first, so a burst of one-off names can't flush out the
+    hot set. A name that is used again while it's in the FIFO, or that comes
+    back shortly after being evicted from it (we remember those names without
+    their resources), is promoted into the main LRU.
+    """
+
+    def __init__(
+            self, capacity, in_ratio=_TWO_QUEUE_IN_RATIO,
+            out_ratio=_TWO_QUEUE_OUT_RATIO):
+
+        self._in_capacity = max(1, int(capacity * in_ratio))
+        self._out_capacity = max(1, int(capacity * out_ratio))
+
+        # Resident, seen once
+        self._in = collections.OrderedDict()
+
+        # Not resident, seen once recently
+        self._out = collections.OrderedDict()
+
+        # Resident, seen more than once
+        self._main = collections.OrderedDict()
+
+    @property
+    def names(self):
+        """The cached names, in the order that they'd be evicted."""
+
+        if len(self._in) >= self._in_capacity:
+            return list(self._in) + list(self._main)
+
+        return list(self._main) + list(self._in)
+
+    def hit(self, name):
+
+        try:
+            del self._in[name]
+
+        except KeyError:
+            self._main.move_to_end(name)
+
+        else:
+            self._main[name] = None
+
+    def insert(self, name):
+
+        try:
+            del self._out[name]
+
+        except KeyError:
+            self._in[name] = None
+
+        else:
+            self._main[name] = None
+
+    def evict(self):
+
+        if len(self._in) >= self._in_capacity or not self._main:
+            name, _ = self._in.popitem(last=False)
+
+            self._out[name] = None
+            if len(self._out) > self._out_capacity:
+                self._out.popitem(last=False)
+
+        else:
+            name, _ = self._main.popitem(last=False)
+
+        return name
+
+    def remove(self, name):
+        """Drop a resident name without remembering it."""
+
+        try:
+            del self._in[name]
+
+        except KeyError:
+            del self._main[name]
+
+
+POLICY__LRU = 'lru'
+POLICY__TWO_QUEUE = '2q'
+
+_POLICIES = {
+    POLICY__LRU: LruPolicy,
+    POLICY__TWO_QUEUE: TwoQueuePolicy,
+}
+
+
 class CachedResources(object):
-    def __init__(self, fault_cb):
-        self._lru = []
+    def __init__(
+            self, fault_cb, capacity=None, policy=None, do_track_idle=False):
+        """`policy` can be the name of one of the stock policies or a callable
+        that takes the capacity and returns an object implementing the same
+        methods as `LruPolicy`. If `do_track_idle` is True, the time that every
+        resource was last used is kept so that `close_idle()` can be used.
+        """
+
+        if capacity is None:
+            capacity = _MAX_CACHED_RESOURCES
+
+        assert \
+            capacity > 0, \
+            "Capacity must be at least one: ({})".format(capacity)
+
+        if policy is None:
+            policy = POLICY__LRU
+
+        if policy.__class__ is str:
+            try:
+                policy = _POLICIES[policy]
+
+            except KeyError:
+                raise \
+                    ValueError(
+                        "Eviction policy not valid: [{}]".format(policy))
+
+        self._policy = policy(capacity)
         self._index = {}
 
         self._fault_cb = fault_cb
+        self._capacity = capacity
+
+        # name -> time last used
+        self._last_used = None
+        if do_track_idle is True:
+            self._last_used = {}
+
+        self._hits = 0
+        self._faults = 0
+        self._closes = 0
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def memory_bytes(self):
+        """Approximately what the open resources hold."""
+
+        memory_bytes = sum(
+            getattr(resource, 'memory_bytes', jpart.output.HANDLE_BYTES)
+            for resource
+            in self._index.values()
+        )
+
+        return memory_bytes
 
     @property
     def lru(self):
-        return self._lru
+        return self._policy.names
 
     @property
     def index(self):
         return self._index
 
+    @property
+    def stats(self):
+        stats = {
+            'hits': self._hits,
+            'faults': self._faults,
+            'closes': self._closes,
+        }
+
+        return stats
+
     def _dispose_oldest(self):
 
-        if not self._lru:
+        if not self._index:
             return False
 
-        name, self._lru = self._lru[0], self._lru[1:]
+        name = self._policy.evict()
+        self._close(name)
+
+        return True
+
+    def _close(self, name):
+
         resource = self._index.pop(name)
 
+        if self._last_used is not None:
+            del self._last_used[name]
+
         _LOGGER.info("Closing: [{}]".format(name))
         resource.close()
 
-        return True
+        self._closes += 1
+
+    def close_idle(self, idle_seconds, now=None):
+        """Close every resource that hasn't been used for the given number of
+        seconds. Returns how many were closed.
+        """
+
+        assert \
+            self._last_used is not None, \
+            "Idle resources aren't being tracked."
+
+        if now is None:
+            now = time.monotonic()
+
+        names = [
+            name
+            for name, last_used
+            in self._last_used.items()
+            if now - last_used >= idle_seconds
+        ]
+
+        for name in names:
+            self._policy.remove(name)
+            self._close(name)
+
+        return len(names)
+
+    def set_capacity(self, capacity):
+        """Change how many resources can be open, closing whatever doesn't fit
+        anymore.
+        """
+
+        assert \
+            capacity > 0, \
+            "Capacity must be at least one: ({})".format(capacity)
+
+        self._capacity = capacity
+
+        while len(self._index) > capacity:
+            self._dispose_oldest()
+
+    def flush(self):
+        """Flush every open resource without closing it."""
+
+        for resource in self._index.values():
+            resource.flush()
 
     def dispose(self):
 
@@ -57,7 +302,7 @@ class CachedResources(object):
             return False
 
         # Designed to avoid infinite looping
-        for _ in range(_MAX_CACHED_RESOURCES):
+        for _ in range(self._capacity):
             last_result = self._dispose_oldest()
 
             if last_result is False:
@@ -82,12 +327,19 @@ class CachedResources(object):
             pass
 
         else:
+            self._policy.hit(name)
+            self._hits += 1
+
+            if self._last_used is not None:
+                self._last_used[name] = time.monotonic()
+
             return resource
 
 
         # Retrieve resource
 
         resource = self._fault_cb(name)
+        self._faults += 1
 
         # Register resource
 
@@ -105,11 +357,14 @@ class CachedResources(object):
 
         # Make sure there's space
 
-        if len(self._index) >= _MAX_CACHED_RESOURCES:
+        if len(self._index) >= self._capacity:
             self._dispose_oldest()
 
 
         # Add to cache
 
-        self._lru.append(name)
+        self._policy.insert(name)
         self._index[name] = resource
+
+        if self._last_used is not None:
+            self._last_used[name] = time.monotonic()
@@ -0,0 +1,337 @@
+import os
+import re
+import json
+import sqlite3
+import logging
+
+DEFAULT_CATALOG_FILENAME = '.catalog.sqlite3'
+
+# The number of files with pending updates that we'll hold before writing them
+_DEFAULT_BATCH_SIZE = 1000
+
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+# Roughly what one pending file update holds
+_PENDING_BYTES = 256
+
+_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS `files` (
+    `path` TEXT NOT NULL PRIMARY KEY,
+    `partition` TEXT NOT NULL,
+    `rule` TEXT NOT NULL,
+    `phrases` TEXT NOT NULL,
+    `records` INTEGER NOT NULL,
+    `bytes` INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS `files_rule` ON `files` (`rule`);
+
+CREATE TABLE IF NOT EXISTS `file_values` (
+    `path` TEXT NOT NULL,
+    `position` INTEGER NOT NULL,
+    `field` TEXT NOT NULL,
+    `value` TEXT NOT NULL,
+    PRIMARY KEY (`path`, `position`)
+);
+
+CREATE INDEX IF NOT EXISTS `file_values_field_value`
+    ON `file_values` (`field`, `value`);
+"""
+
+_UPSERT_FILE_QUERY = """\
+INSERT INTO `files`
+    (`path`, `partition`, `rule`, `phrases`, `records`, `bytes`)
+VALUES
+    (?, ?, ?, ?, ?, ?)
+ON CONFLICT (`path`) DO UPDATE SET
+    `records` = `records` + `excluded`.`records`,
+    `bytes` = `bytes` + `excluded`.`bytes`
+"""
+
+_INSERT_VALUE_QUERY = """\
+INSERT OR IGNORE INTO `file_values`
+    (`path`, `position`, `field`, `value`)
+VALUES
+    (?, ?, ?, ?)
+"""
+
+_OPERATORS = ('!=', '<=', '>=', '=', '<', '>')
+_PREDICATE_RE = re.compile(r'^([^!<>=]+)(!=|<=|>=|=|<|>)(.*)$')
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def get_catalog_filepath(output_path, filename=DEFAULT_CATALOG_FILENAME):
+    return os.path.join(output_path, filename)
+
+
+def parse_predicate(predicate):
+    """Parse an expression like "field=value" into a (field, operator, value)
+    tuple. Values are compared as strings.
+    """
+
+    m = _PREDICATE_RE.match(predicate)
+    if m is None:
+        raise \
+            ValueError(
+                "Predicate not valid: [{}]".format(predicate))
+
+    return m.groups()
+
+
+class Catalog(object):
+    """A SQLite table of the partition files under an output path, with their
+    rule, phrase values, record count, and byte count. Paths are relative to
+    the output path. Updates are held in memory and written in batches.
+    """
+
+    def __init__(self, filepath, output_path, batch_size=_DEFAULT_BATCH_SIZE):
+        self._filepath = filepath
+        self._output_path = output_path
+        self._batch_size = batch_size
+
+        self._connection = sqlite3.connect(filepath)
+        self._connection.executescript(_SCHEMA)
+
+        # partition name -> (rule name, field names, phrases)
+        self._partitions = {}
+
+        # path -> [partition name, records, bytes]
+        self._pending = {}
+
+    @property
+    def filepath(self):
+        return self._filepath
+
+    @property
+    def memory_bytes(self):
+        return len(self._pending) * _PENDING_BYTES
+
+    def register_partition(self, name, rule_name, field_names, phrases):
+        """Remember what a partition (by its name relative to the output path)
+        was produced by.
+        """
+
+        if name in self._partitions:
+            return
+
+        self._partitions[name] = (rule_name, field_names, phrases)
+
+    def is_registered(self, name):
+        return name in self._partitions
+
+    def add(self, name, filepath, records, bytes_):
+        """Count records that were written to one of the files of a
+        partition.
+        """
+
+        rel_filepath = os.path.relpath(filepath, self._output_path)
+
+        try:
+            pending = self._pending[rel_filepath]
+
+        except KeyError:
+            self._pending[rel_filepath] = [name, records, bytes_]
+
+            if len(self._pending) >= self._batch_size:
+                self.flush()
+
+        else:
+            pending[1] += records
+            pending[2] += bytes_
+
+    def flush(self):
+
+        if not self._pending:
+            return
+
+        file_rows = []
+        value_rows = []
+        for rel_filepath, (name, records, bytes_) in self._pending.items():
+            rule_name, field_names, phrases = self._partitions[name]
+
+            file_rows.append((
+                rel_filepath,
+                name,
+                rule_name,
+                json.dumps(phrases),
+                records,
+                bytes_,
+            ))
+
+            for position, (field_name, phrase) \
+                    in enumerate(zip(field_names, phrases)):
+
+                value_rows.append((
+                    rel_filepath,
+                    position,
+                    field_name,
+                    phrase,
+                ))
+
+        with self._connection:
+            self._connection.executemany(_UPSERT_FILE_QUERY, file_rows)
+            self._connection.executemany(_INSERT_VALUE_QUERY, value_rows)
+
+        _LOGGER.debug("Cataloged ({}) files.".format(len(file_rows)))
+
+        self._pending.clear()
+
+    def close(self):
+        self.flush()
+        self._connection.close()
+
+    def replace_files(self, target_rel_filepath, rel_filepaths):
+        """Record that the given files were merged into the target (which may
+        or may not be one of them).
+        """
+
+        markers = ', '.join(['?'] * len(rel_filepaths))
+
+        with self._connection:
+            c = self._connection.cursor()
+
+            c.execute(
+                "SELECT `partition`, `rule`, `phrases`, SUM(`records`), "
+                "SUM(`bytes`) "
+                "FROM `files` "
+                "WHERE `path` IN ({}) "
+                "GROUP BY `partition`, `rule`, `phrases`".format(markers),
+                rel_filepaths)
+
+            rows = c.fetchall()
+            if not rows:
+                return
+
+            assert \
+                len(rows) == 1, \
+                "Files belong to more than one partition: {}".format(
+                    rel_filepaths)
+
+            c.execute(
+                "SELECT `position`, `field`, `value` "
+                "FROM `file_values` "
+                "WHERE `path` IN ({}) "
+                "GROUP BY `position`".format(markers),
+                rel_filepaths)
+
+            values = c.fetchall()
+
+            c.execute(
+                "DELETE FROM `files` WHERE `path` IN ({})".format(markers),
+                rel_filepaths)
+
+            c.execute(
+                "DELETE FROM `file_values` WHERE `path` IN ({})".format(
+                markers),
+                rel_filepaths)
+
+            c.execute(_UPSERT_FILE_QUERY, (target_rel_filepath,) + rows[0])
+
+            c.executemany(
+                _INSERT_VALUE_QUERY,
+                [
+                    (target_rel_filepath,) + value
+                    for value
+                    in values
+                ])
+
+    def merge(self, filepath, rel_filepaths):
+        """Add the files of another catalog, under the paths that they were
+        moved to (a dictionary of its paths to ours). Counts are added to any
+        file that we already have.
+        """
+
+        self.flush()
+
+        other = sqlite3.connect(filepath)
+
+        try:
+            file_rows = other.execute(
+                "SELECT `path`, `partition`, `rule`, `phrases`, `records`, "
+                "`bytes` "
+                "FROM `files`").fetchall()
+
+            value_rows = other.execute(
+                "SELECT `path`, `position`, `field`, `value` "
+                "FROM `file_values`").fetchall()
+
+        finally:
+            other.close()
+
+        file_rows = [
+            (rel_filepaths.get(row[0], row[0]),) + row[1:]
+            for row
+            in file_rows
+        ]
+
+        value_rows = [
+            (rel_filepaths.get(row[0], row[0]),) + row[1:]
+            for row
+            in value_rows
+        ]
+
+        with self._connection:
+            self._connection.executemany(_UPSERT_FILE_QUERY, file_rows)
+            self._connection.executemany(_INSERT_VALUE_QUERY, value_rows)
+
+    def find(self, rule_name=None, predicates=()):
+        """Return (path, records, bytes) for the files that match the rule and
+        all of the (field, operator, value) predicates.
+        """
+
+        conditions = []
+        arguments = []
+
+        if rule_name is not None:
+            conditions.append("f.`rule` = ?")
+            arguments.append(rule_name)
+
+        for field_name, operator, value in predicates:
+            assert \
+                operator in _OPERATORS, \
+                "Operator not valid: [{}]".format(operator)
+
+            conditions.append(
+                "EXISTS (SELECT 1 FROM `file_values` v "
+                "WHERE v.`path` = f.`path` AND v.`field` = ? AND "
+                "v.`value` {} ?)".format(operator))
+
+            arguments.append(field_name)
+            arguments.append(value)
+
+        query = "SELECT f.`path`, f.`records`, f.`bytes` FROM `files` f"
+
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        # Keep the segments of a partition in order. The first segment has the
+        # shortest name and the rest are the same length.
+        query += " ORDER BY f.`partition`, LENGTH(f.`path`), f.`path`"
+
+        c = self._connection.cursor()
+        c.execute(query, arguments)
+
+        return c.fetchall()
+
+
+def copy_files(output_path, rel_filepaths, f):
+    """Stream the records of the given files, without decoding them, to a
+    binary stream.
+    """
+
+    for rel_filepath in rel_filepaths:
+        filepath = os.path.join(output_path, rel_filepath)
+
+        try:
+            with open(filepath, 'rb') as g:
+                while True:
+                    chunk = g.read(_COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+
+                    f.write(chunk)
+
+        except FileNotFoundError:
+            _LOGGER.warning("Cataloged file is missing: [{}]".format(
+                            filepath))
@@ -0,0 +1,249 @@
+import logging
+
+import riu.hierarchy
+
+import jpart.filter
+import jpart.rule
+
+_HIERARCHY_SEPARATOR = '.'
+
+_INDENT = '    '
+
+# What a lookup gives for a field that isn't there
+_MISSING = object()
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _get_value_slowly(record, name):
+    """The generic lookup, for anything that isn't a plain dictionary
+    (lists, None, etc.). It behaves exactly like the uncompiled rule.
+    """
+
+    try:
+        return \
+            riu.hierarchy.get_value_from_hierarchy_with_string_reference(
+                record, name)
+
+    except KeyError:
+        return _MISSING
+
+
+def _is_per_record(filter_):
+    """Whether the filter's batch methods are just loops over its per-record
+    ones, so that evaluating records one at a time gives the same result.
+    """
+
+    if isinstance(filter_, jpart.filter.MemoizedFilter) is True:
+        return _is_per_record(filter_.filter)
+
+    cls_ = filter_.__class__
+
+    return \
+        cls_.get_values is jpart.filter.BaseFilter.get_values and \
+        cls_.does_qualify_batch is jpart.filter.BaseFilter.does_qualify_batch
+
+
+def _generate_lookup(name, target):
+    """Walk the dictionaries of the field's path inline and fall back to the
+    generic lookup as soon as something else turns up.
+    """
+
+    keys = name.split(_HIERARCHY_SEPARATOR)
+    slow = '{} = _get_value_slowly(record, {!r})'.format(target, name)
+
+    lines = ['{} = _MISSING'.format(target)]
+
+    # Each level is nested in the one before it
+    for i, key in enumerate(keys):
+        pad = _INDENT * i
+
+        if i == 0:
+            node = 'record'
+        else:
+            node = 'n{}'.format(i)
+
+        if i == len(keys) - 1:
+            child = target
+        else:
+            child = 'n{}'.format(i + 1)
+
+        lines += [
+            pad + 'if {}.__class__ is dict:'.format(node),
+            pad + _INDENT + '{} = {}.get({!r}, _MISSING)'.format(
+            child, node, key),
+        ]
+
+    # Unwind, adding the fallbacks from the innermost level out. A missing key
+    # stays missing (like a KeyError) but any other kind of node is left to the
+    # generic lookup.
+    for i in reversed(range(len(keys))):
+        pad = _INDENT * i
+
+        if i == 0:
+            lines.append(pad + 'else:')
+        else:
+            lines.append(pad + 'elif n{} is not _MISSING:'.format(i))
+
+        lines.append(pad + _INDENT + slow)
+
+    return lines
+
+
+def _generate_body(rule):
+    """Return the lines of a function of one record that returns its phrases
+    or None.
+    """
+
+    lines = []
+    phrase_names = []
+    for i, (part, is_fan_out) \
+            in enumerate(zip(rule._parts, rule._fan_out_flags)):
+
+        value = 'v{}'.format(i)
+        phrase = 'p{}'.format(i)
+
+
+        # Value
+
+        if isinstance(part, (list, tuple)) is True:
+            name = part[0]
+
+            lines += [
+                'try:',
+                _INDENT + '{} = get_value{}({!r}, record)'.format(
+                value, i, name),
+                'except SkipRuleException as e:',
+                _INDENT + 'skips[(e.field_name, e.reason)] += 1',
+                _INDENT + 'return None',
+                'if does_qualify{}({!r}, {}) is False:'.format(
+                i, name, value),
+                _INDENT + 'skips[({!r}, SKIP_REASON_MODULE__NOT_QUALIFIED)] '
+                    '+= 1'.format(name),
+                _INDENT + 'return None',
+            ]
+
+        else:
+            name = part
+
+            lines += _generate_lookup(name, value)
+
+            lines += [
+                'if {} is _MISSING:'.format(value),
+                _INDENT + 'skips[({!r}, SKIP_REASON_DEFAULT__NOT_FOUND)] '
+                    '+= 1'.format(name),
+                _INDENT + 'return None',
+            ]
+
+
+        # Phrase. Only the common cases are inlined and anything else gets
+        # the generic validation (and its errors).
+
+        if is_fan_out is True:
+            lines.append(
+                '{} = get_fan_out_phrases(part{}, {}, record)'.format(
+                phrase, i, value))
+
+        else:
+            lines += [
+                'if {0}.__class__ is str and match({0}) is not None:'.format(
+                value),
+                _INDENT + '{} = {}'.format(phrase, value),
+                'elif {}.__class__ is int:'.format(value),
+                _INDENT + '{} = str({})'.format(phrase, value),
+                'else:',
+                _INDENT + '{} = get_phrase(part{}, {}, record)'.format(
+                phrase, i, value),
+            ]
+
+        phrase_names.append(phrase)
+
+
+    phrases = '[{}]'.format(', '.join(phrase_names))
+
+    if rule._is_fan_out is True:
+        lines += [
+            'phrases = {}'.format(phrases),
+            'reason = check_fan_out(phrases)',
+            'if reason is not None:',
+            _INDENT + 'skips[(fan_out_field_name, reason)] += 1',
+            _INDENT + 'return None',
+            'return phrases',
+        ]
+
+    else:
+        lines.append('return {}'.format(phrases))
+
+    return lines
+
+
+def generate_source(rule):
+    """Return the source of the specialized functions for a rule."""
+
+    source_lines = ['def apply(record):']
+    source_lines += [
+        _INDENT + line
+        for line
+        in _generate_body(rule)
+    ]
+
+    source_lines += [
+        '',
+        '',
+        'def apply_batch(records):',
+        _INDENT + 'return [apply(record) for record in records]',
+        '',
+    ]
+
+    return '\n'.join(source_lines)
+
+
+def compile_rule(rule):
+    """Generate and compile a function specialized to the rule that does what
+    `Rule.apply()` does, with the field paths, filter calls, and validation
+    inlined. Returns it along with the equivalent of `Rule.apply_batch()`, or
+    None if one of the rule's filters has its own batch methods (which only
+    the generic version uses).
+    """
+
+    source = generate_source(rule)
+
+    g = {
+        '_MISSING': _MISSING,
+        '_get_value_slowly': _get_value_slowly,
+        'SkipRuleException': jpart.filter.SkipRuleException,
+        'SKIP_REASON_MODULE__NOT_QUALIFIED':
+            jpart.rule.SKIP_REASON_MODULE__NOT_QUALIFIED,
+        'SKIP_REASON_DEFAULT__NOT_FOUND':
+            jpart.rule.SKIP_REASON_DEFAULT__NOT_FOUND,
+        'match': jpart.rule._FILENAME_VALUE_RE.match,
+        'skips': rule._skips,
+        'get_phrase': rule._get_phrase,
+        'get_fan_out_phrases': rule._get_fan_out_phrases,
+        'check_fan_out': rule._check_fan_out,
+        'fan_out_field_name': rule._fan_out_field_name,
+    }
+
+    is_per_record = True
+    for i, part in enumerate(rule._parts):
+        g['part{}'.format(i)] = part
+
+        if isinstance(part, (list, tuple)) is True:
+            filter_ = part[1]
+
+            g['get_value{}'.format(i)] = filter_.get_value
+            g['does_qualify{}'.format(i)] = filter_.does_qualify
+
+            if _is_per_record(filter_) is False:
+                is_per_record = False
+
+    _LOGGER.debug("Compiled rule [{}]:\n{}".format(rule.name, source))
+
+    code = compile(source, '<jpart rule {}>'.format(rule.name), 'exec')
+    exec(code, g)
+
+    apply_batch = None
+    if is_per_record is True:
+        apply_batch = g['apply_batch']
+
+    return g['apply'], apply_batch
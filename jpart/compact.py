@@ -0,0 +1,339 @@
+import os
+import re
+import logging
+import collections
+import multiprocessing
+
+import jpart.index
+import jpart.output
+import jpart.catalog
+
+_DEFAULT_TARGET_BYTES = 128 * 1024 * 1024
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+_SEGMENT_FILENAME_RE = re.compile(r'^(.+)-([0-9]{5})(\.jsonl)$')
+_PARTITION_SUFFIX = '.jsonl'
+_TEMP_FILENAME_TEMPLATE = '.{}.compact-{}'
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def find_partitions(output_path):
+    """Return a dictionary of the partitions under the output path mapped to
+    their files (as (segment, filepath, size) tuples, in segment order). A
+    numbered file is only treated as a segment if its first segment exists
+    beside it. Hidden files and directories are ignored.
+    """
+
+    partitions = collections.defaultdict(list)
+    for path, folders, filenames in os.walk(output_path):
+
+        # Prune hidden directories in-place
+        folders[:] = [
+            folder
+            for folder
+            in folders
+            if folder.startswith('.') is False
+        ]
+
+        filenames_s = set([
+            filename
+            for filename
+            in filenames
+            if filename.startswith('.') is False and \
+               filename.endswith(_PARTITION_SUFFIX) is True
+        ])
+
+        for filename in filenames_s:
+            base_filename = filename
+            segment = 0
+
+            m = _SEGMENT_FILENAME_RE.match(filename)
+            if m is not None:
+                candidate = m.group(1) + m.group(3)
+
+                if candidate in filenames_s:
+                    base_filename = candidate
+                    segment = int(m.group(2))
+
+            filepath = os.path.join(path, filename)
+            size = os.path.getsize(filepath)
+
+            base_filepath = os.path.join(path, base_filename)
+            partitions[base_filepath].append((segment, filepath, size))
+
+
+    for files in partitions.values():
+        files.sort()
+
+    return dict(partitions)
+
+
+def plan_bins(files, target_bytes):
+    """Pack consecutive files into bins of up to the target size. A file that
+    is already larger than the target is left on its own.
+    """
+
+    bins = []
+    current = []
+    current_size = 0
+    for file_ in files:
+        size = file_[2]
+
+        if current and current_size + size > target_bytes:
+            bins.append(current)
+
+            current = []
+            current_size = 0
+
+        current.append(file_)
+        current_size += size
+
+    if current:
+        bins.append(current)
+
+    return bins
+
+
+def _copy(src_fd, dst_fd, size):
+    """Stream one file onto the end of another, within the kernel if we
+    can.
+    """
+
+    remaining = size
+
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    if copy_file_range is not None:
+        try:
+            while remaining > 0:
+                copied = \
+                    copy_file_range(
+                        src_fd,
+                        dst_fd,
+                        min(remaining, _COPY_CHUNK_SIZE))
+
+                if copied == 0:
+                    break
+
+                remaining -= copied
+
+        except OSError:
+            # Not supported between these files. Continue from wherever we
+            # got to.
+            pass
+
+    while remaining > 0:
+        chunk = os.read(src_fd, min(remaining, _COPY_CHUNK_SIZE))
+        if not chunk:
+            break
+
+        view = memoryview(chunk)
+        while view:
+            written = os.write(dst_fd, view)
+            view = view[written:]
+
+        remaining -= len(chunk)
+
+
+def _concatenate(filepaths, dst_fd):
+
+    for filepath in filepaths:
+        with open(filepath, 'rb') as f:
+            src_fd = f.fileno()
+
+            size = os.fstat(src_fd).st_size
+            if size == 0:
+                continue
+
+            _copy(src_fd, dst_fd, size)
+
+            # Make sure that a truncated last record can't run into the first
+            # record of the next file
+            if os.pread(src_fd, 1, size - 1) != b'\n':
+                os.write(dst_fd, b'\n')
+
+
+def _rename_sidecar(filepath, target_filepath):
+
+    sidecar_filepath = jpart.index.get_sidecar_filepath(filepath)
+    if os.path.exists(sidecar_filepath) is False:
+        return
+
+    os.replace(
+        sidecar_filepath,
+        jpart.index.get_sidecar_filepath(target_filepath))
+
+
+def _get_sidecar_stride(filepaths):
+    """Return the stride of the first index among the files, or None if none of
+    them are indexed.
+    """
+
+    for filepath in filepaths:
+        sidecar_filepath = jpart.index.get_sidecar_filepath(filepath)
+        if os.path.exists(sidecar_filepath) is False:
+            continue
+
+        entries = jpart.index.load_index(filepath)
+        return jpart.index.get_stride(entries)
+
+    return None
+
+
+def compact_partition(base_filepath, files, target_bytes):
+    """Merge the files of one partition into as few segments as the target
+    size allows. Every merged segment is written to a hidden temporary file
+    and renamed into place so that readers never see a partial file.
+    Returns a list of (target filepath, filepaths) for every segment that
+    changed.
+
+    Segments are always renumbered contiguously from zero so that a later run
+    continues numbering correctly.
+    """
+
+    bins = plan_bins(files, target_bytes)
+    if len(bins) == len(files):
+        return []
+
+    moves = []
+    for segment, bin_ in enumerate(bins):
+        target_filepath = \
+            jpart.output.get_segment_filepath(base_filepath, segment)
+
+        filepaths = [filepath for _, filepath, _ in bin_]
+
+
+        # Only renumber
+
+        if len(filepaths) == 1:
+            if filepaths[0] != target_filepath:
+                os.replace(filepaths[0], target_filepath)
+
+                _rename_sidecar(filepaths[0], target_filepath)
+
+                moves.append((target_filepath, filepaths))
+
+            continue
+
+
+        # Merge. The target is either the first file in the bin or a file that
+        # belonged to an earlier bin and has already been removed.
+
+        path = os.path.dirname(target_filepath)
+
+        temp_filename = \
+            _TEMP_FILENAME_TEMPLATE.format(
+                os.path.basename(target_filepath),
+                os.getpid())
+
+        temp_filepath = os.path.join(path, temp_filename)
+
+        # If the files were indexed, the merged file will be, too
+        stride = _get_sidecar_stride(filepaths)
+
+        try:
+            with open(temp_filepath, 'wb', buffering=0) as f:
+                _concatenate(filepaths, f.fileno())
+                os.fsync(f.fileno())
+
+            os.replace(temp_filepath, target_filepath)
+
+        except:
+            if os.path.exists(temp_filepath) is True:
+                os.remove(temp_filepath)
+
+            raise
+
+        for filepath in filepaths:
+            sidecar_filepath = jpart.index.get_sidecar_filepath(filepath)
+            if os.path.exists(sidecar_filepath) is True:
+                os.remove(sidecar_filepath)
+
+            if filepath != target_filepath:
+                os.remove(filepath)
+
+        if stride is not None:
+            jpart.index.build_index(target_filepath, stride=stride)
+
+        moves.append((target_filepath, filepaths))
+
+
+    _LOGGER.info("Compacted [{}]: ({}) files into ({}).".format(
+                 base_filepath, len(files), len(bins)))
+
+    return moves
+
+
+def _compact_partition_star(arguments):
+    return compact_partition(*arguments)
+
+
+def _update_catalog(catalog_filepath, output_path, results):
+
+    catalog = jpart.catalog.Catalog(catalog_filepath, output_path)
+
+    try:
+        for moves in results:
+
+            # These have to be applied in order since a target can be a file
+            # that was merged away by an earlier move
+            for target_filepath, filepaths in moves:
+                rel_filepaths = [
+                    os.path.relpath(filepath, output_path)
+                    for filepath
+                    in filepaths
+                ]
+
+                catalog.replace_files(
+                    os.path.relpath(target_filepath, output_path),
+                    rel_filepaths)
+
+    finally:
+        catalog.close()
+
+
+def compact_output_path(
+        output_path, target_bytes=_DEFAULT_TARGET_BYTES, processes=None,
+        catalog_filename=jpart.catalog.DEFAULT_CATALOG_FILENAME):
+    """Compact every partition under an output path. This must not run while a
+    job is writing to the same path. If there's a catalog, it's updated to
+    match. Returns the number of partitions that were compacted and the number
+    of files that were removed.
+    """
+
+    partitions = find_partitions(output_path)
+
+    work = [
+        (base_filepath, files, target_bytes)
+        for base_filepath, files
+        in sorted(partitions.items())
+        if len(files) > 1
+    ]
+
+    if processes == 1 or len(work) <= 1:
+        results = [_compact_partition_star(arguments) for arguments in work]
+
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(_compact_partition_star, work)
+
+
+    catalog_filepath = \
+        jpart.catalog.get_catalog_filepath(output_path, catalog_filename)
+
+    if os.path.exists(catalog_filepath) is True:
+        _update_catalog(catalog_filepath, output_path, results)
+
+
+    compacted = 0
+    removed = 0
+    for moves in results:
+        if not moves:
+            continue
+
+        compacted += 1
+
+        for target_filepath, filepaths in moves:
+            removed += len(filepaths) - 1
+
+    return compacted, removed
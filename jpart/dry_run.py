@@ -0,0 +1,397 @@
+import logging
+import json
+import math
+import hashlib
+
+import jpart.rule
+import jpart.cache
+
+# 2^14 registers (16K of memory per rule) gives a standard error of about 1%
+_HLL_PRECISION = 14
+
+# The number of partitions we'll track individually (per rule) before we start
+# discarding the lightest ones
+_HEAVY_HITTERS_CAPACITY = 10000
+
+# Leave some descriptors for the input, logging, modules, etc..
+_RESERVED_DESCRIPTORS = 64
+
+# If partitions see fewer records than this, on average, then caching handles
+# buys us nothing
+_DIRECT_ENGINE_MAX_RECORDS_PER_PARTITION = 2
+
+# If every partition that's written to in a batch would get at least this
+# many records, on average, then grouping the writes is worth it
+_BATCH_ENGINE_MIN_RECORDS_PER_GROUP = 4
+
+_DEFAULT_TOP_N = 10
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _HyperLogLog(object):
+    """Approximate distinct-counter with a fixed memory footprint."""
+
+    def __init__(self, precision=_HLL_PRECISION):
+        self._precision = precision
+        self._count = 1 << precision
+        self._registers = bytearray(self._count)
+
+        self._value_bits = 64 - precision
+        self._value_mask = (1 << self._value_bits) - 1
+
+    def add(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+        h = int.from_bytes(digest, 'big')
+
+        index = h >> self._value_bits
+        rank = self._value_bits - (h & self._value_mask).bit_length() + 1
+
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def estimate(self):
+        m = self._count
+        alpha = 0.7213 / (1.0 + 1.079 / m)
+
+        z = 0.0
+        for rank in self._registers:
+            z += 2.0 ** -rank
+
+        estimate = alpha * m * m / z
+
+
+        # Small-range correction (linear counting)
+
+        zeros = self._registers.count(0)
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * math.log(m / zeros)
+
+
+        return int(round(estimate))
+
+
+class RuleEstimate(object):
+    """Tracks the partitions produced by one rule with bounded memory."""
+
+    def __init__(self, rule_name, capacity=_HEAVY_HITTERS_CAPACITY):
+        self._rule_name = rule_name
+        self._capacity = capacity
+
+        self._hll = _HyperLogLog()
+
+        # name -> [records, bytes]
+        self._partitions = {}
+
+        self._is_exact = True
+        self._bytes_error = 0
+
+        self._records = 0
+        self._bytes = 0
+
+    @property
+    def rule_name(self):
+        return self._rule_name
+
+    @property
+    def records(self):
+        return self._records
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    @property
+    def is_exact(self):
+        """Whether the distinct count and the heaviest partitions are exact."""
+
+        return self._is_exact
+
+    @property
+    def bytes_error(self):
+        """The most that the bytes of any of the heaviest partitions may be
+        undercounted by once we've had to discard partitions.
+        """
+
+        return self._bytes_error
+
+    @property
+    def distinct(self):
+        if self._is_exact is True:
+            return len(self._partitions)
+
+        return max(self._hll.estimate(), len(self._partitions))
+
+    @property
+    def average_bytes(self):
+        distinct = self.distinct
+        if distinct == 0:
+            return 0
+
+        return self._bytes // distinct
+
+    def add(self, name, size):
+        self._records += 1
+        self._bytes += size
+
+        try:
+            counters = self._partitions[name]
+
+        except KeyError:
+            self._hll.add(name)
+
+            self._partitions[name] = [1, size]
+
+            if len(self._partitions) > self._capacity * 2:
+                self._purge()
+
+        else:
+            counters[0] += 1
+            counters[1] += size
+
+    def _purge(self):
+        """Keep only the heaviest partitions. This is amortized over
+        `capacity` new partitions.
+        """
+
+        ordered = \
+            sorted(
+                self._partitions.items(),
+                key=lambda x: x[1][1],
+                reverse=True)
+
+        kept = ordered[:self._capacity]
+        dropped = ordered[self._capacity:]
+
+        self._bytes_error = max(self._bytes_error, dropped[0][1][1])
+        self._partitions = dict(kept)
+        self._is_exact = False
+
+    def get_heaviest(self, n):
+        """Return (name, records, bytes) for the N heaviest partitions."""
+
+        ordered = \
+            sorted(
+                self._partitions.items(),
+                key=lambda x: x[1][1],
+                reverse=True)
+
+        heaviest = [
+            (name, records, bytes_)
+            for name, (records, bytes_)
+            in ordered[:n]
+        ]
+
+        return heaviest
+
+
+class Plan(object):
+    def __init__(self, estimates, records, bytes_, descriptor_limit=None):
+        self._estimates = estimates
+        self._records = records
+        self._bytes = bytes_
+
+        if descriptor_limit is None:
+            descriptor_limit = _get_descriptor_limit()
+
+        self._descriptor_limit = descriptor_limit
+
+    @property
+    def estimates(self):
+        return self._estimates
+
+    @property
+    def records(self):
+        return self._records
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    @property
+    def total_distinct(self):
+        return sum(estimate.distinct for estimate in self._estimates)
+
+    @property
+    def recommended_capacity(self):
+        """All rules share one cache so this covers every partition if the
+        descriptor limit allows it.
+        """
+
+        available = self._descriptor_limit - _RESERVED_DESCRIPTORS
+        capacity = min(max(self.total_distinct, 1), max(available, 1))
+
+        return capacity
+
+    @property
+    def recommended_engine(self):
+        total_distinct = self.total_distinct
+        if total_distinct == 0:
+            return jpart.rule.ENGINE__CACHED
+
+        written = sum(estimate.records for estimate in self._estimates)
+        if written / total_distinct < _DIRECT_ENGINE_MAX_RECORDS_PER_PARTITION:
+            return jpart.rule.ENGINE__DIRECT
+
+        # Assume that the partitions share every batch evenly
+        written_per_batch = \
+            jpart.rule.DEFAULT_BATCH_SIZE * written / max(self._records, 1)
+
+        if written_per_batch / total_distinct >= \
+           _BATCH_ENGINE_MIN_RECORDS_PER_GROUP:
+            return jpart.rule.ENGINE__BATCH
+
+        return jpart.rule.ENGINE__CACHED
+
+
+def _get_descriptor_limit():
+
+    # Not available on all platforms
+    try:
+        import resource
+
+    except ImportError:
+        return jpart.cache._MAX_CACHED_RESOURCES + _RESERVED_DESCRIPTORS
+
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+
+    if soft == resource.RLIM_INFINITY:
+        return 2 ** 20
+
+    return soft
+
+
+def _get_size(line):
+    """The number of bytes that a line takes up on disk."""
+
+    if line.__class__ is str:
+        return len(line.encode('utf-8'))
+
+    return len(line)
+
+
+def plan_with_rules(rules, f, sample_size=None, descriptor_limit=None):
+    """Run the rules over the input and tally the partitions that would be
+    written. The line lengths stand in for the serialized sizes so nothing is
+    encoded, except for rules with a projection. If `sample_size` is given,
+    only that many records are scanned.
+    """
+
+    estimates = [RuleEstimate(rule.name) for rule in rules]
+    pairs = list(zip(rules, estimates))
+
+    records = 0
+    bytes_ = 0
+    for line in f:
+        if sample_size is not None and records >= sample_size:
+            break
+
+        record = json.loads(line)
+        size = _get_size(line)
+
+        records += 1
+        bytes_ += size
+
+        for rule, estimate in pairs:
+            values = rule.apply(record)
+            if values is None:
+                continue
+
+            rule_size = size
+            if rule.projection is not None:
+                rule_size = len(rule.serialize(record))
+
+            for phrases in rule.expand(values):
+                name = rule.get_partition_rel_filepath(phrases)
+                estimate.add(name, rule_size)
+
+
+        if records % 100000 == 0:
+            _LOGGER.info("Scanned ({}) records.".format(records))
+
+
+    plan = Plan(estimates, records, bytes_, descriptor_limit=descriptor_limit)
+    return plan
+
+
+def plan_with_config(
+        module_path, config, f, sample_size=None, descriptor_limit=None,
+        get_symbol_cb=None):
+
+    filter_mappings = \
+        jpart.rule._build_filters_with_config(
+            module_path,
+            config,
+            get_symbol_cb=get_symbol_cb)
+
+    try:
+        rules = \
+            jpart.rule._build_rules_with_config(
+                module_path,
+                config,
+                None,
+                filter_mappings=filter_mappings)
+
+        plan = \
+            plan_with_rules(
+                rules,
+                f,
+                sample_size=sample_size,
+                descriptor_limit=descriptor_limit)
+
+    finally:
+        jpart.rule._teardown_filters(filter_mappings)
+
+    return plan
+
+
+def format_plan(plan, top_n=_DEFAULT_TOP_N):
+
+    lines = []
+    lines.append(
+        "Scanned ({}) records ({}) bytes.".format(plan.records, plan.bytes))
+
+    for estimate in plan.estimates:
+        lines.append('')
+
+        if estimate.is_exact is True:
+            accuracy = 'exact'
+        else:
+            accuracy = 'approximate'
+
+        lines.append("Rule [{}]:".format(estimate.rule_name))
+        lines.append(
+            "  Distinct partitions: ({}) [{}]".format(
+            estimate.distinct, accuracy))
+
+        lines.append("  Matched records: ({})".format(estimate.records))
+        lines.append(
+            "  Bytes: ({}) total, ({}) average per partition".format(
+            estimate.bytes, estimate.average_bytes))
+
+        heaviest = estimate.get_heaviest(top_n)
+        if not heaviest:
+            continue
+
+        if estimate.bytes_error > 0:
+            lines.append(
+                "  Heaviest partitions (may be undercounted by up to ({}) "
+                "bytes):".format(estimate.bytes_error))
+
+        else:
+            lines.append("  Heaviest partitions:")
+
+        for name, records, bytes_ in heaviest:
+            lines.append(
+                "    {}: ({}) bytes, ({}) records".format(
+                name, bytes_, records))
+
+
+    lines.append('')
+    lines.append(
+        "Recommended cache capacity: ({})".format(plan.recommended_capacity))
+
+    lines.append(
+        "Recommended engine: [{}]".format(plan.recommended_engine))
+
+    return '\n'.join(lines) + '\n'
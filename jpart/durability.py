@@ -0,0 +1,177 @@
+import os
+import time
+import logging
+
+# Leave it to the OS
+DURABILITY__NONE = 'none'
+
+# Sync every dirty file together every so many seconds or bytes
+DURABILITY__PERIODIC = 'periodic'
+
+# Sync every file as it's closed
+DURABILITY__CLOSE = 'close'
+
+DURABILITIES = (
+    DURABILITY__NONE,
+    DURABILITY__PERIODIC,
+    DURABILITY__CLOSE,
+)
+
+_DEFAULT_INTERVAL_SECONDS = 5.0
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def sync_path(path):
+    """Sync a file or directory that we don't have open. Directories can't be
+    opened on every platform, in which case there's nothing that we can do.
+    """
+
+    try:
+        fd = os.open(path, os.O_RDONLY)
+
+    except (FileNotFoundError, PermissionError, IsADirectoryError):
+        return False
+
+    try:
+        os.fsync(fd)
+
+    except OSError:
+        return False
+
+    finally:
+        os.close(fd)
+
+    return True
+
+
+class SyncCoordinator(object):
+    """Decides when partition files get synced to disk. It's shared by every
+    `jpart.output.PartitionFile` so that periodic syncs cover all of the dirty
+    handles at once, along with the files that were closed since the last one
+    and the directories that new files were created in.
+    """
+
+    def __init__(
+            self, mode=DURABILITY__NONE, interval_seconds=None,
+            interval_bytes=None, do_sync_directories=True):
+
+        assert \
+            mode in DURABILITIES, \
+            "Durability not valid: [{}]".format(mode)
+
+        if mode == DURABILITY__PERIODIC and \
+           interval_seconds is None and interval_bytes is None:
+            interval_seconds = _DEFAULT_INTERVAL_SECONDS
+
+        self._mode = mode
+        self._interval_seconds = interval_seconds
+        self._interval_bytes = interval_bytes
+        self._do_sync_directories = do_sync_directories
+
+        # Open partition files with unsynced writes
+        self._dirty = set()
+
+        # Closed files with unsynced writes
+        self._pending_filepaths = set()
+
+        # Directories that have gained entries
+        self._pending_paths = set()
+
+        self._unsynced_bytes = 0
+        self._last_sync_time = time.monotonic()
+
+        self._syncs = 0
+        self._fsyncs = 0
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @property
+    def stats(self):
+        stats = {
+            'syncs': self._syncs,
+            'fsyncs': self._fsyncs,
+        }
+
+        return stats
+
+    def add_path(self, path):
+        """Register a directory that has gained an entry."""
+
+        if self._mode == DURABILITY__NONE or \
+           self._do_sync_directories is False:
+            return
+
+        self._pending_paths.add(path)
+
+    def opened(self, f, is_new):
+        if is_new is True:
+            self.add_path(os.path.dirname(f.filepath))
+
+    def written(self, f, bytes_):
+        if self._mode != DURABILITY__PERIODIC:
+            return
+
+        self._dirty.add(f)
+        self._unsynced_bytes += bytes_
+
+        if self._interval_bytes is not None and \
+           self._unsynced_bytes >= self._interval_bytes:
+            self.sync()
+
+        elif self._interval_seconds is not None and \
+             time.monotonic() - self._last_sync_time >= \
+                self._interval_seconds:
+            self.sync()
+
+    def closing(self, f):
+        """Called with the partition file's data flushed but before its handle
+        is closed.
+        """
+
+        if self._mode == DURABILITY__CLOSE:
+            f.sync()
+            self._fsyncs += 1
+
+            self._sync_paths()
+
+        elif self._mode == DURABILITY__PERIODIC and f in self._dirty:
+            self._dirty.remove(f)
+
+            # Syncing later through another descriptor covers the same file
+            self._pending_filepaths.add(f.filepath)
+
+    def _sync_paths(self):
+
+        for path in self._pending_paths:
+            if sync_path(path) is True:
+                self._fsyncs += 1
+
+        self._pending_paths.clear()
+
+    def sync(self):
+        """Sync everything that's outstanding."""
+
+        if self._mode == DURABILITY__NONE:
+            return
+
+        for f in self._dirty:
+            f.sync()
+            self._fsyncs += 1
+
+        for filepath in self._pending_filepaths:
+            if sync_path(filepath) is True:
+                self._fsyncs += 1
+
+        self._sync_paths()
+
+        self._dirty.clear()
+        self._pending_filepaths.clear()
+
+        self._unsynced_bytes = 0
+        self._last_sync_time = time.monotonic()
+        self._syncs += 1
+
+        _LOGGER.debug("Synced: {}".format(self.stats))
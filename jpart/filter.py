@@ -1,18 +1,101 @@
 
+import re
+import zlib
+import datetime
+import importlib
+import collections
+
 import riu.hierarchy
 
+DEFAULT_MEMOIZE_SIZE = 10000
+
+# Roughly what one remembered result holds
+_MEMO_ENTRY_BYTES = 256
+
+# References with this prefix are to filters that ship with this package
+_BUILTIN_REFERENCE_PREFIX = 'jpart.'
+
+SKIP_REASON_TIME__NOT_FOUND = 'time: not found'
+SKIP_REASON_TIME__NOT_VALID = 'time: not valid'
+
+SKIP_REASON_HASH__NOT_FOUND = 'hash: not found'
+
+GRANULARITY__YEAR = 'year'
+GRANULARITY__MONTH = 'month'
+GRANULARITY__DAY = 'day'
+GRANULARITY__HOUR = 'hour'
+GRANULARITY__MINUTE = 'minute'
+
+# Formats have to produce values that can be used in filenames
+_GRANULARITY_FORMATS = {
+    GRANULARITY__YEAR: '%Y',
+    GRANULARITY__MONTH: '%Y-%m',
+    GRANULARITY__DAY: '%Y-%m-%d',
+    GRANULARITY__HOUR: '%Y-%m-%dT%H',
+    GRANULARITY__MINUTE: '%Y-%m-%dT%H%M',
+}
+
+# The length of ISO-8601 prefix that determines the bucket, and the (start,
+# stop, separator) slices that the bucket is assembled from
+_GRANULARITY_PREFIXES = {
+    GRANULARITY__YEAR: (4, ((0, 4, ''),)),
+    GRANULARITY__MONTH: (7, ((0, 7, ''),)),
+    GRANULARITY__DAY: (10, ((0, 10, ''),)),
+    GRANULARITY__HOUR: (13, ((0, 10, ''), (11, 13, 'T'))),
+    GRANULARITY__MINUTE: (16, ((0, 10, ''), (11, 13, 'T'), (14, 16, ''))),
+}
+
+# Epoch times in the same unit share a bucket. Months and years aren't a
+# fixed length so days are as far as we can go.
+_GRANULARITY_SECONDS = {
+    GRANULARITY__YEAR: 86400,
+    GRANULARITY__MONTH: 86400,
+    GRANULARITY__DAY: 86400,
+    GRANULARITY__HOUR: 3600,
+    GRANULARITY__MINUTE: 60,
+}
+
+_EPOCH_UNIT_DIVISORS = {
+    's': 1,
+    'ms': 1000,
+    'us': 1000000,
+}
+
+_TIME_MEMO_SIZE = 1024
+
+# The fixed shape of an ISO-8601 timestamp (without an offset), which can stop
+# after any field
+_ISO_SHAPE_RE = \
+    re.compile(
+        r'[0-9]{4}(-[0-9]{2}(-[0-9]{2}([T ][0-9]{2}(:[0-9]{2}(:[0-9]{2}'
+        r'(\.[0-9]+)?)?)?)?)?)?')
+
+# The offset at the end of the time part of an ISO-8601 string
+_OFFSET_RE = re.compile(r'(Z|[+-][0-9]{2}(:?[0-9]{2})?)$')
+
+_DEFAULT_HASH_BUCKETS = 16
+
+# Returned by `get_values()` in place of the value of a record that should be
+# skipped
+SKIP = object()
+
 
 class SkipRuleException(Exception):
     def __init__(self, field_name, reason):
         self._field_name = field_name
         self._reason = reason
 
+        # These are raised for a lot of records, so the message is only
+        # formatted if somebody asks for it
+        super().__init__(field_name, reason)
+
+    def __str__(self):
         message = \
             "Skipping rule on account of value or lack of value for [{}]: " \
                 "{}".format(
-                self._field_name, reason)
+                self._field_name, self._reason)
 
-        super().__init__(message)
+        return message
 
     @property
     def field_name(self):
@@ -24,6 +107,24 @@ class SkipRuleException(Exception):
 
 
 class BaseFilter(object):
+    """Filters are built once per entry in the config's filter-mappings and
+    shared by every rule that references them.
+    """
+
+    def setup(self, config):
+        """Do any expensive initialization (like loading lookup tables). The
+        config is the "config" dictionary of the filter's entry, if any.
+        """
+
+        pass
+
+    def teardown(self):
+        """Release whatever `setup()` acquired. Called once processing is
+        done.
+        """
+
+        pass
+
     def get_value(self, name, record):
         """Value extractor if needed to be overridden with something more
         elaborate.
@@ -39,3 +140,459 @@ class BaseFilter(object):
         """Whether to skip this record for this rule."""
 
         return True
+
+    def get_values(self, name, records):
+        """Extract the values for a list of records. Override this if the
+        values can be produced more cheaply together than one at a time. A
+        record that should be skipped gets `SKIP`, or the `SkipRuleException`
+        that says why, instead of a value.
+        """
+
+        values = []
+        for record in records:
+            try:
+                value = self.get_value(name, record)
+
+            except SkipRuleException as e:
+                value = e
+
+            values.append(value)
+
+        return values
+
+    def does_qualify_batch(self, name, values):
+        """Return a list of booleans for a list of values. Override this if the
+        check can be done more cheaply together than one at a time.
+        """
+
+        qualifies = [
+            self.does_qualify(name, value)
+            for value
+            in values
+        ]
+
+        return qualifies
+
+
+class _Memo(object):
+    """A bounded LRU mapping that counts its hits and misses."""
+
+    def __init__(self, size):
+        self._size = size
+        self._entries = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_call(self, key, cb, *args):
+
+        try:
+            value = self._entries[key]
+
+        except KeyError:
+            pass
+
+        except TypeError:
+            # Unhashable, so not cacheable
+            return cb(*args)
+
+        else:
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+        self.misses += 1
+
+        value = cb(*args)
+
+        self._entries[key] = value
+        if len(self._entries) > self._size:
+            self._entries.popitem(last=False)
+
+        return value
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def memory_bytes(self):
+        return len(self._entries) * _MEMO_ENTRY_BYTES
+
+    def shrink(self):
+        """Halve the size, forgetting the oldest entries. Returns False if we
+        can't get any smaller.
+        """
+
+        if self._size <= 1:
+            return False
+
+        self._size //= 2
+
+        while len(self._entries) > self._size:
+            self._entries.popitem(last=False)
+
+        return True
+
+    @property
+    def stats(self):
+        lookups = self.hits + self.misses
+
+        stats = {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+        }
+
+        return stats
+
+
+class MemoizedFilter(BaseFilter):
+    """Wraps another filter and remembers what `does_qualify()` returned for
+    recent (name, value) pairs. If `do_memoize_value` is True, the wrapped
+    filter's `get_value()` must only depend on the raw value of the field, and
+    its results are remembered by that raw value, too.
+    """
+
+    def __init__(
+            self, filter_, size=DEFAULT_MEMOIZE_SIZE, do_memoize_value=False):
+
+        assert \
+            size > 0, \
+            "Memoize size must be at least one: ({})".format(size)
+
+        self._filter = filter_
+        self._do_memoize_value = do_memoize_value
+
+        self._qualify_memo = _Memo(size)
+
+        self._value_memo = None
+        if do_memoize_value is True:
+            self._value_memo = _Memo(size)
+
+    @property
+    def filter(self):
+        return self._filter
+
+    @property
+    def memory_bytes(self):
+        memory_bytes = self._qualify_memo.memory_bytes
+
+        if self._value_memo is not None:
+            memory_bytes += self._value_memo.memory_bytes
+
+        return memory_bytes
+
+    def shrink(self):
+        """Halve the memos. Returns False if they can't get any smaller."""
+
+        is_shrunk = self._qualify_memo.shrink()
+
+        if self._value_memo is not None:
+            is_shrunk = self._value_memo.shrink() or is_shrunk
+
+        return is_shrunk
+
+    def setup(self, config):
+        self._filter.setup(config)
+
+    def teardown(self):
+        self._filter.teardown()
+
+    @property
+    def stats(self):
+        stats = {
+            'qualify': self._qualify_memo.stats,
+        }
+
+        if self._value_memo is not None:
+            stats['value'] = self._value_memo.stats
+
+        return stats
+
+    def get_value(self, name, record):
+        if self._value_memo is None:
+            return self._filter.get_value(name, record)
+
+        try:
+            raw = \
+                riu.hierarchy.get_value_from_hierarchy_with_string_reference(
+                    record, name)
+
+        except KeyError:
+            # Leave it to the filter to decide what a missing field means
+            return self._filter.get_value(name, record)
+
+        value = \
+            self._value_memo.get_or_call(
+                (name, raw),
+                self._filter.get_value,
+                name,
+                record)
+
+        return value
+
+    def get_values(self, name, records):
+        if self._value_memo is None:
+            return self._filter.get_values(name, records)
+
+        return super().get_values(name, records)
+
+    def does_qualify(self, name, value):
+
+        does_qualify = \
+            self._qualify_memo.get_or_call(
+                (name, value),
+                self._filter.does_qualify,
+                name,
+                value)
+
+        return does_qualify
+
+
+def is_builtin_reference(reference):
+    return reference.startswith(_BUILTIN_REFERENCE_PREFIX)
+
+
+def get_builtin_symbol(reference):
+    """Resolve a reference to something that ships with this package, like
+    "jpart.filter.TimeBucketFilter".
+    """
+
+    module_name, symbol_name = reference.rsplit('.', 1)
+
+    module = importlib.import_module(module_name)
+    return getattr(module, symbol_name)
+
+
+def _get_offset(s):
+    """Return the offset of an ISO-8601 string as written, or an empty string
+    if it has none.
+    """
+
+    # Only the time can have one (the date has hyphens of its own)
+    m = _OFFSET_RE.search(s, 11)
+    if m is None:
+        return ''
+
+    return m.group(1)
+
+
+def _is_utc_offset(offset):
+    """Whether an offset (from `_get_offset()`) is missing or zero."""
+
+    if offset == '' or offset == 'Z':
+        return True
+
+    return offset[1:].replace(':', '').strip('0') == ''
+
+
+class TimeBucketFilter(BaseFilter):
+    """Reduces a timestamp (an ISO-8601 string or an epoch number) to the
+    time bucket that it belongs to, in UTC. Config:
+
+        granularity: year, month, day (default), hour, or minute
+        format: a `strftime` format to use rather than the default for the
+                granularity. Results are then only remembered for exact
+                values, since the format can be finer than the granularity.
+        epoch_unit: s (default), ms, or us
+
+    ISO-8601 strings that are already in UTC (or have no offset) are bucketed
+    by slicing them. Everything else is parsed. Recent results are remembered
+    since neighboring records tend to share a bucket.
+    """
+
+    def __init__(self):
+        self.setup({})
+
+    def setup(self, config):
+        granularity = config.get('granularity', GRANULARITY__DAY)
+
+        assert \
+            granularity in _GRANULARITY_FORMATS, \
+            "Granularity not valid: [{}]".format(granularity)
+
+        epoch_unit = config.get('epoch_unit', 's')
+
+        assert \
+            epoch_unit in _EPOCH_UNIT_DIVISORS, \
+            "Epoch unit not valid: [{}]".format(epoch_unit)
+
+        self._format = config.get('format')
+        self._is_custom = self._format is not None
+
+        # Custom formats always take the slow path
+        self._prefix_length = None
+        self._slices = None
+        if self._format is None:
+            self._format = _GRANULARITY_FORMATS[granularity]
+            self._prefix_length, self._slices = \
+                _GRANULARITY_PREFIXES[granularity]
+
+        self._unit_seconds = _GRANULARITY_SECONDS[granularity]
+        self._epoch_divisor = _EPOCH_UNIT_DIVISORS[epoch_unit]
+
+        self._memo = {}
+
+    def _remember(self, key, bucket):
+        if len(self._memo) >= _TIME_MEMO_SIZE:
+            self._memo.clear()
+
+        self._memo[key] = bucket
+
+    def _get_bucket_with_slices(self, s, length):
+        """The fast path, for strings in UTC. The length excludes the offset.
+        Returns None if the string isn't in the expected shape.
+        """
+
+        prefix_length = self._prefix_length
+        if prefix_length is None or length < prefix_length:
+            return None
+
+        if _ISO_SHAPE_RE.fullmatch(s, 0, length) is None:
+            return None
+
+        parts = []
+        for start, stop, separator in self._slices:
+            if start > 0:
+                parts.append(separator)
+
+            parts.append(s[start:stop])
+
+        return ''.join(parts)
+
+    def _get_bucket_with_datetime(self, dt):
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(datetime.timezone.utc)
+
+        return dt.strftime(self._format)
+
+    def get_bucket(self, value):
+        """Return the bucket for a timestamp, or None if it's not one."""
+
+        if value.__class__ is str:
+            offset = _get_offset(value)
+
+            if _is_utc_offset(offset) is True:
+                bucket = \
+                    self._get_bucket_with_slices(
+                        value,
+                        len(value) - len(offset))
+
+                if bucket is not None:
+                    return bucket
+
+            # Everything that can affect a default bucket is in the first
+            # sixteen characters and the offset
+            if self._is_custom is True:
+                key = value
+
+            else:
+                key = (value[:16], offset)
+
+            try:
+                return self._memo[key]
+
+            except KeyError:
+                pass
+
+            try:
+                dt = datetime.datetime.fromisoformat(value)
+
+            except ValueError:
+                return None
+
+            bucket = self._get_bucket_with_datetime(dt)
+            self._remember(key, bucket)
+
+            return bucket
+
+        if isinstance(value, (int, float)) is False or \
+           isinstance(value, bool) is True:
+            return None
+
+        seconds = value / self._epoch_divisor
+
+        if self._is_custom is True:
+            key = value
+            timestamp = seconds
+
+        else:
+            key = int(seconds // self._unit_seconds)
+            timestamp = key * self._unit_seconds
+
+        try:
+            return self._memo[key]
+
+        except KeyError:
+            pass
+
+        dt = \
+            datetime.datetime.fromtimestamp(
+                timestamp,
+                tz=datetime.timezone.utc)
+
+        bucket = self._get_bucket_with_datetime(dt)
+        self._remember(key, bucket)
+
+        return bucket
+
+    def get_value(self, name, record):
+        try:
+            value = super().get_value(name, record)
+
+        except KeyError:
+            raise SkipRuleException(name, SKIP_REASON_TIME__NOT_FOUND)
+
+        bucket = self.get_bucket(value)
+        if bucket is None:
+            raise SkipRuleException(name, SKIP_REASON_TIME__NOT_VALID)
+
+        return bucket
+
+
+def get_stable_hash(value):
+    """A hash of the value's string form that's the same in every process
+    (unlike `hash()`, which is salted per process).
+    """
+
+    return zlib.crc32(str(value).encode('utf-8'))
+
+
+class HashBucketFilter(BaseFilter):
+    """Maps a value to one of a fixed number of buckets so that the number of
+    partitions doesn't grow with the number of distinct values. Buckets are
+    zero-padded so that they sort. Config:
+
+        buckets: the number of buckets (default 16)
+    """
+
+    def __init__(self):
+        self.setup({})
+
+    def setup(self, config):
+        buckets = config.get('buckets', _DEFAULT_HASH_BUCKETS)
+
+        assert \
+            buckets > 0, \
+            "Bucket count must be at least one: ({})".format(buckets)
+
+        self._buckets = buckets
+
+        width = len(str(buckets - 1))
+        self._template = '{:0' + str(width) + 'd}'
+
+    def get_bucket(self, value):
+        bucket = get_stable_hash(value) % self._buckets
+        return self._template.format(bucket)
+
+    def get_value(self, name, record):
+        try:
+            value = super().get_value(name, record)
+
+        except KeyError:
+            raise SkipRuleException(name, SKIP_REASON_HASH__NOT_FOUND)
+
+        return self.get_bucket(value)
@@ -0,0 +1,281 @@
+import os
+import sys
+import json
+import array
+import bisect
+import logging
+
+# The sidecar is a flat sequence of little-endian (record number, byte offset)
+# pairs of unsigned 64-bit integers. There's an entry for every record whose
+# number is a multiple of the stride.
+_ENTRY_TYPECODE = 'Q'
+_SIDECAR_SUFFIX = '.idx'
+_TEMP_SUFFIX = '.tmp'
+
+DEFAULT_STRIDE = 1000
+
+_READ_CHUNK_SIZE = 1024 * 1024
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def get_sidecar_filepath(filepath):
+    return filepath + _SIDECAR_SUFFIX
+
+
+def _get_entries_with_file(f):
+
+    entries = array.array(_ENTRY_TYPECODE)
+    entries.frombytes(f.read())
+
+    if sys.byteorder == 'big':
+        entries.byteswap()
+
+    return entries
+
+
+def load_index(filepath):
+    """Return the entries for a partition file as a flat array of (record,
+    offset) pairs. The array is empty if there's no sidecar.
+    """
+
+    sidecar_filepath = get_sidecar_filepath(filepath)
+
+    try:
+        with open(sidecar_filepath, 'rb') as f:
+            return _get_entries_with_file(f)
+
+    except FileNotFoundError:
+        return array.array(_ENTRY_TYPECODE)
+
+
+def _write_entries(f, entries):
+
+    if sys.byteorder == 'big':
+        entries = array.array(_ENTRY_TYPECODE, entries)
+        entries.byteswap()
+
+    entries.tofile(f)
+
+
+def get_stride(entries):
+    """Infer the stride that an index was written with."""
+
+    if len(entries) < 4:
+        return DEFAULT_STRIDE
+
+    return entries[2] - entries[0]
+
+
+def count_records(filepath, entries=None):
+    """Count the records in a partition file, only reading the part of it
+    after the last indexed record if there's a sidecar.
+    """
+
+    if entries is None:
+        entries = load_index(filepath)
+
+    if entries:
+        records = entries[-2]
+        offset = entries[-1]
+
+    else:
+        records = 0
+        offset = 0
+
+    with open(filepath, 'rb') as f:
+        f.seek(offset)
+
+        while True:
+            chunk = f.read(_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+
+            records += chunk.count(b'\n')
+
+    return records
+
+
+def _index_chunk(entries, data, records_written, bytes_written, next_, stride):
+    """Add entries for the records that start in the chunk. Returns the number
+    of the next record that needs an entry.
+    """
+
+    position = 0
+    record = records_written
+    len_ = len(data)
+    while True:
+        if record == next_:
+            entries.append(record)
+            entries.append(bytes_written + position)
+
+            next_ += stride
+
+        end = data.find(b'\n', position)
+        if end == -1:
+            break
+
+        position = end + 1
+        record += 1
+
+        if position == len_:
+            break
+
+    return next_
+
+
+class IndexWriter(object):
+    """Collects index entries for one partition file as records are written
+    to it. Entries are appended to the sidecar whenever we're flushed.
+    """
+
+    def __init__(self, filepath, records_written, stride=DEFAULT_STRIDE):
+        self._sidecar_filepath = get_sidecar_filepath(filepath)
+        self._stride = stride
+
+        # The number of the next record that gets an entry
+        self._next = -(-records_written // stride) * stride
+
+        self._entries = array.array(_ENTRY_TYPECODE)
+
+    def add(self, data, records_written, bytes_written):
+        """Register a chunk of whole records that is about to be written at the
+        given position.
+        """
+
+        if self._next - records_written >= data.count(b'\n'):
+            return
+
+        self._next = \
+            _index_chunk(
+                self._entries,
+                data,
+                records_written,
+                bytes_written,
+                self._next,
+                self._stride)
+
+    @property
+    def memory_bytes(self):
+        """The size of the entries that haven't been written yet."""
+
+        return len(self._entries) * self._entries.itemsize
+
+    def flush(self):
+        if not self._entries:
+            return
+
+        with open(self._sidecar_filepath, 'ab') as f:
+            _write_entries(f, self._entries)
+
+        del self._entries[:]
+
+
+def _index_file(f, records, offset, stride):
+    """Return entries for the records from the current position of the file
+    on, where the given number of records and bytes precede it.
+    """
+
+    entries = array.array(_ENTRY_TYPECODE)
+
+    next_ = -(-records // stride) * stride
+    while True:
+        chunk = f.read(_READ_CHUNK_SIZE)
+        if not chunk:
+            break
+
+        # A record that started in the previous chunk will already have been
+        # considered
+        next_ = _index_chunk(entries, chunk, records, offset, next_, stride)
+
+        records += chunk.count(b'\n')
+        offset += len(chunk)
+
+    return entries
+
+
+def build_index(filepath, stride=DEFAULT_STRIDE):
+    """Build the sidecar for an existing partition file from scratch. The
+    sidecar is swapped into place atomically.
+    """
+
+    with open(filepath, 'rb') as f:
+        entries = _index_file(f, 0, 0, stride)
+
+    sidecar_filepath = get_sidecar_filepath(filepath)
+    temp_filepath = sidecar_filepath + _TEMP_SUFFIX
+
+    with open(temp_filepath, 'wb') as f:
+        _write_entries(f, entries)
+
+    os.replace(temp_filepath, sidecar_filepath)
+
+    return entries
+
+
+def extend_index(filepath, records, offset, stride=DEFAULT_STRIDE):
+    """Add entries to the sidecar of a partition file for the records that
+    were appended at the given offset, where the given number of records
+    precede them. Only the appended part of the file is read.
+    """
+
+    with open(filepath, 'rb') as f:
+        f.seek(offset)
+        entries = _index_file(f, records, offset, stride)
+
+    if entries:
+        with open(get_sidecar_filepath(filepath), 'ab') as f:
+            _write_entries(f, entries)
+
+    return entries
+
+
+def iterate_lines(filepath, start, stop=None):
+    """Yield the raw lines for records [start, stop) of a partition file,
+    seeking as close to the first one as the index allows.
+    """
+
+    entries = load_index(filepath)
+
+    records = entries[0::2]
+    i = bisect.bisect_right(records, start) - 1
+
+    if i >= 0:
+        record = records[i]
+        offset = entries[i * 2 + 1]
+
+    else:
+        record = 0
+        offset = 0
+
+    with open(filepath, 'rb') as f:
+        f.seek(offset)
+
+        for line in f:
+            if stop is not None and record >= stop:
+                break
+
+            if record >= start:
+                yield line
+
+            record += 1
+
+
+def iterate_records(filepath, start, stop=None):
+    """Yield the decoded records [start, stop) of a partition file."""
+
+    for line in iterate_lines(filepath, start, stop=stop):
+        yield json.loads(line)
+
+
+def get_record(filepath, n):
+    """Return record N of a partition file. Raises `IndexError` if there
+    aren't that many records.
+    """
+
+    for record in iterate_records(filepath, n, stop=n + 1):
+        return record
+
+    raise \
+        IndexError(
+            "Partition file [{}] has no record ({}).".format(filepath, n))
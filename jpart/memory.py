@@ -0,0 +1,194 @@
+import logging
+
+_SIZE_MULTIPLIERS = {
+    'k': 1024,
+    'm': 1024 ** 2,
+    'g': 1024 ** 3,
+}
+
+# Handle capacity isn't lowered beyond this
+_MIN_CAPACITY = 4
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def parse_size(text):
+    """Parse a number of bytes with an optional K, M, or G suffix (binary
+    multiples).
+    """
+
+    text = text.strip()
+
+    multiplier = _SIZE_MULTIPLIERS.get(text[-1:].lower())
+    if multiplier is not None:
+        text = text[:-1]
+
+    else:
+        multiplier = 1
+
+    try:
+        size = int(float(text) * multiplier)
+
+    except ValueError:
+        raise \
+            ValueError(
+                "Size not valid: [{}]".format(text))
+
+    return size
+
+
+class MemoryGovernor(object):
+    """Keeps the approximate number of bytes held by the buffers, caches, and
+    handles that are registered with it under a limit. Every consumer reports
+    its `memory_bytes`. When we're checked and find that we're over, we shed
+    in this order until we're back under: flush the buffers (`flush()`),
+    shrink the caches (`shrink()`, which returns False once it can't), and
+    then lower the capacity of the handle caches
+    (`jpart.cache.CachedResources`). What's shed stays shed.
+    """
+
+    def __init__(self, limit_bytes, min_capacity=_MIN_CAPACITY):
+
+        assert \
+            limit_bytes > 0, \
+            "Memory limit must be positive: ({})".format(limit_bytes)
+
+        self._limit_bytes = limit_bytes
+        self._min_capacity = min_capacity
+
+        self._buffers = []
+        self._caches = []
+        self._handles = []
+
+        self._checks = 0
+        self._peak_bytes = 0
+        self._flushes = 0
+        self._cache_shrinks = 0
+        self._handle_shrinks = 0
+        self._overruns = 0
+
+    @property
+    def limit_bytes(self):
+        return self._limit_bytes
+
+    @property
+    def held_bytes(self):
+
+        # A consumer can be registered more than once (like a handle cache,
+        # which also buffers)
+        consumers = {
+            id(consumer): consumer
+            for consumer
+            in self._buffers + self._caches + self._handles
+        }
+
+        held_bytes = sum(
+            consumer.memory_bytes
+            for consumer
+            in consumers.values()
+        )
+
+        return held_bytes
+
+    @property
+    def stats(self):
+        stats = {
+            'limit_bytes': self._limit_bytes,
+            'held_bytes': self.held_bytes,
+            'peak_bytes': self._peak_bytes,
+            'checks': self._checks,
+            'flushes': self._flushes,
+            'cache_shrinks': self._cache_shrinks,
+            'handle_shrinks': self._handle_shrinks,
+            'overruns': self._overruns,
+        }
+
+        return stats
+
+    def add_buffer(self, consumer):
+        self._buffers.append(consumer)
+
+    def add_cache(self, consumer):
+        self._caches.append(consumer)
+
+    def add_handles(self, cached_resources):
+        self._handles.append(cached_resources)
+
+    def _shrink_caches(self):
+        """Halve every cache once. Returns whether any of them shrank."""
+
+        is_shrunk = False
+        for cache in self._caches:
+            if cache.shrink() is True:
+                self._cache_shrinks += 1
+                is_shrunk = True
+
+        return is_shrunk
+
+    def _shrink_handles(self):
+        """Halve the capacity of every handle cache once. Returns whether any
+        of them shrank.
+        """
+
+        is_shrunk = False
+        for cached_resources in self._handles:
+            capacity = cached_resources.capacity
+            if capacity <= self._min_capacity:
+                continue
+
+            capacity = max(self._min_capacity, capacity // 2)
+
+            _LOGGER.info("Lowering handle capacity to ({}).".format(capacity))
+            cached_resources.set_capacity(capacity)
+
+            self._handle_shrinks += 1
+            is_shrunk = True
+
+        return is_shrunk
+
+    def check(self):
+        """Shed whatever it takes to get under the limit. Returns whether we
+        had to shed anything.
+        """
+
+        self._checks += 1
+
+        held_bytes = self.held_bytes
+        self._peak_bytes = max(self._peak_bytes, held_bytes)
+
+        if held_bytes <= self._limit_bytes:
+            return False
+
+
+        # Flush buffers
+
+        for consumer in self._buffers:
+            consumer.flush()
+
+        self._flushes += 1
+
+        if self.held_bytes <= self._limit_bytes:
+            return True
+
+
+        # Shrink caches
+
+        while self._shrink_caches() is True:
+            if self.held_bytes <= self._limit_bytes:
+                return True
+
+
+        # Lower the open-handle count
+
+        while self._shrink_handles() is True:
+            if self.held_bytes <= self._limit_bytes:
+                return True
+
+
+        self._overruns += 1
+
+        _LOGGER.warning("Memory still over the limit after shedding: "
+                        "({}) > ({})".format(
+                        self.held_bytes, self._limit_bytes))
+
+        return True
@@ -0,0 +1,391 @@
+import io
+import os
+import logging
+import functools
+
+import jpart.index
+import jpart.utility
+
+_SEGMENT_FILENAME_TEMPLATE = '{}-{:05d}{}'
+
+# Roughly what an open partition file holds: its write buffer plus the objects
+# around it
+HANDLE_BYTES = io.DEFAULT_BUFFER_SIZE + 1024
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def get_segment_filepath(filepath, segment):
+    """The first segment has the partition's own filename. Later ones get a
+    number inserted before the extension.
+    """
+
+    if segment == 0:
+        return filepath
+
+    root, extension = os.path.splitext(filepath)
+
+    segment_filepath = \
+        _SEGMENT_FILENAME_TEMPLATE.format(root, segment, extension)
+
+    return segment_filepath
+
+
+class SegmentState(object):
+    """What we know about the current segment of one partition. This outlives
+    the handle so that a partition that is evicted from the cache and then
+    reopened doesn't need to be rediscovered.
+    """
+
+    __slots__ = ('segment', 'bytes_written', 'records_written')
+
+    def __init__(self, segment=0, bytes_written=0, records_written=0):
+        self.segment = segment
+        self.bytes_written = bytes_written
+        self.records_written = records_written
+
+
+def probe_segment_state(filepath, do_count_records=False):
+    """Find the last segment left by a previous run so that we continue
+    appending to it (and numbering after it).
+    """
+
+    segment = 0
+    while os.path.exists(get_segment_filepath(filepath, segment + 1)) is True:
+        segment += 1
+
+    segment_filepath = get_segment_filepath(filepath, segment)
+
+    try:
+        bytes_written = os.path.getsize(segment_filepath)
+
+    except FileNotFoundError:
+        return SegmentState()
+
+    records_written = 0
+    if do_count_records is True and bytes_written > 0:
+        records_written = jpart.index.count_records(segment_filepath)
+
+    state = SegmentState(segment, bytes_written, records_written)
+    return state
+
+
+class PartitionFile(object):
+    """An append-only partition file that keeps track of how much has been
+    written to it, and that rolls over to a new segment once it passes the
+    byte or record threshold. Rolling only ever happens between records. If
+    an index stride is given, every segment gets a sidecar index (see
+    `jpart.index`) that's built as we write. If a report callback is given, it
+    is called with the segment filepath and the number of records and bytes
+    written to it whenever we're flushed or a segment is closed. If a
+    `jpart.durability.SyncCoordinator` is given, it decides when we're synced.
+    """
+
+    def __init__(
+            self, filepath, state=None, max_bytes=None, max_records=None,
+            index_stride=None, report_cb=None,
+            opener=jpart.utility.RESOURCE_APPEND_BINARY_OPENER, syncer=None):
+
+        if state is None:
+            state = SegmentState()
+
+        self._filepath = filepath
+        self._state = state
+        self._max_bytes = max_bytes
+        self._max_records = max_records
+        self._index_stride = index_stride
+        self._report_cb = report_cb
+        self._opener = opener
+        self._syncer = syncer
+
+        self._index = None
+
+        # What the segment looked like the last time we reported it
+        self._reported_records = 0
+        self._reported_bytes = 0
+
+        self._is_rolling = max_bytes is not None or max_records is not None
+        self._is_at_boundary = True
+
+        self._f = self._open()
+
+    @property
+    def filepath(self):
+        """The path of the segment currently being written."""
+
+        return get_segment_filepath(self._filepath, self._state.segment)
+
+    @property
+    def base_filepath(self):
+        return self._filepath
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def memory_bytes(self):
+        memory_bytes = HANDLE_BYTES
+
+        if self._index is not None:
+            memory_bytes += self._index.memory_bytes
+
+        return memory_bytes
+
+    def _open(self):
+        filepath = self.filepath
+        f = self._opener(filepath)
+
+        # Append-mode handles are positioned at the end so this picks up
+        # anything that a previous run wrote without a `stat`
+        self._state.bytes_written = f.tell()
+
+        self._reported_records = self._state.records_written
+        self._reported_bytes = self._state.bytes_written
+
+        if self._index_stride is not None:
+            self._index = \
+                jpart.index.IndexWriter(
+                    filepath,
+                    self._state.records_written,
+                    stride=self._index_stride)
+
+        if self._syncer is not None:
+            is_new = self._state.bytes_written == 0
+            self._syncer.opened(self, is_new)
+
+        return f
+
+    def _report(self):
+        if self._report_cb is None:
+            return
+
+        state = self._state
+
+        records = state.records_written - self._reported_records
+        bytes_ = state.bytes_written - self._reported_bytes
+
+        if bytes_ == 0:
+            return
+
+        self._report_cb(self.filepath, records, bytes_)
+
+        self._reported_records = state.records_written
+        self._reported_bytes = state.bytes_written
+
+    def _close(self):
+        if self._syncer is not None:
+            self._f.flush()
+            self._syncer.closing(self)
+
+        self._f.close()
+
+        if self._index is not None:
+            self._index.flush()
+
+        self._report()
+
+    def _roll(self):
+        self._close()
+
+        self._state.segment += 1
+        self._state.bytes_written = 0
+        self._state.records_written = 0
+
+        _LOGGER.info("Rolling: [{}]".format(self.filepath))
+
+        self._f = self._open()
+
+    def _is_full(self):
+        if self._is_at_boundary is False:
+            return False
+
+        state = self._state
+
+        if self._max_bytes is not None and \
+           state.bytes_written >= self._max_bytes:
+            return True
+
+        if self._max_records is not None and \
+           state.records_written >= self._max_records:
+            return True
+
+        return False
+
+    def _get_cut(self, data):
+        """Return how much of the data belongs in the current segment. This is
+        always the whole data or a prefix that ends on a record boundary.
+        """
+
+        state = self._state
+        max_bytes = self._max_bytes
+        max_records = self._max_records
+
+
+        # Fast path: nothing crosses a threshold
+
+        len_ = len(data)
+        records = data.count(b'\n')
+
+        if (max_bytes is None or state.bytes_written + len_ < max_bytes) and \
+           (max_records is None or \
+            state.records_written + records < max_records):
+            return len_
+
+
+        # Find the record that crosses
+
+        records_written = state.records_written
+        position = 0
+        while position < len_:
+            end = data.find(b'\n', position)
+            if end == -1:
+                break
+
+            position = end + 1
+            records_written += 1
+
+            if max_bytes is not None and \
+               state.bytes_written + position >= max_bytes:
+                return position
+
+            if max_records is not None and records_written >= max_records:
+                return position
+
+        return len_
+
+    def _write(self, data):
+        if self._index is not None:
+            self._index.add(
+                data,
+                self._state.records_written,
+                self._state.bytes_written)
+
+        self._f.write(data)
+
+        self._state.bytes_written += len(data)
+        self._state.records_written += data.count(b'\n')
+
+        if self._syncer is not None:
+            self._syncer.written(self, len(data))
+
+    def write(self, data):
+        if data.__class__ is str:
+            data = data.encode('utf-8')
+
+        if self._is_rolling is False:
+            self._write(data)
+            return
+
+        while data:
+            if self._is_full() is True:
+                self._roll()
+
+            cut = self._get_cut(data)
+
+            self._write(data[:cut])
+            self._is_at_boundary = data[cut - 1:cut] == b'\n'
+
+            data = data[cut:]
+
+    def flush(self):
+        self._f.flush()
+
+        if self._index is not None:
+            self._index.flush()
+
+        self._report()
+
+    def sync(self):
+        """Make sure that everything written so far is on disk."""
+
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self):
+        self._close()
+
+
+class PartitionFaultHandler(object):
+    """Opens `PartitionFile` resources for a `jpart.cache.CachedResources`.
+    Names are relative to the output path.
+    """
+
+    def __init__(
+            self, output_path, max_bytes=None, max_records=None,
+            index_stride=None, catalog=None, syncer=None):
+
+        self._output_path = output_path
+        self._max_bytes = max_bytes
+        self._max_records = max_records
+        self._index_stride = index_stride
+        self._catalog = catalog
+        self._syncer = syncer
+
+        self._is_rolling = max_bytes is not None or max_records is not None
+
+        # Appending to an indexed file means that we need to know how many
+        # records are already in it
+        self._do_count_records = \
+            max_records is not None or index_stride is not None
+
+        self._created_paths = jpart.utility.CreatedPaths()
+
+        # name -> SegmentState
+        self._states = {}
+
+    @property
+    def output_path(self):
+        return self._output_path
+
+    def _get_state(self, name, filepath):
+
+        try:
+            return self._states[name]
+
+        except KeyError:
+            pass
+
+        if self._is_rolling is True or self._do_count_records is True:
+            state = \
+                probe_segment_state(
+                    filepath,
+                    do_count_records=self._do_count_records)
+
+        else:
+            state = SegmentState()
+
+        self._states[name] = state
+        return state
+
+    def __call__(self, name):
+        filepath = os.path.join(self._output_path, name)
+
+        _LOGGER.info("Opening: [{}]".format(name))
+
+        # Every directory that we create is a new entry in its parent
+        path = os.path.dirname(filepath)
+        for created_path in self._created_paths.ensure(path):
+            if self._syncer is not None:
+                parent_path = os.path.dirname(created_path) or os.curdir
+                self._syncer.add_path(parent_path)
+
+        state = self._get_state(name, filepath)
+
+        # Only partitions are cataloged (not, e.g., the unmatched records)
+        report_cb = None
+        if self._catalog is not None and \
+           self._catalog.is_registered(name) is True:
+            report_cb = functools.partial(self._catalog.add, name)
+
+        f = \
+            PartitionFile(
+                filepath,
+                state=state,
+                max_bytes=self._max_bytes,
+                max_records=self._max_records,
+                index_stride=self._index_stride,
+                report_cb=report_cb,
+                syncer=self._syncer)
+
+        return f
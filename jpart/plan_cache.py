@@ -0,0 +1,256 @@
+import os
+import sys
+import pickle
+import marshal
+import hashlib
+import logging
+import builtins
+
+import jpart.filter
+
+_CACHE_PATH_ENVIRONMENT_NAME = 'JPART_CACHE_PATH'
+_DEFAULT_CACHE_PATH = os.path.join('~', '.cache', 'jpart')
+
+_ENTRY_SUFFIX = '.plan'
+
+# Entries written by another version of Python, or another version of this
+# format, are ignored
+_FORMAT_VERSION = 1
+_CACHE_KEY_PREFIX = \
+    '{}:{}:'.format(_FORMAT_VERSION, sys.implementation.cache_tag)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def get_cache_path():
+    cache_path = \
+        os.environ.get(
+            _CACHE_PATH_ENVIRONMENT_NAME,
+            os.path.expanduser(_DEFAULT_CACHE_PATH))
+
+    return cache_path
+
+
+def _get_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_module_filepath(root_module_path, reference):
+    """Translate a filter reference to the file that defines it, the same way
+    that `riu.plugin` does. Returns the filepath and the symbol name.
+    """
+
+    package_and_module, symbol_name = reference.rsplit('.', 1)
+
+    rel_filepath = package_and_module.replace('.', os.sep) + '.py'
+    filepath = os.path.join(root_module_path, rel_filepath)
+
+    return filepath, symbol_name
+
+
+def _get_references(config):
+
+    references = []
+    for reference in config.get('filter_mappings', {}).values():
+
+        # Either a reference or a dictionary with a reference and options
+        if isinstance(reference, dict) is True:
+            reference = reference['reference']
+
+        # These are imported rather than compiled
+        if jpart.filter.is_builtin_reference(reference) is True:
+            continue
+
+        references.append(reference)
+
+    return references
+
+
+class CompiledPlan(object):
+    """A parsed config along with the compiled code of every module that its
+    filters reference. `get_symbol` can stand in for
+    `riu.plugin.get_module_symbol_with_reference`.
+    """
+
+    def __init__(self, config, code_objects, is_hit):
+        self._config = config
+        self._is_hit = is_hit
+
+        # module filepath -> code object
+        self._code_objects = code_objects
+
+        # module filepath -> globals
+        self._modules = {}
+
+    @property
+    def config(self):
+        return self._config
+
+    @property
+    def is_hit(self):
+        """Whether this was loaded from the cache."""
+
+        return self._is_hit
+
+    def get_symbol(self, root_module_path, reference):
+        filepath, symbol_name = \
+            get_module_filepath(root_module_path, reference)
+
+        try:
+            g = self._modules[filepath]
+
+        except KeyError:
+            pass
+
+        else:
+            return g[symbol_name]
+
+        code = self._code_objects[filepath]
+
+        g = {
+            '__name__': os.path.splitext(os.path.basename(filepath))[0],
+            '__file__': filepath,
+            '__builtins__': builtins,
+        }
+
+        exec(code, g)
+
+        self._modules[filepath] = g
+        return g[symbol_name]
+
+
+class PlanCache(object):
+    """Remembers the parsed config and compiled filter modules of previous
+    runs, keyed by the hashes of the config and the module files, so that
+    short runs can skip parsing YAML and compiling modules.
+    """
+
+    def __init__(self, cache_path=None):
+        if cache_path is None:
+            cache_path = get_cache_path()
+
+        self._cache_path = cache_path
+
+    @property
+    def cache_path(self):
+        return self._cache_path
+
+    def _get_entry_filepath(self, config_data, root_module_path):
+        key = \
+            _CACHE_KEY_PREFIX + \
+            os.path.abspath(root_module_path) + ':' + \
+            _get_digest(config_data)
+
+        filename = _get_digest(key.encode('utf-8')) + _ENTRY_SUFFIX
+        filepath = os.path.join(self._cache_path, filename)
+
+        return filepath
+
+    def _read_entry(self, entry_filepath):
+        """Return the entry if it exists and none of its modules have
+        changed.
+        """
+
+        try:
+            with open(entry_filepath, 'rb') as f:
+                entry = pickle.load(f)
+
+        except FileNotFoundError:
+            return None
+
+        except Exception:
+            _LOGGER.warning("Ignoring unreadable plan-cache entry: [{}]".format(
+                            entry_filepath))
+
+            return None
+
+        code_objects = {}
+        for filepath, (digest, code_data) in entry['modules'].items():
+            try:
+                with open(filepath, 'rb') as f:
+                    data = f.read()
+
+            except FileNotFoundError:
+                return None
+
+            if _get_digest(data) != digest:
+                return None
+
+            code_objects[filepath] = marshal.loads(code_data)
+
+        return entry['config'], code_objects
+
+    def _write_entry(self, entry_filepath, entry):
+
+        temp_filepath = '{}.{}'.format(entry_filepath, os.getpid())
+
+        try:
+            os.makedirs(self._cache_path, exist_ok=True)
+
+            with open(temp_filepath, 'wb') as f:
+                pickle.dump(entry, f)
+
+            os.replace(temp_filepath, entry_filepath)
+
+        except OSError:
+            # The cache is only an optimization
+            _LOGGER.warning("Could not write plan-cache entry: [{}]".format(
+                            entry_filepath))
+
+            if os.path.exists(temp_filepath) is True:
+                os.remove(temp_filepath)
+
+    def load(self, config_filepath, root_module_path):
+        """Return a `CompiledPlan` for the config, from the cache if
+        possible.
+        """
+
+        with open(config_filepath, 'rb') as f:
+            config_data = f.read()
+
+        entry_filepath = \
+            self._get_entry_filepath(config_data, root_module_path)
+
+
+        # Cached
+
+        result = self._read_entry(entry_filepath)
+        if result is not None:
+            _LOGGER.debug("Plan-cache hit: [{}]".format(config_filepath))
+
+            config, code_objects = result
+
+            plan = CompiledPlan(config, code_objects, is_hit=True)
+            return plan
+
+
+        # Not cached. Parse and compile everything.
+
+        import yaml
+
+        config = yaml.safe_load(config_data)
+
+        code_objects = {}
+        modules = {}
+        for reference in _get_references(config):
+            filepath, _ = get_module_filepath(root_module_path, reference)
+            if filepath in modules:
+                continue
+
+            with open(filepath, 'rb') as f:
+                data = f.read()
+
+            code = compile(data, filepath, 'exec')
+
+            code_objects[filepath] = code
+            modules[filepath] = (_get_digest(data), marshal.dumps(code))
+
+        entry = {
+            'config': config,
+            'modules': modules,
+        }
+
+        self._write_entry(entry_filepath, entry)
+
+        plan = CompiledPlan(config, code_objects, is_hit=False)
+        return plan
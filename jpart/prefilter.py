@@ -0,0 +1,167 @@
+import re
+import json
+import logging
+
+_HIERARCHY_SEPARATOR = '.'
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _is_index(key):
+    """Whether the key could be a list index, which doesn't appear in the line
+    at all.
+    """
+
+    try:
+        int(key)
+
+    except ValueError:
+        return False
+
+    return True
+
+
+def get_field_needles(field_name):
+    """Return the substrings that any line with the given field must contain
+    (one for every level of the reference). Names that might be escaped
+    differently in the input than we'd escape them, and list indices, don't
+    get any.
+    """
+
+    needles = []
+    for key in field_name.split(_HIERARCHY_SEPARATOR):
+        if _is_index(key) is True:
+            continue
+
+        needle = json.dumps(key)
+
+        # Only plain keys are guaranteed to appear exactly like this
+        if needle[1:-1] != key:
+            continue
+
+        needles.append(needle)
+
+    return needles
+
+
+def _get_bytes_expression(check):
+    """Return a bytes expression equivalent to a (substring or expression)
+    check. These also work on `memoryview` lines.
+    """
+
+    if check.__class__ is str:
+        pattern = re.escape(check.encode('utf-8'))
+        flags = 0
+
+    else:
+        pattern = check.pattern.encode('utf-8')
+        flags = check.flags & ~re.UNICODE
+
+    expression = re.compile(pattern, flags)
+    return expression
+
+
+class Prefilter(object):
+    """Checks raw lines before they're decoded. A line passes if all of the
+    checks of at least one rule pass. Checks are either substrings or compiled
+    regular expressions. A line that passes may still not match any rule but a
+    line that doesn't pass can't. Lines can be strings or bytes-like objects.
+    """
+
+    def __init__(self, checks_by_rule):
+        self._alternatives = []
+        self._bytes_alternatives = []
+        for rule_name, checks in checks_by_rule.items():
+            needles = [check for check in checks if check.__class__ is str]
+            expressions = [check for check in checks if check.__class__ is not str]
+
+            self._alternatives.append((rule_name, needles, expressions))
+
+            bytes_expressions = [
+                _get_bytes_expression(check)
+                for check
+                in needles + expressions
+            ]
+
+            self._bytes_alternatives.append((rule_name, bytes_expressions))
+
+        self._lines = 0
+        self._passed = 0
+
+    @property
+    def stats(self):
+        lines = self._lines
+        passed = self._passed
+
+        stats = {
+            'lines': lines,
+            'passed': passed,
+            'pass_ratio': float(passed) / lines if lines else 0.0,
+        }
+
+        return stats
+
+    def _check_bytes(self, line):
+
+        for _, expressions in self._bytes_alternatives:
+            for expression in expressions:
+                if expression.search(line) is None:
+                    break
+
+            else:
+                self._passed += 1
+                return True
+
+        return False
+
+    def check(self, line):
+        self._lines += 1
+
+        if line.__class__ is not str:
+            return self._check_bytes(line)
+
+        for _, needles, expressions in self._alternatives:
+            for needle in needles:
+                if needle not in line:
+                    break
+
+            else:
+                for expression in expressions:
+                    if expression.search(line) is None:
+                        break
+
+                else:
+                    self._passed += 1
+                    return True
+
+        return False
+
+
+def build_prefilter(rules, patterns_by_rule=None):
+    """Derive checks from the fields that every rule requires, plus any
+    patterns declared for a rule. Returns None if some rule could match any
+    line, since then there's nothing to skip.
+    """
+
+    if patterns_by_rule is None:
+        patterns_by_rule = {}
+
+    checks_by_rule = {}
+    for rule in rules:
+        checks = []
+        for field_name in rule.required_field_names:
+            checks += get_field_needles(field_name)
+
+        for pattern in patterns_by_rule.get(rule.name, []):
+            checks.append(re.compile(pattern))
+
+        if not checks:
+            _LOGGER.info("Rule [{}] has nothing to prefilter on. Not "
+                         "prefiltering.".format(rule.name))
+
+            return None
+
+        checks_by_rule[rule.name] = checks
+
+    prefilter = Prefilter(checks_by_rule)
+    return prefilter
@@ -0,0 +1,130 @@
+_HIERARCHY_SEPARATOR = '.'
+
+# Marks a path that's taken (or dropped) whole
+_LEAF = True
+
+# (include, exclude) -> Projection
+_PROJECTIONS = {}
+
+
+def _compile_paths(paths):
+    """Build a tree of the path components. A path that's a prefix of another
+    one covers it.
+    """
+
+    tree = {}
+    for path in sorted(paths, key=len):
+        node = tree
+        parts = path.split(_HIERARCHY_SEPARATOR)
+        for i, part in enumerate(parts):
+            child = node.get(part)
+            if child is _LEAF:
+                break
+
+            if i == len(parts) - 1:
+                node[part] = _LEAF
+                break
+
+            if child is None:
+                child = {}
+                node[part] = child
+
+            node = child
+
+    return tree
+
+
+def _include(record, tree):
+
+    projected = {}
+    for key, value in record.items():
+        node = tree.get(key)
+        if node is None:
+            continue
+
+        if node is _LEAF:
+            projected[key] = value
+
+        elif isinstance(value, dict) is True:
+            projected[key] = _include(value, node)
+
+    return projected
+
+
+def _exclude(record, tree):
+
+    projected = {}
+    for key, value in record.items():
+        node = tree.get(key)
+        if node is _LEAF:
+            continue
+
+        if node is not None and isinstance(value, dict) is True:
+            value = _exclude(value, node)
+
+        projected[key] = value
+
+    return projected
+
+
+class Projection(object):
+    """Keeps (or drops) a set of dotted field paths of a record. Fields keep
+    the order that they have in the record. Use `get_projection()` so that
+    rules with the same projection share one instance.
+    """
+
+    def __init__(self, include=None, exclude=None):
+
+        assert \
+            (include is None) != (exclude is None), \
+            "Exactly one of include or exclude must be given."
+
+        self._include = include
+        self._exclude = exclude
+
+        if include is not None:
+            self._tree = _compile_paths(include)
+            self._project = _include
+
+        else:
+            self._tree = _compile_paths(exclude)
+            self._project = _exclude
+
+    @property
+    def include(self):
+        return self._include
+
+    @property
+    def exclude(self):
+        return self._exclude
+
+    def __repr__(self):
+        return \
+            '<Projection include={} exclude={}>'.format(
+                self._include, self._exclude)
+
+    def apply(self, record):
+        return self._project(record, self._tree)
+
+
+def get_projection(include=None, exclude=None):
+    """Return the one projection for the given paths."""
+
+    if include is not None:
+        include = tuple(sorted(set(include)))
+
+    if exclude is not None:
+        exclude = tuple(sorted(set(exclude)))
+
+    key = (include, exclude)
+
+    try:
+        return _PROJECTIONS[key]
+
+    except KeyError:
+        pass
+
+    projection = Projection(include=include, exclude=exclude)
+    _PROJECTIONS[key] = projection
+
+    return projection
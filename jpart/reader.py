@@ -0,0 +1,132 @@
+import os
+import json
+import mmap
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def terminate_line(line):
+    """Make sure that a (str or bytes) line ends with a newline."""
+
+    if line.__class__ is str:
+        newline = '\n'
+    else:
+        newline = b'\n'
+
+    if line.endswith(newline) is True:
+        return line
+
+    return line + newline
+
+
+def iterate_line_range(f, start, end):
+    """Yield the lines of a seekable binary (or text) stream that start within
+    [start, end). Unless `start` is at the beginning of a line, the partial
+    line that it lands in is skipped. The last line is read in full, so
+    adjacent ranges yield every line exactly once.
+    """
+
+    if start > 0:
+        # If the previous byte is a newline, this just consumes it
+        f.seek(start - 1)
+        f.readline()
+
+    else:
+        f.seek(0)
+
+    while f.tell() < end:
+        line = f.readline()
+        if not line:
+            break
+
+        yield line
+
+
+class MappedInput(object):
+    """An input file that's read through a memory map rather than decoded line
+    by line. Only regular files can be mapped.
+    """
+
+    def __init__(self, filepath, do_advise=True):
+        self._filepath = filepath
+        self._do_advise = do_advise
+
+    @property
+    def filepath(self):
+        return self._filepath
+
+    def _advise(self, m):
+
+        # Not available on all platforms
+        if hasattr(m, 'madvise') is False or \
+           hasattr(mmap, 'MADV_SEQUENTIAL') is False:
+            return
+
+        m.madvise(mmap.MADV_SEQUENTIAL)
+
+    def iterate_lines(self):
+        """Yield a `memoryview` of every line, including its newline if it has
+        one. Every view is released once the next one is requested so they
+        must not be kept.
+        """
+
+        with open(self._filepath, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return
+
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            if self._do_advise is True:
+                self._advise(m)
+
+            view = memoryview(m)
+
+            try:
+                position = 0
+                while position < size:
+                    end = m.find(b'\n', position)
+                    if end == -1:
+                        end = size
+                    else:
+                        end += 1
+
+                    line = view[position:end]
+
+                    try:
+                        yield line
+
+                    finally:
+                        line.release()
+
+                    position = end
+
+            finally:
+                view.release()
+
+        finally:
+            m.close()
+
+    def iterate_records(self, prefilter=None, do_keep_lines=False):
+        """Yield (record, line) for every line that passes the prefilter. The
+        line is None unless we're asked to keep it, in which case it's the raw
+        bytes of the line (with a newline).
+        """
+
+        for view in self.iterate_lines():
+            if prefilter is not None and prefilter.check(view) is False:
+                continue
+
+            # The decoder needs bytes. This is the only copy and the line that
+            # we pass through is the same one.
+            data = view.tobytes()
+
+            record = json.loads(data)
+
+            line = None
+            if do_keep_lines is True:
+                line = terminate_line(data)
+
+            yield record, line
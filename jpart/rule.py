@@ -1,20 +1,54 @@
 import logging
 import os
 import json
-import functools
 import re
+import itertools
+import threading
+import collections
 
-import riu.plugin
 import riu.journal
 import riu.hierarchy
 import riu.utility
 
 import jpart.filter
 import jpart.cache
+import jpart.index
+import jpart.output
+import jpart.prefilter
+import jpart.projection
+import jpart.reader
+import jpart.sample
 import jpart.utility
 
 SKIP_REASON_MODULE__NOT_QUALIFIED = 'filter: not qualified'
+SKIP_REASON_MODULE__SKIPPED = 'filter: skipped'
 SKIP_REASON_DEFAULT__NOT_FOUND = 'default: not found'
+SKIP_REASON_FAN_OUT__EMPTY = 'fan-out: empty'
+SKIP_REASON_FAN_OUT__TOO_MANY = 'fan-out: too many partitions'
+
+# The most partitions that one record can be fanned-out to by one rule
+DEFAULT_FAN_OUT_LIMIT = 1000
+
+DEFAULT_UNMATCHED_FILENAME = 'unmatched.jsonl'
+
+# Keep a cache of open handles for partition files
+ENGINE__CACHED = 'cached'
+
+# Open, write, and close the partition file for every record
+ENGINE__DIRECT = 'direct'
+
+# Like the cached engine but group every batch of records by partition and
+# write each group at once
+ENGINE__BATCH = 'batch'
+
+_ENGINES = (
+    ENGINE__CACHED,
+    ENGINE__DIRECT,
+    ENGINE__BATCH,
+)
+
+# The number of records that are evaluated together
+DEFAULT_BATCH_SIZE = 1000
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -22,17 +56,122 @@ _FILENAME_VALUE_RE = re.compile(r'^[a-zA-Z0-9\-_\. ]*$')
 
 
 class Rule(object):
-    def __init__(self, filter_mappings, name, rule_raw, cached_resources=None):
+    def __init__(
+            self, filter_mappings, name, rule_raw, cached_resources=None,
+            layout=jpart.utility.LAYOUT__FLAT, catalog=None,
+            fan_out_limit=DEFAULT_FAN_OUT_LIMIT, projection=None, shard=None,
+            do_compile=False):
+
+        assert \
+            layout in jpart.utility.LAYOUTS, \
+            "Layout not valid: [{}]".format(layout)
+
         rebuilt = self._process_parts(filter_mappings, rule_raw)
 
         self._name = name
         self._parts = rebuilt
         self._cached_resources = cached_resources
+        self._layout = layout
+        self._catalog = catalog
+        self._fan_out_limit = fan_out_limit
+
+        # A shared `jpart.projection.Projection`, or None to write whole
+        # records
+        self._projection = projection
+
+        # A `jpart.shard.KeyShard` if we only write the partitions that it
+        # owns
+        self._shard = shard
+
+        # Parts whose list values send the record to every value's partition
+        self._fan_out_flags = [
+            isinstance(part, dict) is True and part.get('fan_out', False) is True
+            for part
+            in rule_raw
+        ]
+
+        self._is_fan_out = any(self._fan_out_flags)
+
+        self._field_names = [
+            part[0] if isinstance(part, (list, tuple)) is True else part
+            for part
+            in rebuilt
+        ]
+
+        # Fields to blame when a fan-out can't be used
+        self._fan_out_field_name = \
+            ','.join([
+                field_name
+                for field_name, is_fan_out
+                in zip(self._field_names, self._fan_out_flags)
+                if is_fan_out is True
+            ])
+
+        # (field name, reason) -> count
+        self._skips = collections.Counter()
+
+        if layout == jpart.utility.LAYOUT__HIVE:
+            for field_name in self._field_names:
+                assert \
+                    os.sep not in field_name and '=' not in field_name, \
+                    "Rule [{}] field [{}] can't be used as a directory " \
+                        "name.".format(name, field_name)
+
+        # Only used when we're not writing through the cache
+        self._created_paths = jpart.utility.CreatedPaths()
+
+        # Replace the generic evaluation with functions generated for this
+        # rule
+        if do_compile is True:
+            self._compile()
+
+    def _compile(self):
+        import jpart.codegen
+
+        apply, apply_batch = jpart.codegen.compile_rule(self)
+
+        self.apply = apply
+
+        if apply_batch is not None:
+            self.apply_batch = apply_batch
 
     @property
     def name(self):
         return self._name
 
+    @property
+    def field_names(self):
+        return self._field_names
+
+    @property
+    def layout(self):
+        return self._layout
+
+    @property
+    def projection(self):
+        return self._projection
+
+    @property
+    def skips(self):
+        """How many records were skipped, by (field name, reason)."""
+
+        return self._skips
+
+    @property
+    def required_field_names(self):
+        """The fields that a record must have for this rule to match it. Fields
+        that go through a filter aren't included since the filter decides.
+        """
+
+        field_names = [
+            part
+            for part
+            in self._parts
+            if isinstance(part, (list, tuple)) is False
+        ]
+
+        return field_names
+
     def __str__(self):
         return self.name
 
@@ -40,6 +179,15 @@ class Rule(object):
 
         materialized_parts = []
         for part in rule_raw:
+
+            # The long form, with options
+            if isinstance(part, dict) is True:
+                filter_name = part.get('filter')
+                if filter_name is None:
+                    part = part['field']
+                else:
+                    part = (part['field'], filter_name)
+
             if isinstance(part, (list, tuple)) is True:
                 field_name, filter_name = part
 
@@ -51,8 +199,12 @@ class Rule(object):
                         "an exclamation point: [{}]".format(filter_name)
 
                 filter_name = filter_name[1:]
-                filter_cls = filter_mappings[filter_name]
-                filter_ = filter_cls()
+                filter_ = filter_mappings[filter_name]
+
+                # The mappings can have either classes or shared instances
+                if isinstance(filter_, type) is True:
+                    filter_ = filter_()
+
                 part = (field_name, filter_)
 
             materialized_parts.append(part)
@@ -99,110 +251,583 @@ class Rule(object):
 
         return value
 
+    def _get_values_with_rule_part(self, part, records):
+        """The batch equivalent of `_get_value_with_rule_part()`. Records that
+        should be skipped get `jpart.filter.SKIP`.
+        """
+
+        filter_module = None
+        if isinstance(part, (list, tuple)) is True:
+            name, filter_module = part
+        else:
+            name = part
+
+
+        # Default extraction
+
+        if filter_module is None:
+            values = []
+            for record in records:
+                try:
+                    value = \
+                        riu.hierarchy.get_value_from_hierarchy_with_string_reference(
+                            record, name)
+
+                except KeyError:
+                    value = jpart.filter.SKIP
+                    self._skips[(name, SKIP_REASON_DEFAULT__NOT_FOUND)] += 1
+
+                values.append(value)
+
+            return values
+
+
+        # Filter extraction. Only ask about the values that we actually got.
+
+        values = filter_module.get_values(name, records)
+
+        for i, value in enumerate(values):
+            if isinstance(value, jpart.filter.SkipRuleException) is True:
+                self._skips[(value.field_name, value.reason)] += 1
+                values[i] = jpart.filter.SKIP
+
+            elif value is jpart.filter.SKIP:
+                self._skips[(name, SKIP_REASON_MODULE__SKIPPED)] += 1
+
+        present = [
+            value
+            for value
+            in values
+            if value is not jpart.filter.SKIP
+        ]
+
+        qualifies = iter(filter_module.does_qualify_batch(name, present))
+
+        for i, value in enumerate(values):
+            if value is jpart.filter.SKIP:
+                continue
+
+            if next(qualifies) is False:
+                values[i] = jpart.filter.SKIP
+                self._skips[(name, SKIP_REASON_MODULE__NOT_QUALIFIED)] += 1
+
+        return values
+
+    def _get_phrase(self, part, value, record):
+
+        assert \
+            isinstance(value, (str, int, float)) is True, \
+            "Rule [{}] part [{}] yielded [non-simple] value that can't " \
+                "be used in a filename: [{}] {}\n" \
+                "RECORD:\n{}".format(
+                self.name, part, value.__class__.__name__, value,
+                riu.utility.get_pretty_json(record))
+
+        # If not a string, make it a string
+        value = str(value)
+
+        assert \
+            _FILENAME_VALUE_RE.match(value) is not None, \
+            "Rule [{}] part [{}] yielded value that can't be used in a " \
+                "filename: [{}]\n" \
+                "RECORD:\n{}".format(
+                self.name, part, value,
+                riu.utility.get_pretty_json(record))
+
+        return value
+
+    def _get_fan_out_phrases(self, part, value, record):
+        """Return the distinct phrases of a list value, in the order that they
+        first appear, as a tuple. A scalar is treated like a list of one.
+        """
+
+        if isinstance(value, list) is False:
+            value = [value]
+
+        phrases = [
+            self._get_phrase(part, item, record)
+            for item
+            in value
+        ]
+
+        return tuple(dict.fromkeys(phrases))
+
+    def _check_fan_out(self, values):
+        """Return the reason that the values can't be used, or None."""
+
+        count = 1
+        for value in values:
+            if value.__class__ is tuple:
+                count *= len(value)
+
+        if count == 0:
+            return SKIP_REASON_FAN_OUT__EMPTY
+
+        if count > self._fan_out_limit:
+            _LOGGER.warning("Rule [{}] would fan a record out to ({}) "
+                            "partitions. Skipping.".format(self.name, count))
+
+            return SKIP_REASON_FAN_OUT__TOO_MANY
+
+        return None
+
+    def expand(self, values):
+        """Return the list of phrases for every partition that the values of
+        a record (from `apply()`) go to. With a shard, only the partitions that
+        it owns are returned.
+        """
+
+        if self._shard is not None:
+            combinations = [
+                combination
+                for combination
+                in self._expand(values)
+                if self._shard.is_owned(self._name, combination) is True
+            ]
+
+            return combinations
+
+        return self._expand(values)
+
+    def _expand(self, values):
+
+        if self._is_fan_out is False:
+            return [values]
+
+        options = [
+            value if value.__class__ is tuple else (value,)
+            for value
+            in values
+        ]
+
+        combinations = [
+            list(combination)
+            for combination
+            in itertools.product(*options)
+        ]
+
+        return combinations
+
     def apply(self, record):
         """Retrieve the values for each of the parts of the rule. If any are
-        not present, return None.
+        not present, return None. Fan-out parts give a tuple of the distinct
+        values (see `expand()`).
         """
 
         values = []
-        for part in self._parts:
+        for part, is_fan_out in zip(self._parts, self._fan_out_flags):
 
             # Apply rule part
 
             try:
                 value = self._get_value_with_rule_part(part, record)
 
-            except jpart.filter.SkipRuleException:
+            except jpart.filter.SkipRuleException as e:
+                self._skips[(e.field_name, e.reason)] += 1
                 return None
 
 
-            assert \
-                isinstance(value, (str, int, float)) is True, \
-                "Rule [{}] part [{}] yielded [non-simple] value that can't " \
-                    "be used in a filename: [{}] {}\n" \
-                    "RECORD:\n{}".format(
-                    self.name, part, value.__class__.__name__, value,
-                    riu.utility.get_pretty_json(record))
+            # Capture
 
-            # If not a string, make it a string
-            value = str(value)
+            if is_fan_out is True:
+                value = self._get_fan_out_phrases(part, value, record)
+            else:
+                value = self._get_phrase(part, value, record)
 
-            assert \
-                _FILENAME_VALUE_RE.match(value) is not None, \
-                "Rule [{}] part [{}] yielded value that can't be used in a " \
-                    "filename: [{}]\n" \
-                    "RECORD:\n{}".format(
-                    self.name, part, value,
-                    riu.utility.get_pretty_json(record))
+            values.append(value)
 
 
-            # Capture
+        if self._is_fan_out is True:
+            reason = self._check_fan_out(values)
+            if reason is not None:
+                self._skips[(self._fan_out_field_name, reason)] += 1
+                return None
 
-            values.append(value)
+        return values
 
+    def apply_batch(self, records):
+        """The same as `apply()` but for a list of records. Returns a list with
+        the values (or None) for each record. Every part is evaluated for all
+        of the records that are still in play before moving on to the next
+        part.
+        """
 
-        return values
+        phrases_list = [[] for _ in records]
+        remaining = list(range(len(records)))
+
+        for part, is_fan_out in zip(self._parts, self._fan_out_flags):
+            if not remaining:
+                break
+
+            batch = [records[i] for i in remaining]
+            values = self._get_values_with_rule_part(part, batch)
+
+            still_remaining = []
+            for i, record, value in zip(remaining, batch, values):
+                if value is jpart.filter.SKIP:
+                    phrases_list[i] = None
+                    continue
+
+                if is_fan_out is True:
+                    phrase = self._get_fan_out_phrases(part, value, record)
+                else:
+                    phrase = self._get_phrase(part, value, record)
+
+                phrases_list[i].append(phrase)
+
+                still_remaining.append(i)
+
+            remaining = still_remaining
+
+
+        if self._is_fan_out is True:
+            for i in remaining:
+                reason = self._check_fan_out(phrases_list[i])
+                if reason is not None:
+                    self._skips[(self._fan_out_field_name, reason)] += 1
+                    phrases_list[i] = None
+
+        return phrases_list
+
+    def serialize(self, record):
+        """Return the line that this rule writes for the record."""
+
+        if self._projection is not None:
+            record = self._projection.apply(record)
+
+        return json.dumps(record) + '\n'
 
     def _write_record__inner(self, f, record):
 
-        json.dump(record, f)
-        f.write('\n')
+        # One write per record so that the output layer only ever sees whole
+        # records
+        f.write(json.dumps(record) + '\n')
 
-    def write_record(self, output_path, rule_name, record, phrases):
-        """Write the record in a certain partitioned output path. Values values
-        will have already been stringified.
+    def get_partition_rel_filepath(self, phrases):
+        """Return the path of the partition file relative to the rule's
+        directory.
         """
 
-        filename = jpart.utility.construct_output_filename(phrases)
+        rel_filepath = \
+            jpart.utility.construct_output_rel_filepath(
+                self._field_names,
+                phrases,
+                layout=self._layout)
+
+        return rel_filepath
+
+    def _write_to_partition(
+            self, output_path, rule_name, record, phrases, line=None):
+
+        filename = self.get_partition_rel_filepath(phrases)
+
+        # The cache logic is context agnostic. Therefore, the "name" we're
+        # looking up must be relative to the root output path (so that it's
+        # both absolute and unique against any other identical filename).
+        rel_filepath = os.path.join(rule_name, filename)
+
+        if self._catalog is not None:
+            self._catalog.register_partition(
+                rel_filepath,
+                rule_name,
+                self._field_names,
+                phrases)
 
         if self._cached_resources is None:
-            rule_output_path = os.path.join(output_path, rule_name)
+            filepath = os.path.join(output_path, rel_filepath)
+            self._created_paths.ensure(os.path.dirname(filepath))
 
-            if os.path.exists(rule_output_path) is False:
-                os.makedirs(rule_output_path)
+            if line is None:
+                line = json.dumps(record) + '\n'
 
-            filepath = os.path.join(rule_output_path, filename)
+            opener = _get_direct_opener(line)
+            with opener(filepath) as f:
+                f.write(line)
 
-            with jpart.utility.RESOURCE_APPEND_OPENER(filepath) as f:
-                self._write_record__inner(f, record)
+            if self._catalog is not None:
+                self._catalog.add(rel_filepath, filepath, 1, len(line))
 
         else:
-            # The cache logic is context agnostic. Therefore, the "name" we're
-            # looking up must be relative to the root output path (so that it's
-            # both absolute and unique against any other identical filename).
+            f = self._cached_resources.get_or_create(rel_filepath)
+
+            if line is None:
+                self._write_record__inner(f, record)
+            else:
+                f.write(line)
+
+    def write_record(self, output_path, rule_name, record, phrases, line=None):
+        """Write the record in a certain partitioned output path. Values values
+        will have already been stringified. If the record's original line is
+        given (str or bytes, with a newline), it's written as-is rather than
+        reserializing the record. With a projection, the line must already be
+        projected. A record that fans out is only serialized once.
+        """
+
+        combinations = self.expand(phrases)
+
+        if line is None and \
+           (len(combinations) > 1 or self._projection is not None):
+            line = self.serialize(record)
+
+        for phrases in combinations:
+            self._write_to_partition(
+                output_path,
+                rule_name,
+                record,
+                phrases,
+                line=line)
+
+    def write_records(self, output_path, rule_name, lines, phrases_list):
+        """Write a batch of already-serialized records (as strings or bytes
+        ending with newlines). Records are grouped by partition and every
+        partition gets one write, in the order that the records came in.
+        """
+
+        groups = {}
+        for line, phrases in zip(lines, phrases_list):
+            if phrases is None:
+                continue
+
+            for combination in self.expand(phrases):
+                key = tuple(combination)
+
+                try:
+                    group = groups[key]
+
+                except KeyError:
+                    groups[key] = group = []
+
+                group.append(line)
+
+
+        for phrases, group in groups.items():
+            filename = self.get_partition_rel_filepath(phrases)
             rel_filepath = os.path.join(rule_name, filename)
 
-            f = self._cached_resources.get_or_create(rel_filepath)
-            self._write_record__inner(f, record)
+            if self._catalog is not None:
+                self._catalog.register_partition(
+                    rel_filepath,
+                    rule_name,
+                    self._field_names,
+                    list(phrases))
 
+            # Works for both strings and bytes
+            data = group[0][:0].join(group)
 
-def _build_rules_with_config(
-        root_module_import_path, config, cached_resources):
+            if self._cached_resources is None:
+                filepath = os.path.join(output_path, rel_filepath)
+                self._created_paths.ensure(os.path.dirname(filepath))
 
-    filter_mappings_raw = config.get('filter_mappings', {})
-    rules_index_raw = config['rules']
+                opener = _get_direct_opener(data)
+                with opener(filepath) as f:
+                    f.write(data)
 
+                if self._catalog is not None:
+                    self._catalog.add(
+                        rel_filepath,
+                        filepath,
+                        len(group),
+                        len(data))
 
-    # Load custom filters
+            else:
+                f = self._cached_resources.get_or_create(rel_filepath)
+                f.write(data)
 
-# TODO(dustin): Add test for filter mappings
-    filter_mappings = {}
-    for name, reference in filter_mappings_raw.items():
 
-        _LOGGER.debug("Processing [{}] [{}].".format(name, reference))
+class UnmatchedSink(object):
+    """Collects the records that matched no rule (or every Nth of them) and
+    writes them to one file under the output path, through the cache if
+    there is one. Writes are held until we're flushed.
+    """
 
-        cls_ = riu.plugin.get_module_symbol_with_reference(
-                root_module_import_path,
-                reference)
+    def __init__(
+            self, output_path, filename=DEFAULT_UNMATCHED_FILENAME,
+            sample_every=1, cached_resources=None):
 
         assert \
-            issubclass(cls_, jpart.filter.BaseFilter) is True, \
-            "Class does not inherit jpart.filter.BaseFilter: [{}]".format(
-                reference)
+            sample_every > 0, \
+            "Sampling must be at least one: ({})".format(sample_every)
+
+        self._output_path = output_path
+        self._filename = filename
+        self._sample_every = sample_every
+        self._cached_resources = cached_resources
+
+        self._pending = []
+
+        self._unmatched = 0
+        self._written = 0
+
+    @property
+    def stats(self):
+        stats = {
+            'unmatched': self._unmatched,
+            'written': self._written,
+        }
+
+        return stats
+
+    @property
+    def memory_bytes(self):
+        return sum(len(line) for line in self._pending)
+
+    def add(self, record, line=None):
+        self._unmatched += 1
+
+        if (self._unmatched - 1) % self._sample_every != 0:
+            return
 
-        filter_ = cls_()
+        if line is None:
+            line = json.dumps(record) + '\n'
 
-        filter_mappings[name] = filter_
+        self._pending.append(line)
+
+    def flush(self):
+        if not self._pending:
+            return
+
+        # Works for both strings and bytes
+        data = self._pending[0][:0].join(self._pending)
+
+        if self._cached_resources is None:
+            filepath = os.path.join(self._output_path, self._filename)
+
+            opener = _get_direct_opener(data)
+            with opener(filepath) as f:
+                f.write(data)
+
+        else:
+            f = self._cached_resources.get_or_create(self._filename)
+            f.write(data)
+
+        self._written += len(self._pending)
+        del self._pending[:]
+
+
+def _get_direct_opener(data):
+
+    if data.__class__ is str:
+        return jpart.utility.RESOURCE_APPEND_OPENER
+
+    return jpart.utility.RESOURCE_APPEND_BINARY_OPENER
+
+
+def _build_filter_with_config(
+        root_module_import_path, reference, get_symbol_cb=None):
+
+    # Either a reference or a dictionary with a reference and options
+    filter_config = {}
+    if isinstance(reference, dict) is True:
+        filter_config = reference
+        reference = filter_config['reference']
+
+    if jpart.filter.is_builtin_reference(reference) is True:
+        cls_ = jpart.filter.get_builtin_symbol(reference)
+
+    else:
+        if get_symbol_cb is None:
+            import riu.plugin
+            get_symbol_cb = riu.plugin.get_module_symbol_with_reference
+
+        cls_ = get_symbol_cb(root_module_import_path, reference)
+
+    assert \
+        issubclass(cls_, jpart.filter.BaseFilter) is True, \
+        "Class does not inherit jpart.filter.BaseFilter: [{}]".format(
+            reference)
+
+    filter_ = cls_()
+    filter_.setup(filter_config.get('config', {}))
+
+    # Either "true" or a dictionary
+    memoize_config = filter_config.get('memoize')
+    if memoize_config:
+        if memoize_config is True:
+            memoize_config = {}
+
+        filter_ = \
+            jpart.filter.MemoizedFilter(
+                filter_,
+                size=memoize_config.get(
+                    'size',
+                    jpart.filter.DEFAULT_MEMOIZE_SIZE),
+                do_memoize_value=memoize_config.get('transform', False))
+
+    return filter_
+
+
+def _build_filters_with_config(
+        root_module_import_path, config, get_symbol_cb=None):
+    """Build and set up every filter in the config once. The rules share
+    these instances. The filter classes are resolved with
+    `riu.plugin.get_module_symbol_with_reference()` unless another resolver
+    (like `jpart.plan_cache.CompiledPlan.get_symbol`) is given.
+    """
+
+    filter_mappings_raw = config.get('filter_mappings', {})
+
+    filter_mappings = {}
+    try:
+        for name, reference in filter_mappings_raw.items():
+
+            _LOGGER.debug("Processing [{}] [{}].".format(name, reference))
+
+            filter_mappings[name] = \
+                _build_filter_with_config(
+                    root_module_import_path,
+                    reference,
+                    get_symbol_cb=get_symbol_cb)
+
+    except:
+        _teardown_filters(filter_mappings)
+        raise
+
+    return filter_mappings
+
+
+def _teardown_filters(filter_mappings):
+
+    for name, filter_ in filter_mappings.items():
+        _LOGGER.debug("Tearing down filter [{}].".format(name))
+        filter_.teardown()
+
+
+def _build_projection_with_config(name, project_config):
+
+    include = project_config.get('include')
+    exclude = project_config.get('exclude')
+
+    assert \
+        (include is None) != (exclude is None), \
+        "Rule [{}] projection needs exactly one of include or " \
+            "exclude.".format(name)
+
+    projection = \
+        jpart.projection.get_projection(
+            include=include,
+            exclude=exclude)
+
+    return projection
+
+
+def _build_rules_with_config(
+        root_module_import_path, config, cached_resources, catalog=None,
+        filter_mappings=None, shard=None):
+    """If the filters aren't given, they're built here and it's up to the
+    caller to tear them down (they're shared by the rules).
+    """
+
+    rules_index_raw = config['rules']
+    layout = config.get('layout', jpart.utility.LAYOUT__FLAT)
+    fan_out_limit = config.get('fan_out_limit', DEFAULT_FAN_OUT_LIMIT)
+    do_compile = config.get('compile', False)
+
+
+    # Load custom filters
+
+    if filter_mappings is None:
+        filter_mappings = \
+            _build_filters_with_config(root_module_import_path, config)
 
 
     # Initialize filters
@@ -210,11 +835,27 @@ def _build_rules_with_config(
     rules = []
     for name, rule_raw in rules_index_raw.items():
 
+        # Either a list of parts or a dictionary with the parts and options
+        projection = None
+        if isinstance(rule_raw, dict) is True:
+            project_config = rule_raw.get('project')
+            if project_config is not None:
+                projection = \
+                    _build_projection_with_config(name, project_config)
+
+            rule_raw = rule_raw['parts']
+
         rule = Rule(
                 filter_mappings,
                 name,
                 rule_raw,
-                cached_resources=cached_resources)
+                cached_resources=cached_resources,
+                layout=layout,
+                catalog=catalog,
+                fan_out_limit=fan_out_limit,
+                projection=projection,
+                shard=shard,
+                do_compile=do_compile)
 
         rules.append(rule)
 
@@ -222,60 +863,855 @@ def _build_rules_with_config(
     return rules
 
 
-def apply_rules_to_input_data_with_rules(output_path, rules, f):
+def _iterate_text_records(f, prefilter, do_keep_lines):
+
+    f.seek(0)
+
+    for line in f:
+        if prefilter is not None and prefilter.check(line) is False:
+            continue
+
+        record = json.loads(line)
+
+        if do_keep_lines is True:
+            yield record, jpart.reader.terminate_line(line)
+
+        else:
+            yield record, None
+
+
+def _iterate_records(f, prefilter=None, do_keep_lines=False, sampler=None):
+    """Yield (record, line) for every record in the input, which is either a
+    stream or a `jpart.reader.MappedInput`. The line is None unless we're asked
+    to keep it. Lines that the prefilter (or the sampler, like a
+    `jpart.sample.LineSampler`) rules out are skipped without being decoded.
+    """
+
+    if sampler is not None:
+        pairs = \
+            sampler.iterate_records(
+                f,
+                prefilter=prefilter,
+                do_keep_lines=do_keep_lines)
+
+        return pairs
+
+    if isinstance(f, jpart.reader.MappedInput) is True:
+        pairs = \
+            f.iterate_records(
+                prefilter=prefilter,
+                do_keep_lines=do_keep_lines)
+
+        return pairs
+
+    if prefilter is None and do_keep_lines is False:
+        pairs = (
+            (record, None)
+            for record
+            in riu.journal.parse_journal_stream_gen(f)
+        )
+
+        return pairs
+
+    return _iterate_text_records(f, prefilter, do_keep_lines)
+
+
+def _iterate_batches(pairs, batch_size):
+    """Yield lists of records along with the list of their lines."""
+
+    records = []
+    lines = []
+    for record, line in pairs:
+        records.append(record)
+        lines.append(line)
+
+        if len(records) >= batch_size:
+            yield records, lines
+
+            records = []
+            lines = []
+
+    if records:
+        yield records, lines
+
+
+def _get_projected_line(rule, record, line, lines_by_projection):
+    """Return the line that the rule writes for the record, serializing it at
+    most once for every distinct projection. Without a projection, this is the
+    original line (if kept).
+    """
 
-    j = riu.journal.parse_journal_stream_gen(f)
-    for i, record in enumerate(j):
+    projection = rule.projection
+    if projection is None and line is not None:
+        return line
+
+    try:
+        return lines_by_projection[projection]
+
+    except KeyError:
+        pass
+
+    projected_line = rule.serialize(record)
+    lines_by_projection[projection] = projected_line
+
+    return projected_line
+
+
+def apply_rules_to_input_data_with_rules(
+        output_path, rules, f, batch_size=DEFAULT_BATCH_SIZE, prefilter=None,
+        do_passthrough=False, unmatched_sink=None, sampler=None,
+        reservoir=None, governor=None):
+    """Records are evaluated in batches (so that filters can use their batch
+    methods) but are still written in the order that they were read. With
+    passthrough, the original lines are written rather than reserializing
+    the records (except for rules with a projection). Every record is
+    serialized once for every distinct projection that it's written with.
+
+    A sampler (from `jpart.sample`) decides which of the input's lines are
+    read. With a `jpart.sample.PartitionReservoir`, matched records are
+    offered to it rather than written and the sample is written at the end.
+    A `jpart.memory.MemoryGovernor` is checked after every batch.
+    """
+
+    pairs = \
+        _iterate_records(
+            f,
+            prefilter=prefilter,
+            do_keep_lines=do_passthrough,
+            sampler=sampler)
+
+    processed = 0
+    for batch, lines in _iterate_batches(pairs, batch_size):
+
+        phrases_by_rule = [
+            rule.apply_batch(batch)
+            for rule
+            in rules
+        ]
+
+        for i, record in enumerate(batch):
+            is_matched = False
+
+            # projection -> line
+            lines_by_projection = {}
+
+            for rule, phrases_list in zip(rules, phrases_by_rule):
+                values = phrases_list[i]
+                if values is None:
+                    continue
+
+                is_matched = True
+
+                if reservoir is not None:
+                    reservoir.add(
+                        rule,
+                        record,
+                        values,
+                        line=lines[i] if rule.projection is None else None)
+
+                    continue
+
+                line = \
+                    _get_projected_line(
+                        rule,
+                        record,
+                        lines[i],
+                        lines_by_projection)
+
+                try:
+                    rule.write_record(
+                        output_path,
+                        rule.name,
+                        record,
+                        values,
+                        line=line)
+
+                except:
+                    _LOGGER.exception("Could not write record via rule: {}".format(
+                                      rule))
+
+                    raise
+
+            if is_matched is False and unmatched_sink is not None:
+                unmatched_sink.add(record, line=lines[i])
+
+        if unmatched_sink is not None:
+            unmatched_sink.flush()
+
+        if governor is not None:
+            governor.check()
+
+        processed += len(batch)
+        _LOGGER.info("Processed ({}) records.".format(processed))
+
+    if reservoir is not None:
+        reservoir.write(output_path)
+
+
+def apply_rules_to_input_data_with_rules__batch(
+        output_path, rules, f, batch_size=DEFAULT_BATCH_SIZE, prefilter=None,
+        do_passthrough=False, unmatched_sink=None, sampler=None,
+        reservoir=None, governor=None):
+    """Evaluate every rule over a batch of records and then write each of the
+    batch's partitions at once. Every record is serialized once for every
+    distinct projection, no matter how many rules it matches. The output is
+    the same as with `apply_rules_to_input_data_with_rules()`.
+    """
+
+    pairs = \
+        _iterate_records(
+            f,
+            prefilter=prefilter,
+            do_keep_lines=do_passthrough,
+            sampler=sampler)
+
+    processed = 0
+    for batch, lines in _iterate_batches(pairs, batch_size):
+
+        phrases_by_rule = [
+            rule.apply_batch(batch)
+            for rule
+            in rules
+        ]
+
+
+        # Serialize whatever matched at least one rule, once for every
+        # projection (unless we already have the original lines)
+
+        # projection -> lines
+        lines_by_projection = {
+            None: lines,
+        }
+
+        is_matched_list = [False] * len(batch)
+        rule_lines_list = []
+        for rule, phrases_list in zip(rules, phrases_by_rule):
+            if reservoir is not None:
+                for i, phrases in enumerate(phrases_list):
+                    if phrases is None:
+                        continue
+
+                    is_matched_list[i] = True
+
+                    reservoir.add(
+                        rule,
+                        batch[i],
+                        phrases,
+                        line=lines[i] if rule.projection is None else None)
 
-        for rule in rules:
-            values = rule.apply(record)
-            if values is None:
                 continue
 
+            projection = rule.projection
+
+            try:
+                projected_lines = lines_by_projection[projection]
+
+            except KeyError:
+                projected_lines = [None] * len(batch)
+                lines_by_projection[projection] = projected_lines
+
+            for i, phrases in enumerate(phrases_list):
+                if phrases is None:
+                    continue
+
+                is_matched_list[i] = True
+
+                if projected_lines[i] is None:
+                    projected_lines[i] = rule.serialize(batch[i])
+
+            rule_lines_list.append(projected_lines)
+
+
+        # Write
+
+        for rule, phrases_list, rule_lines \
+                in zip(rules, phrases_by_rule, rule_lines_list):
+
             try:
-                rule.write_record(output_path, rule.name, record, values)
+                rule.write_records(
+                    output_path,
+                    rule.name,
+                    rule_lines,
+                    phrases_list)
 
             except:
-                _LOGGER.exception("Could not write record via rule: {}".format(
+                _LOGGER.exception("Could not write records via rule: {}".format(
                                   rule))
 
                 raise
 
+        if unmatched_sink is not None:
+            for record, line, is_matched \
+                    in zip(batch, lines, is_matched_list):
 
-        if i % 100 == 0 and i > 0:
-            _LOGGER.info("Processed ({}) records.".format(i + 1))
+                if is_matched is False:
+                    unmatched_sink.add(record, line=line)
 
+            unmatched_sink.flush()
 
-def load_rules_and_apply_to_input_data_with_config(
-        module_path, output_path, config, f, cached_resources=None,
-        do_dispose=True):
+        if governor is not None:
+            governor.check()
 
-    # Initialize cache
+        processed += len(batch)
+        _LOGGER.info("Processed ({}) records.".format(processed))
 
-    if cached_resources is None:
+    if reservoir is not None:
+        reservoir.write(output_path)
 
-        fault_cb = \
-            functools.partial(
-                jpart.cache.default_fault_handler,
-                output_path)
 
-        cached_resources = jpart.cache.CachedResources(fault_cb)
+def _build_catalog_with_config(output_path, config):
 
+    # Either "true" or a dictionary
+    catalog_config = config.get('catalog')
+    if not catalog_config:
+        return None
 
-    # Build rules
+    if catalog_config is True:
+        catalog_config = {}
 
-    rules = \
-        _build_rules_with_config(
-            module_path,
-            config,
-            cached_resources)
+    import jpart.catalog
+
+    filename = \
+        catalog_config.get(
+            'filename',
+            jpart.catalog.DEFAULT_CATALOG_FILENAME)
+
+    filepath = jpart.catalog.get_catalog_filepath(output_path, filename)
+
+    catalog = jpart.catalog.Catalog(filepath, output_path)
+    return catalog
+
+
+def _build_syncer_with_config(config):
+
+    # Either the mode or a dictionary
+    durability_config = config.get('durability')
+    if not durability_config:
+        return None
+
+    if durability_config.__class__ is str:
+        durability_config = {
+            'mode': durability_config,
+        }
+
+    import jpart.durability
+
+    mode = durability_config.get('mode', jpart.durability.DURABILITY__NONE)
+    if mode == jpart.durability.DURABILITY__NONE:
+        return None
+
+    syncer = \
+        jpart.durability.SyncCoordinator(
+            mode,
+            interval_seconds=durability_config.get('interval_seconds'),
+            interval_bytes=durability_config.get('interval_bytes'),
+            do_sync_directories=durability_config.get('directories', True))
+
+    return syncer
+
+
+def _build_fault_handler_with_config(
+        output_path, config, catalog=None, syncer=None):
+
+    rolling_config = config.get('rolling', {})
+
+    # Either "true" or a dictionary
+    index_config = config.get('index')
+
+    index_stride = None
+    if index_config is True:
+        index_stride = jpart.index.DEFAULT_STRIDE
+
+    elif index_config:
+        index_stride = \
+            index_config.get('stride', jpart.index.DEFAULT_STRIDE)
+
+    fault_cb = \
+        jpart.output.PartitionFaultHandler(
+            output_path,
+            max_bytes=rolling_config.get('max_bytes'),
+            max_records=rolling_config.get('max_records'),
+            index_stride=index_stride,
+            catalog=catalog,
+            syncer=syncer)
+
+    return fault_cb
+
+
+def _build_unmatched_sink_with_config(output_path, config, cached_resources):
+
+    # Either "true" or a dictionary
+    unmatched_config = config.get('unmatched')
+    if not unmatched_config:
+        return None
+
+    if unmatched_config is True:
+        unmatched_config = {}
+
+    sink = \
+        UnmatchedSink(
+            output_path,
+            filename=unmatched_config.get(
+                'filename',
+                DEFAULT_UNMATCHED_FILENAME),
+            sample_every=unmatched_config.get('sample_every', 1),
+            cached_resources=cached_resources)
+
+    return sink
+
+
+def _log_skips(rules, unmatched_sink):
+
+    for rule in rules:
+        for (field_name, reason), count in sorted(rule.skips.items()):
+            _LOGGER.info("Rule [{}] skipped ({}) records on [{}]: {}".format(
+                         rule.name, count, field_name, reason))
+
+    if unmatched_sink is not None:
+        stats = unmatched_sink.stats
+
+        _LOGGER.info("Wrote ({}) of ({}) unmatched records.".format(
+                     stats['written'], stats['unmatched']))
+
+
+def _build_prefilter_with_config(rules, config):
+
+    # Either "true" or a dictionary of patterns by rule name
+    prefilter_config = config.get('prefilter')
+    if not prefilter_config:
+        return None
+
+    if prefilter_config is True:
+        prefilter_config = {}
+
+    prefilter = \
+        jpart.prefilter.build_prefilter(
+            rules,
+            patterns_by_rule=prefilter_config.get('patterns'))
+
+    return prefilter
+
+
+def _build_sampling_with_config(config):
+    """Return the sampler and the reservoir (either can be None)."""
+
+    sample_config = config.get('sample')
+    if not sample_config:
+        return None, None
+
+    every = sample_config.get('every')
+    ratio = sample_config.get('ratio')
+    reservoir_size = sample_config.get('reservoir')
+    seed = sample_config.get('seed')
+
+    assert \
+        every is None or ratio is None, \
+        "Sampling can be by line or by byte-range but not both."
+
+    sampler = None
+    if every is not None:
+        sampler = jpart.sample.LineSampler(every)
+
+    elif ratio is not None:
+        sampler = \
+            jpart.sample.ByteRangeSampler(
+                ratio,
+                range_bytes=sample_config.get(
+                    'range_bytes',
+                    jpart.sample.DEFAULT_RANGE_BYTES),
+                seed=seed)
+
+    reservoir = None
+    if reservoir_size is not None:
+        reservoir = \
+            jpart.sample.PartitionReservoir(
+                reservoir_size,
+                seed=seed)
+
+    return sampler, reservoir
+
+
+def _build_shard_with_config(output_path, config):
+    """Return the path that the shard writes to, along with either a
+    `jpart.shard.KeyShard` or a `jpart.shard.ByteRangeShard` (the other one is
+    None).
+    """
+
+    shard_config = config.get('shard')
+    if not shard_config:
+        return output_path, None, None
+
+    import jpart.shard
+
+    by = shard_config.get('by', jpart.shard.SHARD_BY__BYTES)
+
+    assert \
+        by in jpart.shard.SHARD_BYS, \
+        "Shard mode not valid: [{}]".format(by)
+
+    index = shard_config['index']
+    count = shard_config['count']
+
+    output_path = jpart.shard.get_shard_path(output_path, index, count)
+
+    if by == jpart.shard.SHARD_BY__KEY:
+        return output_path, jpart.shard.KeyShard(index, count), None
+
+    return output_path, None, jpart.shard.ByteRangeShard(index, count)
+
+
+def _build_governor_with_config(
+        config, cached_resources, filter_mappings, catalog, unmatched_sink):
+
+    # Either a number of bytes or a string like "512M"
+    memory_limit = config.get('memory_limit')
+    if memory_limit is None:
+        return None
 
+    import jpart.memory
 
-    # Process data
+    if memory_limit.__class__ is str:
+        memory_limit = jpart.memory.parse_size(memory_limit)
+
+    governor = jpart.memory.MemoryGovernor(memory_limit)
+
+
+    # Buffers
+
+    if cached_resources is not None:
+        governor.add_buffer(cached_resources)
+
+    if catalog is not None:
+        governor.add_buffer(catalog)
+
+    if unmatched_sink is not None:
+        governor.add_buffer(unmatched_sink)
+
+
+    # Caches
+
+    for filter_ in filter_mappings.values():
+        if isinstance(filter_, jpart.filter.MemoizedFilter) is True:
+            governor.add_cache(filter_)
+
+
+    # Handles
+
+    if cached_resources is not None:
+        governor.add_handles(cached_resources)
+
+
+    return governor
+
+
+def _get_memoize_stats(filter_mappings):
+    """Return the memo stats of every memoized filter, by filter name."""
+
+    stats = {
+        name: filter_.stats
+        for name, filter_
+        in filter_mappings.items()
+        if isinstance(filter_, jpart.filter.MemoizedFilter) is True
+    }
+
+    return stats
+
+
+def _log_prefilter_stats(prefilter):
+
+    stats = prefilter.stats
+
+    _LOGGER.info("Prefilter passed ({}) of ({}) lines ({:.1f}%).".format(
+                 stats['passed'], stats['lines'],
+                 stats['pass_ratio'] * 100))
+
+
+class Partitioner(object):
+    """Builds the rules, filters, and output layer for a config once and then
+    partitions any number of streams with them, keeping the partition handles
+    open in between. Handles that go unused for `cache.idle_seconds` are
+    closed before the next stream. Streams can be fed from several threads
+    but are processed one at a time. Nothing is complete on disk until we're
+    flushed or closed.
+
+    If a cache is given then it's up to the caller to have set up the output
+    layer behind it. With a "shard" config, we write to the shard's subtree of
+    the output path (see `jpart.shard.merge_shards()`).
+    """
+
+    def __init__(
+            self, module_path, output_path, config, cached_resources=None,
+            get_symbol_cb=None):
+
+        engine = config.get('engine', ENGINE__CACHED)
+
+        assert \
+            engine in _ENGINES, \
+            "Engine not valid: [{}]".format(engine)
+
+        # The direct engine doesn't write through partition files
+        assert \
+            engine != ENGINE__DIRECT or \
+            (not config.get('rolling') and not config.get('index')), \
+            "The direct engine doesn't support rolling or indexing."
+
+        cache_config = config.get('cache', {})
+
+        output_path, key_shard, range_shard = \
+            _build_shard_with_config(
+                output_path,
+                config)
+
+        if key_shard is not None or range_shard is not None:
+            os.makedirs(output_path, exist_ok=True)
+
+        self._output_path = output_path
+        self._engine = engine
+        self._batch_size = config.get('batch_size', DEFAULT_BATCH_SIZE)
+        self._do_passthrough = config.get('passthrough', False)
+        self._idle_seconds = cache_config.get('idle_seconds')
+
+        self._lock = threading.Lock()
+        self._is_closed = False
+        self._feeds = 0
+        self._idle_closes = 0
+
+        self._catalog = _build_catalog_with_config(output_path, config)
+
+
+        # Initialize cache
+
+        self._syncer = None
+        if cached_resources is None and engine != ENGINE__DIRECT:
+            self._syncer = _build_syncer_with_config(config)
+
+            fault_cb = \
+                _build_fault_handler_with_config(
+                    output_path,
+                    config,
+                    catalog=self._catalog,
+                    syncer=self._syncer)
+
+            cached_resources = \
+                jpart.cache.CachedResources(
+                    fault_cb,
+                    capacity=cache_config.get('capacity'),
+                    policy=cache_config.get('policy'),
+                    do_track_idle=self._idle_seconds is not None)
+
+        self._cached_resources = cached_resources
+
+
+        # Build rules
+
+        self._filter_mappings = \
+            _build_filters_with_config(
+                module_path,
+                config,
+                get_symbol_cb=get_symbol_cb)
+
+        self._rules = \
+            _build_rules_with_config(
+                module_path,
+                config,
+                cached_resources,
+                catalog=self._catalog,
+                filter_mappings=self._filter_mappings,
+                shard=key_shard)
+
+        self._prefilter = _build_prefilter_with_config(self._rules, config)
+
+        self._sampler, self._reservoir = _build_sampling_with_config(config)
+
+        if range_shard is not None:
+            assert \
+                self._sampler is None, \
+                "Sharding by bytes can't be combined with sampling the input."
+
+            self._sampler = range_shard
+
+        # Every shard sees every unmatched record when sharding by key
+        self._unmatched_sink = None
+        if key_shard is None or key_shard.index == 0:
+            self._unmatched_sink = \
+                _build_unmatched_sink_with_config(
+                    output_path,
+                    config,
+                    cached_resources)
+
+        # Every line that the prefilter would skip is unmatched, and the sink
+        # needs to see it
+        if self._unmatched_sink is not None and self._prefilter is not None:
+            _LOGGER.info("Not prefiltering since unmatched records are "
+                         "collected.")
+
+            self._prefilter = None
+
+        self._governor = \
+            _build_governor_with_config(
+                config,
+                cached_resources,
+                self._filter_mappings,
+                self._catalog,
+                self._unmatched_sink)
+
+    @property
+    def rules(self):
+        return self._rules
+
+    @property
+    def cached_resources(self):
+        return self._cached_resources
+
+    @property
+    def stats(self):
+        stats = {
+            'feeds': self._feeds,
+            'idle_closes': self._idle_closes,
+        }
+
+        if self._cached_resources is not None:
+            stats.update(self._cached_resources.stats)
+
+        if self._governor is not None:
+            stats['memory'] = self._governor.stats
+
+        memoize_stats = _get_memoize_stats(self._filter_mappings)
+        if memoize_stats:
+            stats['memoize'] = memoize_stats
+
+        return stats
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
+
+    def _close_idle(self):
+
+        if self._idle_seconds is None or self._cached_resources is None:
+            return
+
+        closed = self._cached_resources.close_idle(self._idle_seconds)
+        self._idle_closes += closed
+
+    def feed(self, f):
+        """Partition one stream (or `jpart.reader.MappedInput`)."""
+
+        with self._lock:
+            assert \
+                self._is_closed is False, \
+                "Partitioner is closed."
+
+            self._close_idle()
+
+            if self._engine == ENGINE__BATCH:
+                apply_cb = apply_rules_to_input_data_with_rules__batch
+            else:
+                apply_cb = apply_rules_to_input_data_with_rules
+
+            apply_cb(
+                self._output_path,
+                self._rules,
+                f,
+                batch_size=self._batch_size,
+                prefilter=self._prefilter,
+                do_passthrough=self._do_passthrough,
+                unmatched_sink=self._unmatched_sink,
+                sampler=self._sampler,
+                reservoir=self._reservoir,
+                governor=self._governor)
+
+            self._feeds += 1
+
+    def log_stats(self):
+        _log_skips(self._rules, self._unmatched_sink)
+
+        if self._prefilter is not None:
+            _log_prefilter_stats(self._prefilter)
+
+        if self._sampler is not None:
+            _LOGGER.info("Sampled: {}".format(self._sampler.stats))
+
+        if self._governor is not None:
+            _LOGGER.info("Memory: {}".format(self._governor.stats))
+
+        memoize_stats = _get_memoize_stats(self._filter_mappings)
+        for name, stats in sorted(memoize_stats.items()):
+            _LOGGER.info("Memoized filter [{}]: {}".format(name, stats))
+
+    def _flush(self):
+
+        if self._cached_resources is not None:
+            self._cached_resources.flush()
+
+        if self._syncer is not None:
+            self._syncer.sync()
+
+        if self._catalog is not None:
+            self._catalog.flush()
+
+    def flush(self):
+        """Get everything that's been written so far onto disk (as far as the
+        durability setting asks for) while keeping the handles open.
+        """
+
+        with self._lock:
+            self._flush()
+
+    def _close(self):
+
+        if self._cached_resources is not None:
+            self._cached_resources.dispose()
+
+        _teardown_filters(self._filter_mappings)
+
+        if self._syncer is not None:
+            self._syncer.sync()
+
+        if self._catalog is not None:
+            self._catalog.close()
+
+    def close(self):
+        """Close every handle and tear down the filters."""
+
+        with self._lock:
+            if self._is_closed is True:
+                return
+
+            self._is_closed = True
+            self._close()
+
+
+def load_rules_and_apply_to_input_data_with_config(
+        module_path, output_path, config, f, cached_resources=None,
+        do_dispose=True, get_symbol_cb=None):
+    """If we're given a cache then it's up to the caller to have set up the
+    output layer behind it. The catalog, if enabled in the config, is only
+    complete once the handles have been disposed. The input is either a stream
+    or a `jpart.reader.MappedInput`. To partition many streams with the same
+    config, use a `Partitioner`.
+    """
+
+    partitioner = \
+        Partitioner(
+            module_path,
+            output_path,
+            config,
+            cached_resources=cached_resources,
+            get_symbol_cb=get_symbol_cb)
 
     try:
-        apply_rules_to_input_data_with_rules(output_path, rules, f)
+        partitioner.feed(f)
+        partitioner.log_stats()
 
     finally:
         if do_dispose is True:
-            cached_resources.dispose()
+            partitioner.close()
+
+        else:
+            partitioner.flush()
+
+            # The handles outlive us but the filters were built for us alone
+            _teardown_filters(partitioner._filter_mappings)
@@ -0,0 +1,243 @@
+import os
+import json
+import math
+import random
+import logging
+import itertools
+
+import jpart.reader
+
+# The size of every range that's read in the byte-range mode
+DEFAULT_RANGE_BYTES = 1024 * 1024
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def decode_lines(lines, prefilter, do_keep_lines):
+    """Yield (record, line) for every line that passes the prefilter. The
+    lines are strings, bytes, or `memoryview`s.
+    """
+
+    for line in lines:
+        if prefilter is not None and prefilter.check(line) is False:
+            continue
+
+        if line.__class__ is memoryview:
+            line = line.tobytes()
+
+        record = json.loads(line)
+
+        if do_keep_lines is True:
+            yield record, jpart.reader.terminate_line(line)
+
+        else:
+            yield record, None
+
+
+class LineSampler(object):
+    """Keep the first of every N lines. Lines that are skipped are never
+    decoded, and the same input always gives the same sample.
+    """
+
+    def __init__(self, every):
+
+        assert \
+            every > 0, \
+            "Sampling must be at least one: ({})".format(every)
+
+        self._every = every
+
+    @property
+    def stats(self):
+        stats = {
+            'every': self._every,
+        }
+
+        return stats
+
+    def iterate_records(self, f, prefilter=None, do_keep_lines=False):
+        """The input is either a stream or a `jpart.reader.MappedInput`."""
+
+        if isinstance(f, jpart.reader.MappedInput) is True:
+            lines = f.iterate_lines()
+
+        else:
+            f.seek(0)
+            lines = f
+
+        sampled = itertools.islice(lines, 0, None, self._every)
+
+        return decode_lines(sampled, prefilter, do_keep_lines)
+
+
+class ByteRangeSampler(object):
+    """Read about `ratio` of a seekable input as ranges of `range_bytes`
+    starting at random offsets. Every range is resynchronized on the next
+    newline and its last line is read in full, so only whole lines are
+    returned. Ranges that overlap are read once.
+    """
+
+    def __init__(self, ratio, range_bytes=DEFAULT_RANGE_BYTES, seed=None):
+
+        assert \
+            0 < ratio <= 1, \
+            "Ratio must be in (0, 1]: ({})".format(ratio)
+
+        assert \
+            range_bytes > 0, \
+            "Range must be at least one byte: ({})".format(range_bytes)
+
+        self._ratio = ratio
+        self._range_bytes = range_bytes
+        self._random = random.Random(seed)
+
+        self._ranges = 0
+        self._bytes = 0
+
+    @property
+    def stats(self):
+        stats = {
+            'ranges': self._ranges,
+            'bytes': self._bytes,
+        }
+
+        return stats
+
+    def get_offsets(self, size):
+        """Return the sorted offsets to start reading at."""
+
+        if size == 0:
+            return []
+
+        count = int(math.ceil(size * self._ratio / self._range_bytes))
+
+        if count * self._range_bytes >= size:
+            return [0]
+
+        offsets = sorted(
+            self._random.randrange(size)
+            for _
+            in range(count)
+        )
+
+        return offsets
+
+    def _iterate_lines(self, f):
+
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+
+        position = 0
+        for offset in self.get_offsets(size):
+
+            # Continue from wherever the last range stopped rather than reading
+            # anything twice
+            start = max(offset, position)
+            if start >= size:
+                break
+
+            self._ranges += 1
+
+            yield from \
+                jpart.reader.iterate_line_range(
+                    f,
+                    start,
+                    offset + self._range_bytes)
+
+            end = f.tell()
+            if end > position:
+                self._bytes += end - start
+                position = end
+
+    def iterate_records(self, f, prefilter=None, do_keep_lines=False):
+        """The input is either a seekable stream or a
+        `jpart.reader.MappedInput`. Text streams are read through their
+        underlying binary buffer, if they have one, so that offsets are in
+        bytes.
+        """
+
+        if isinstance(f, jpart.reader.MappedInput) is True:
+            with open(f.filepath, 'rb') as bf:
+                lines = self._iterate_lines(bf)
+                yield from decode_lines(lines, prefilter, do_keep_lines)
+
+            return
+
+        f = getattr(f, 'buffer', f)
+
+        assert \
+            f.seekable() is True, \
+            "Byte-range sampling needs a seekable input."
+
+        lines = self._iterate_lines(f)
+        yield from decode_lines(lines, prefilter, do_keep_lines)
+
+
+class PartitionReservoir(object):
+    """Keep a uniform sample of at most K records for every partition of every
+    rule rather than writing them as they come. `write()` writes the sample
+    and starts over.
+    """
+
+    def __init__(self, size, seed=None):
+
+        assert \
+            size > 0, \
+            "Reservoir must hold at least one record: ({})".format(size)
+
+        self._size = size
+        self._random = random.Random(seed)
+
+        # (rule name, phrases) -> [rule, seen, [(record, line), ...]]
+        self._reservoirs = {}
+
+    @property
+    def size(self):
+        return self._size
+
+    def add(self, rule, record, phrases, line=None):
+        """Offer a matched record (with the line that the rule would write, if
+        known) to each of its partitions.
+        """
+
+        for combination in rule.expand(phrases):
+            key = (rule.name, tuple(combination))
+
+            try:
+                reservoir = self._reservoirs[key]
+
+            except KeyError:
+                reservoir = [rule, 0, []]
+                self._reservoirs[key] = reservoir
+
+            reservoir[1] += 1
+            seen = reservoir[1]
+            sample = reservoir[2]
+
+            if len(sample) < self._size:
+                sample.append((record, line))
+                continue
+
+            i = self._random.randrange(seen)
+            if i < self._size:
+                sample[i] = (record, line)
+
+    def write(self, output_path):
+        """Write every partition's sample and then forget them."""
+
+        for (rule_name, phrases), (rule, _, sample) \
+                in self._reservoirs.items():
+
+            lines = [
+                line if line is not None else rule.serialize(record)
+                for record, line
+                in sample
+            ]
+
+            rule.write_records(
+                output_path,
+                rule_name,
+                lines,
+                [list(phrases)] * len(lines))
+
+        self._reservoirs.clear()
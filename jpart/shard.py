@@ -0,0 +1,466 @@
+import os
+import re
+import json
+import logging
+
+import jpart.catalog
+import jpart.compact
+import jpart.filter
+import jpart.index
+import jpart.output
+import jpart.reader
+import jpart.sample
+
+# Every shard reads its own contiguous share of the input's bytes
+SHARD_BY__BYTES = 'bytes'
+
+# Every shard reads the whole input but only writes the partitions whose keys
+# hash to it
+SHARD_BY__KEY = 'key'
+
+SHARD_BYS = (
+    SHARD_BY__BYTES,
+    SHARD_BY__KEY,
+)
+
+_SHARD_DIRNAME_TEMPLATE = 'shard-{:05d}-of-{:05d}'
+_SHARD_DIRNAME_RE = re.compile(r'^shard-([0-9]{5})-of-([0-9]{5})$')
+
+# Records the progress of merging a shard so that it can be resumed
+_JOURNAL_FILENAME = '.merge-journal'
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def get_shard_path(output_path, index, count):
+    """Return the subtree of the output path that a shard writes to."""
+
+    dirname = _SHARD_DIRNAME_TEMPLATE.format(index, count)
+    return os.path.join(output_path, dirname)
+
+
+def find_shard_paths(output_path):
+    """Return the shard subtrees directly under the output path, in shard
+    order.
+    """
+
+    shard_paths = []
+    for dirname in sorted(os.listdir(output_path)):
+        if _SHARD_DIRNAME_RE.match(dirname) is None:
+            continue
+
+        shard_path = os.path.join(output_path, dirname)
+        if os.path.isdir(shard_path) is False:
+            continue
+
+        shard_paths.append(shard_path)
+
+    return shard_paths
+
+
+def _check_shard(index, count):
+
+    assert \
+        count > 0, \
+        "Shard count must be at least one: ({})".format(count)
+
+    assert \
+        0 <= index < count, \
+        "Shard index must be in [0, {}): ({})".format(count, index)
+
+
+class ByteRangeShard(object):
+    """Read the lines that start within this shard's share of the input's
+    bytes. The shares are contiguous and in order, so every line is read by
+    exactly one shard and the shards' outputs, concatenated in shard order,
+    are in input order. Can be given to the engines as a sampler.
+    """
+
+    def __init__(self, index, count):
+        _check_shard(index, count)
+
+        self._index = index
+        self._count = count
+
+    @property
+    def stats(self):
+        stats = {
+            'index': self._index,
+            'count': self._count,
+        }
+
+        return stats
+
+    def get_range(self, size):
+        """Return the [start, end) byte range of an input of the given
+        size.
+        """
+
+        start = size * self._index // self._count
+        end = size * (self._index + 1) // self._count
+
+        return start, end
+
+    def _iterate_lines(self, f):
+
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+
+        start, end = self.get_range(size)
+
+        _LOGGER.info("Reading bytes [{}, {}) of ({}).".format(
+                     start, end, size))
+
+        return jpart.reader.iterate_line_range(f, start, end)
+
+    def iterate_records(self, f, prefilter=None, do_keep_lines=False):
+        """The input is either a seekable stream or a
+        `jpart.reader.MappedInput`. Text streams are read through their
+        underlying binary buffer, if they have one, so that offsets are in
+        bytes.
+        """
+
+        if isinstance(f, jpart.reader.MappedInput) is True:
+            with open(f.filepath, 'rb') as bf:
+                lines = self._iterate_lines(bf)
+
+                yield from \
+                    jpart.sample.decode_lines(
+                        lines,
+                        prefilter,
+                        do_keep_lines)
+
+            return
+
+        f = getattr(f, 'buffer', f)
+
+        assert \
+            f.seekable() is True, \
+            "Sharding by bytes needs a seekable input."
+
+        lines = self._iterate_lines(f)
+        yield from jpart.sample.decode_lines(lines, prefilter, do_keep_lines)
+
+
+class KeyShard(object):
+    """Owns the partitions whose (rule, phrases) keys hash to this shard. The
+    hash is stable across processes and hosts.
+    """
+
+    def __init__(self, index, count):
+        _check_shard(index, count)
+
+        self._index = index
+        self._count = count
+
+    @property
+    def index(self):
+        return self._index
+
+    def is_owned(self, rule_name, phrases):
+        key = (rule_name, tuple(phrases))
+        return jpart.filter.get_stable_hash(key) % self._count == self._index
+
+
+def _remove_empty_paths(path):
+
+    for current_path, folders, filenames in os.walk(path, topdown=False):
+        if not os.listdir(current_path):
+            os.rmdir(current_path)
+
+
+def _read_journal(journal_filepath):
+    """Return the entries of the partitions that an interrupted merge of a
+    shard started (by shard-relative base filepath) and the set of the ones
+    that it finished.
+    """
+
+    started = {}
+    finished = set()
+
+    try:
+        with open(journal_filepath) as f:
+            for line in f:
+
+                # The last write may have been cut short, before anything was
+                # changed for it
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+
+                if entry.get('is_finished') is True:
+                    finished.add(entry['partition'])
+                else:
+                    started[entry['partition']] = entry
+
+    except FileNotFoundError:
+        pass
+
+    return started, finished
+
+
+def _write_journal(f, entry):
+
+    f.write(json.dumps(entry) + '\n')
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _open_journal(journal_filepath):
+
+    f = open(journal_filepath, 'a')
+
+    # Terminate a write that was cut short
+    if f.tell() > 0:
+        with open(journal_filepath, 'rb') as g:
+            g.seek(-1, os.SEEK_END)
+            if g.read(1) != b'\n':
+                f.write('\n')
+
+    return f
+
+
+def _truncate_or_remove(filepath, size):
+
+    if size is None:
+        if os.path.exists(filepath) is True:
+            os.remove(filepath)
+
+    elif os.path.exists(filepath) is True:
+        os.truncate(filepath, size)
+
+
+def _get_size_or_none(filepath):
+
+    try:
+        return os.path.getsize(filepath)
+    except FileNotFoundError:
+        return None
+
+
+def _remove_partition_files(filepaths):
+
+    for filepath in filepaths:
+        sidecar_filepath = jpart.index.get_sidecar_filepath(filepath)
+        if os.path.exists(sidecar_filepath) is True:
+            os.remove(sidecar_filepath)
+
+        if os.path.exists(filepath) is True:
+            os.remove(filepath)
+
+
+def _merge_partition(
+        output_path, shard_path, base_filepath, files, journal_f,
+        started_entry=None):
+    """Append the files of one of a shard's partitions onto the last segment
+    of the same partition in the output path. The target is first put back
+    the way it was if an earlier merge of the partition was interrupted.
+    Returns the target filepath.
+    """
+
+    rel_filepath = os.path.relpath(base_filepath, shard_path)
+
+
+    # Find the target
+
+    if started_entry is not None:
+        target_filepath = \
+            os.path.join(
+                output_path,
+                started_entry['target'])
+
+        sidecar_filepath = jpart.index.get_sidecar_filepath(target_filepath)
+
+        _LOGGER.warning("Redoing interrupted merge into: [{}]".format(
+                        target_filepath))
+
+        _truncate_or_remove(target_filepath, started_entry['size'])
+        _truncate_or_remove(sidecar_filepath, started_entry['index_size'])
+
+    else:
+        target_base_filepath = os.path.join(output_path, rel_filepath)
+
+        state = jpart.output.probe_segment_state(target_base_filepath)
+
+        target_filepath = \
+            jpart.output.get_segment_filepath(
+                target_base_filepath,
+                state.segment)
+
+        sidecar_filepath = jpart.index.get_sidecar_filepath(target_filepath)
+
+    os.makedirs(os.path.dirname(target_filepath), exist_ok=True)
+
+    filepaths = [filepath for _, filepath, _ in files]
+
+
+    # Record how to undo the append before starting it
+
+    size = _get_size_or_none(target_filepath)
+    index_size = _get_size_or_none(sidecar_filepath)
+
+    entry = {
+        'partition': rel_filepath,
+        'target': os.path.relpath(target_filepath, output_path),
+        'size': size,
+        'index_size': index_size,
+        'files': [
+            os.path.relpath(filepath, shard_path)
+            for filepath
+            in filepaths
+        ],
+    }
+
+    _write_journal(journal_f, entry)
+
+
+    # Append
+
+    # If either side was indexed, the result will be
+    stride = \
+        jpart.compact._get_sidecar_stride(
+            [target_filepath] + filepaths)
+
+    if stride is not None and index_size is not None:
+        records = jpart.index.count_records(target_filepath)
+    else:
+        records = None
+
+    with open(target_filepath, 'ab', buffering=0) as f:
+        jpart.compact._concatenate(filepaths, f.fileno())
+        os.fsync(f.fileno())
+
+    if stride is not None:
+        if records is not None or not size:
+            # Only index what was appended
+            jpart.index.extend_index(
+                target_filepath,
+                records or 0,
+                size or 0,
+                stride=stride)
+
+        else:
+            jpart.index.build_index(target_filepath, stride=stride)
+
+
+    # Finish
+
+    _write_journal(
+        journal_f,
+        {
+            'partition': rel_filepath,
+            'is_finished': True,
+        })
+
+    _remove_partition_files(filepaths)
+
+    return target_filepath
+
+
+def merge_shards(
+        output_path, shard_paths=None,
+        catalog_filename=jpart.catalog.DEFAULT_CATALOG_FILENAME):
+    """Move the partitions of every shard subtree into the final layout under
+    the output path, appending them in shard order, and merge their catalogs.
+    Shards that are merged are removed. Segments are appended to rather than
+    rolled, so compact afterwards if that matters. A merge that was
+    interrupted can be resumed by running it again. Returns the number of
+    shards and files that were merged.
+    """
+
+    if shard_paths is None:
+        shard_paths = find_shard_paths(output_path)
+
+    catalog = None
+    files_merged = 0
+    try:
+        for shard_path in shard_paths:
+            _LOGGER.info("Merging shard: [{}]".format(shard_path))
+
+
+            # Move the data
+
+            journal_filepath = os.path.join(shard_path, _JOURNAL_FILENAME)
+            started, finished = _read_journal(journal_filepath)
+
+            # shard-relative filepath -> output-relative filepath
+            rel_filepaths = {}
+
+            # Partitions that an interrupted merge already finished
+            for rel_base_filepath in finished:
+                entry = started[rel_base_filepath]
+
+                for rel_filepath in entry['files']:
+                    rel_filepaths[rel_filepath] = entry['target']
+
+                _remove_partition_files([
+                    os.path.join(shard_path, rel_filepath)
+                    for rel_filepath
+                    in entry['files']
+                ])
+
+                files_merged += len(entry['files'])
+
+            partitions = jpart.compact.find_partitions(shard_path)
+
+            with _open_journal(journal_filepath) as journal_f:
+                for base_filepath, files in sorted(partitions.items()):
+                    rel_base_filepath = \
+                        os.path.relpath(base_filepath, shard_path)
+
+                    target_filepath = \
+                        _merge_partition(
+                            output_path,
+                            shard_path,
+                            base_filepath,
+                            files,
+                            journal_f,
+                            started_entry=started.get(rel_base_filepath))
+
+                    target_rel_filepath = \
+                        os.path.relpath(target_filepath, output_path)
+
+                    for _, filepath, _ in files:
+                        rel_filepath = os.path.relpath(filepath, shard_path)
+                        rel_filepaths[rel_filepath] = target_rel_filepath
+
+                    files_merged += len(files)
+
+
+            # Merge the catalog
+
+            shard_catalog_filepath = \
+                jpart.catalog.get_catalog_filepath(
+                    shard_path,
+                    catalog_filename)
+
+            if os.path.exists(shard_catalog_filepath) is True:
+                if catalog is None:
+                    catalog_filepath = \
+                        jpart.catalog.get_catalog_filepath(
+                            output_path,
+                            catalog_filename)
+
+                    catalog = \
+                        jpart.catalog.Catalog(
+                            catalog_filepath,
+                            output_path)
+
+                catalog.merge(shard_catalog_filepath, rel_filepaths)
+                os.remove(shard_catalog_filepath)
+
+            # Only once everything in the shard has been merged
+            os.remove(journal_filepath)
+
+            _remove_empty_paths(shard_path)
+
+            if os.path.exists(shard_path) is True:
+                _LOGGER.warning("Shard not empty after merging: [{}]".format(
+                                shard_path))
+
+    finally:
+        if catalog is not None:
+            catalog.close()
+
+    return len(shard_paths), files_merged
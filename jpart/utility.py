@@ -2,11 +2,109 @@ import os
 
 
 RESOURCE_APPEND_OPENER = lambda mode: open(mode, 'a')
+RESOURCE_APPEND_BINARY_OPENER = lambda filepath: open(filepath, 'ab')
+
+# All phrases joined into one filename in the rule's directory
+LAYOUT__FLAT = 'flat'
+
+# One directory level per rule part ("field=value"), with the records in a
+# fixed filename at the bottom
+LAYOUT__HIVE = 'hive'
+
+LAYOUTS = (
+    LAYOUT__FLAT,
+    LAYOUT__HIVE,
+)
 
 
 _OUTPUT_SUFFIX = '.jsonl'
+_HIVE_FILENAME = 'part' + _OUTPUT_SUFFIX
+_HIVE_SEPARATOR = '='
 
 def construct_output_filename(phrases):
 
     filename = '-'.join(phrases) + _OUTPUT_SUFFIX
     return filename
+
+
+def construct_output_rel_filepath(field_names, phrases, layout=LAYOUT__FLAT):
+    """Return the path of the partition file relative to the rule's
+    directory.
+    """
+
+    if layout == LAYOUT__FLAT:
+        return construct_output_filename(phrases)
+
+    assert \
+        layout == LAYOUT__HIVE, \
+        "Layout not valid: [{}]".format(layout)
+
+    parts = [
+        '{}{}{}'.format(field_name, _HIVE_SEPARATOR, phrase)
+        for field_name, phrase
+        in zip(field_names, phrases)
+    ]
+
+    parts.append(_HIVE_FILENAME)
+
+    rel_filepath = os.path.join(*parts)
+    return rel_filepath
+
+
+def parse_hive_rel_filepath(rel_filepath):
+    """Return the (field, value) pairs encoded into the directories of a
+    partition file relative to the rule's directory. Readers can use this to
+    prune directories without opening anything.
+    """
+
+    rel_path = os.path.dirname(rel_filepath)
+    if rel_path == '':
+        return []
+
+    pairs = []
+    for part in rel_path.split(os.sep):
+        field_name, separator, phrase = part.partition(_HIVE_SEPARATOR)
+
+        assert \
+            separator == _HIVE_SEPARATOR, \
+            "Path part is not a field assignment: [{}]".format(part)
+
+        pairs.append((field_name, phrase))
+
+    return pairs
+
+
+class CreatedPaths(object):
+    """Remembers the directories that we've already made sure exist so that
+    opening a file doesn't have to consult the filesystem first.
+    """
+
+    def __init__(self):
+        self._paths = set()
+
+    def __contains__(self, path):
+        return path in self._paths
+
+    def ensure(self, path):
+        """Make sure that the directory exists. Returns the directories that
+        had to be created, deepest first.
+        """
+
+        if path in self._paths:
+            return []
+
+        created = []
+        current = path
+        while current and os.path.isdir(current) is False:
+            created.append(current)
+
+            parent = os.path.dirname(current)
+            if parent == current:
+                break
+
+            current = parent
+
+        os.makedirs(path, exist_ok=True)
+        self._paths.add(path)
+
+        return created
@@ -1,6 +1,7 @@
 import os
 import io
 import uuid
+import random
 
 import riu.utility
 
@@ -35,7 +36,7 @@ class Test(object):
 
         # Check registered
 
-        len_ = len(cache._lru)
+        len_ = len(cache.lru)
 
         assert \
             len_ == 2, \
@@ -78,7 +79,7 @@ class Test(object):
             "Index not correct."
 
         assert \
-            cache._lru == expected_keys, \
+            cache.lru == expected_keys, \
             "LRU not correct."
 
 
@@ -104,7 +105,7 @@ class Test(object):
             "Index not correct (after add)."
 
         assert \
-            cache._lru == expected_keys, \
+            cache.lru == expected_keys, \
             "LRU not correct (after add)."
 
 
@@ -120,7 +121,7 @@ class Test(object):
             "Index not correct (after dispose-one)."
 
         assert \
-            cache._lru == expected_keys, \
+            cache.lru == expected_keys, \
             "LRU not correct (after dispose-one)."
 
 
@@ -133,7 +134,7 @@ class Test(object):
             "Index not empty (after dispose-one)."
 
         assert \
-            not cache._lru, \
+            not cache.lru, \
             "LRU not empty (after dispose-one)."
 
 
@@ -165,6 +166,116 @@ class Test(object):
             requested == expected, \
             "Requested resources not accurate:\n{}".format(requested)
 
+    def _run_skewed_workload(self, policy):
+
+        def fault_cb(name):
+            return io.StringIO()
+
+        cache = jpart.cache.CachedResources(fault_cb, capacity=20, policy=policy)
+
+        # A hot set that fits in the cache, interrupted by bursts of one-off
+        # names
+
+        r = random.Random(0)
+        one_off = 0
+        for i in range(5000):
+            if i % 500 < 50:
+                name = 'one-off-{}'.format(one_off)
+                one_off += 1
+
+            else:
+                name = 'hot-{}'.format(r.randrange(15))
+
+            cache.get_or_create(name)
+
+        return cache.stats
+
+    def test_two_queue_policy(self):
+
+        lru_stats = self._run_skewed_workload(jpart.cache.POLICY__LRU)
+        two_queue_stats = \
+            self._run_skewed_workload(jpart.cache.POLICY__TWO_QUEUE)
+
+        assert \
+            two_queue_stats['faults'] < lru_stats['faults'], \
+            "Expected fewer faults with 2Q: {} {}".format(
+            two_queue_stats, lru_stats)
+
+        assert \
+            two_queue_stats['closes'] < lru_stats['closes'], \
+            "Expected fewer closes with 2Q: {} {}".format(
+            two_queue_stats, lru_stats)
+
+        # The only unavoidable faults are the first sight of every name
+        assert \
+            two_queue_stats['faults'] <= 500 + 15 + 15, \
+            "Too many faults with 2Q: {}".format(two_queue_stats)
+
+    def test_two_queue_promotion(self):
+
+        def fault_cb(name):
+            return io.StringIO()
+
+        cache = \
+            jpart.cache.CachedResources(
+                fault_cb,
+                capacity=4,
+                policy=jpart.cache.POLICY__TWO_QUEUE)
+
+        # "a" is evicted from the FIFO, remembered, and then promoted when it
+        # comes back
+
+        for name in ('a', 'b', 'c', 'd', 'e', 'a'):
+            cache.get_or_create(name)
+
+        for name in ('f', 'g', 'h'):
+            cache.get_or_create(name)
+
+        expected = ['f', 'g', 'h', 'a']
+
+        assert \
+            cache.lru == expected, \
+            "Eviction order not correct: {}".format(cache.lru)
+
+    def test_close_idle(self):
+
+        def fault_cb(name):
+            return io.StringIO()
+
+        for policy in (jpart.cache.POLICY__LRU, jpart.cache.POLICY__TWO_QUEUE):
+            cache = \
+                jpart.cache.CachedResources(
+                    fault_cb,
+                    capacity=4,
+                    policy=policy,
+                    do_track_idle=True)
+
+            for name in ('a', 'b', 'c'):
+                cache.get_or_create(name)
+
+            cache._last_used['a'] -= 100
+            cache._last_used['c'] -= 100
+
+            closed = cache.close_idle(50)
+
+            assert \
+                closed == 2, \
+                "Expected two idle resources ({}): ({})".format(policy, closed)
+
+            assert \
+                cache.lru == ['b'], \
+                "Remaining resources not correct ({}): {}".format(
+                policy, cache.lru)
+
+            # The policy can still evict normally
+
+            for name in ('d', 'e', 'f', 'g'):
+                cache.get_or_create(name)
+
+            assert \
+                len(cache.index) == 4, \
+                "Capacity not respected ({}): {}".format(policy, cache.lru)
+
     def test_default_fault_handler(self):
 
         with riu.utility.temp_path() as temp_path:
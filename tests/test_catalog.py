@@ -0,0 +1,198 @@
+import os
+import io
+
+import riu.journal
+import riu.utility
+
+import jpart.rule
+import jpart.catalog
+import jpart.compact
+
+
+class Test(object):
+    def test_parse_predicate(self):
+
+        actual = jpart.catalog.parse_predicate('field1>=aa=bb')
+
+        assert \
+            actual == ('field1', '>=', 'aa=bb'), \
+            "Predicate not correct: {}".format(actual)
+
+        try:
+            jpart.catalog.parse_predicate('field1')
+
+        except ValueError:
+            pass
+
+        else:
+            raise Exception("Expected ValueError.")
+
+    def test_catalog(self):
+
+        with riu.utility.temp_path() as output_path:
+
+            config = {
+                'catalog': True,
+                'rolling': {
+                    'max_records': 2,
+                },
+                'rules': {
+                    'rule1': ['field1', 'field2'],
+                    'rule2': ['field2'],
+                },
+            }
+
+            input_data = io.StringIO()
+            for i in range(3):
+                riu.journal.journalize(input_data, field1='aa', field2='bb')
+
+            riu.journal.journalize(input_data, field1='cc', field2='dd')
+
+            input_data.seek(0)
+
+            jpart.rule.load_rules_and_apply_to_input_data_with_config(
+                None,
+                output_path,
+                config,
+                input_data)
+
+
+            # Find
+
+            catalog_filepath = \
+                jpart.catalog.get_catalog_filepath(output_path)
+
+            catalog = jpart.catalog.Catalog(catalog_filepath, output_path)
+
+            try:
+                rows = catalog.find(rule_name='rule1')
+                actual = [(path, records) for path, records, _ in rows]
+
+                expected = [
+                    (os.path.join('rule1', 'aa-bb.jsonl'), 2),
+                    (os.path.join('rule1', 'aa-bb-00001.jsonl'), 1),
+                    (os.path.join('rule1', 'cc-dd.jsonl'), 1),
+                ]
+
+                assert \
+                    actual == expected, \
+                    "Rule files not correct: {}".format(actual)
+
+                rows = \
+                    catalog.find(
+                        predicates=[
+                            ('field2', '>', 'bb'),
+                        ])
+
+                actual = [path for path, _, _ in rows]
+
+                expected = [
+                    os.path.join('rule1', 'cc-dd.jsonl'),
+                    os.path.join('rule2', 'dd.jsonl'),
+                ]
+
+                assert \
+                    actual == expected, \
+                    "Predicate files not correct: {}".format(actual)
+
+                # Byte counts match what's on disk
+
+                for path, _, bytes_ in catalog.find():
+                    size = os.path.getsize(os.path.join(output_path, path))
+
+                    assert \
+                        bytes_ == size, \
+                        "Bytes for [{}] not correct: ({}) != ({})".format(
+                            path, bytes_, size)
+
+            finally:
+                catalog.close()
+
+
+            # Compacting updates the catalog
+
+            jpart.compact.compact_output_path(output_path, processes=1)
+
+            catalog = jpart.catalog.Catalog(catalog_filepath, output_path)
+
+            try:
+                rows = \
+                    catalog.find(
+                        rule_name='rule1',
+                        predicates=[
+                            ('field1', '=', 'aa'),
+                        ])
+
+                actual = [(path, records) for path, records, _ in rows]
+
+                expected = [
+                    (os.path.join('rule1', 'aa-bb.jsonl'), 3),
+                ]
+
+                assert \
+                    actual == expected, \
+                    "Compacted files not correct: {}".format(actual)
+
+                rel_filepaths = [path for path, _, _ in rows]
+
+            finally:
+                catalog.close()
+
+            f = io.BytesIO()
+            jpart.catalog.copy_files(output_path, rel_filepaths, f)
+
+            f.seek(0)
+            records = list(riu.journal.parse_journal_stream_gen(f))
+
+            assert \
+                len(records) == 3, \
+                "Copied records not correct: {}".format(records)
+
+    def test_catalog__unmatched(self):
+
+        input_data = io.StringIO()
+        riu.journal.journalize(input_data, field2='xx')
+        riu.journal.journalize(input_data, field1='aa', field2='bb')
+
+        with riu.utility.temp_path() as output_path:
+
+            # The governor flushes the catalog after every batch, too
+
+            config = {
+                'catalog': True,
+                'unmatched': True,
+                'memory_limit': 1,
+                'rules': {
+                    'rule1': ['field1', 'field2'],
+                },
+            }
+
+            jpart.rule.load_rules_and_apply_to_input_data_with_config(
+                None,
+                output_path,
+                config,
+                input_data)
+
+            with open(jpart.rule.DEFAULT_UNMATCHED_FILENAME) as f:
+                records = list(riu.journal.parse_journal_stream_gen(f))
+
+            assert \
+                [record['field2'] for record in records] == ['xx'], \
+                "Unmatched records not correct: {}".format(records)
+
+            catalog_filepath = \
+                jpart.catalog.get_catalog_filepath(output_path)
+
+            catalog = jpart.catalog.Catalog(catalog_filepath, output_path)
+
+            try:
+                paths = [path for path, _, _ in catalog.find()]
+
+            finally:
+                catalog.close()
+
+            # Only the partition is cataloged
+
+            assert \
+                paths == [os.path.join('rule1', 'aa-bb.jsonl')], \
+                "Cataloged files not correct: {}".format(paths)
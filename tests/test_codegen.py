@@ -0,0 +1,305 @@
+import os
+import json
+
+import riu.journal
+import riu.utility
+
+import jpart.codegen
+import jpart.filter
+import jpart.rule
+
+
+class _LowerFilter(jpart.filter.BaseFilter):
+    def get_value(self, name, record):
+        return record[name].lower()
+
+    def does_qualify(self, name, value):
+        return value != 'no'
+
+
+class _StrictFilter(jpart.filter.BaseFilter):
+    def get_value(self, name, record):
+        try:
+            return record[name]
+
+        except KeyError:
+            raise \
+                jpart.filter.SkipRuleException(
+                    name,
+                    'strict: not found')
+
+
+class _BatchFilter(_StrictFilter):
+    def get_values(self, name, records):
+        return [
+            record.get(name, jpart.filter.SKIP)
+            for record
+            in records
+        ]
+
+
+_FILTER_MAPPINGS = {
+    'lower': _LowerFilter,
+    'strict': _StrictFilter,
+    'batch': _BatchFilter,
+}
+
+
+def _build_rules(rule_raw, filter_mappings=_FILTER_MAPPINGS):
+    """Return a generic and a compiled rule for the same parts."""
+
+    generic = jpart.rule.Rule(filter_mappings, 'rule1', rule_raw)
+
+    compiled = \
+        jpart.rule.Rule(
+            filter_mappings,
+            'rule1',
+            rule_raw,
+            do_compile=True)
+
+    return generic, compiled
+
+
+def _check_same(generic, compiled, records):
+
+    expected = [generic.apply(record) for record in records]
+    actual = [compiled.apply(record) for record in records]
+
+    assert \
+        actual == expected, \
+        "Compiled values not correct:\n{}\n{}".format(actual, expected)
+
+    assert \
+        compiled.skips == generic.skips, \
+        "Compiled skips not correct:\n{}\n{}".format(
+        compiled.skips, generic.skips)
+
+    expected = generic.apply_batch(records)
+    actual = compiled.apply_batch(records)
+
+    assert \
+        actual == expected, \
+        "Compiled batch values not correct:\n{}\n{}".format(actual, expected)
+
+    assert \
+        compiled.skips == generic.skips, \
+        "Compiled batch skips not correct:\n{}\n{}".format(
+        compiled.skips, generic.skips)
+
+
+class Test(object):
+    def test_compile_rule__fields(self):
+
+        rule_raw = [
+            'field1',
+            'a.b.c',
+            'items.1',
+        ]
+
+        generic, compiled = _build_rules(rule_raw)
+
+        records = [
+            { 'field1': 'aa', 'a': { 'b': { 'c': 'cc' } }, 'items': [1, 2] },
+            { 'field1': 5, 'a': { 'b': { 'c': 1.5 } }, 'items': ['x', 'y'] },
+            { 'field1': True, 'a': { 'b': { 'c': 'cc' } }, 'items': [1, 2] },
+            { 'a': { 'b': { 'c': 'cc' } }, 'items': [1, 2] },
+            { 'field1': 'aa', 'a': { 'b': {} }, 'items': [1, 2] },
+            { 'field1': 'aa', 'a': None, 'items': [1, 2] },
+            { 'field1': 'aa', 'a': { 'b': None }, 'items': [1, 2] },
+            { 'field1': 'aa', 'a': { 'b': { 'c': 'cc' } } },
+        ]
+
+        _check_same(generic, compiled, records)
+
+        expected = [
+            ['aa', 'cc', '2'],
+            ['5', '1.5', 'y'],
+            ['True', 'cc', '2'],
+            None,
+            None,
+            None,
+            None,
+            None,
+        ]
+
+        actual = [compiled.apply(record) for record in records]
+
+        assert \
+            actual == expected, \
+            "Values not correct: {}".format(actual)
+
+    def test_compile_rule__filters(self):
+
+        rule_raw = [
+            ('field1', '!lower'),
+            ('field2', '!strict'),
+            'field3',
+        ]
+
+        generic, compiled = _build_rules(rule_raw)
+
+        records = [
+            { 'field1': 'AA', 'field2': 'bb', 'field3': 'cc' },
+            { 'field1': 'No', 'field2': 'bb', 'field3': 'cc' },
+            { 'field1': 'AA', 'field3': 'cc' },
+            { 'field1': 'AA', 'field2': 'bb' },
+        ]
+
+        _check_same(generic, compiled, records)
+
+        expected = {
+            ('field1', jpart.rule.SKIP_REASON_MODULE__NOT_QUALIFIED): 2,
+            ('field2', 'strict: not found'): 2,
+            ('field3', jpart.rule.SKIP_REASON_DEFAULT__NOT_FOUND): 2,
+        }
+
+        assert \
+            compiled.skips == expected, \
+            "Skips not correct: {}".format(compiled.skips)
+
+    def test_compile_rule__batch_filter(self):
+
+        # A filter with its own batch methods keeps the generic batch path
+
+        rule_raw = [
+            'field1',
+            ('field2', '!batch'),
+        ]
+
+        generic, compiled = _build_rules(rule_raw)
+
+        apply, apply_batch = jpart.codegen.compile_rule(generic)
+
+        assert \
+            apply_batch is None, \
+            "Expected no compiled batch function."
+
+        records = [
+            { 'field1': 'aa', 'field2': 'bb' },
+            { 'field1': 'aa' },
+        ]
+
+        _check_same(generic, compiled, records)
+
+    def test_compile_rule__fan_out(self):
+
+        rule_raw = [
+            { 'field': 'tags', 'fan_out': True },
+            'field1',
+        ]
+
+        filter_mappings = {}
+
+        generic = \
+            jpart.rule.Rule(
+                filter_mappings,
+                'rule1',
+                rule_raw,
+                fan_out_limit=2)
+
+        compiled = \
+            jpart.rule.Rule(
+                filter_mappings,
+                'rule1',
+                rule_raw,
+                fan_out_limit=2,
+                do_compile=True)
+
+        records = [
+            { 'tags': ['aa', 'bb', 'aa'], 'field1': 'xx' },
+            { 'tags': 'aa', 'field1': 'xx' },
+            { 'tags': [], 'field1': 'xx' },
+            { 'tags': ['aa', 'bb', 'cc'], 'field1': 'xx' },
+            { 'tags': ['aa'] },
+        ]
+
+        _check_same(generic, compiled, records)
+
+    def test_compile_rule__not_valid(self):
+
+        rule_raw = [
+            'field1',
+        ]
+
+        generic, compiled = _build_rules(rule_raw)
+
+        for value in ('a/b', ['aa'], None):
+            record = {
+                'field1': value,
+            }
+
+            for rule in (generic, compiled):
+                try:
+                    rule.apply(record)
+
+                except AssertionError:
+                    pass
+
+                else:
+                    raise Exception("Expected invalid value to fail: {}".format(
+                                    value))
+
+    def test_load_rules_and_apply_to_input_data_with_config__compile(self):
+
+        rules = {
+            'rule1': [
+                'field1',
+                'a.b',
+            ],
+            'rule2': [
+                { 'field': 'tags', 'fan_out': True },
+            ],
+        }
+
+        records = [
+            { 'field1': 'aa', 'a': { 'b': 'x' }, 'tags': ['t1', 't2'] },
+            { 'field1': 'bb', 'a': { 'b': 'y' }, 'tags': [] },
+            { 'field1': 'aa', 'a': None, 'tags': 't1' },
+            { 'field1': 'aa', 'a': { 'b': 'x' } },
+        ]
+
+        with riu.utility.temp_path() as temp_path:
+            input_filepath = os.path.join(temp_path, 'input.jsonl')
+            with open(input_filepath, 'w') as f:
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+
+            trees = []
+            for do_compile in (False, True):
+                output_path = \
+                    os.path.join(temp_path, 'output{}'.format(int(do_compile)))
+
+                os.mkdir(output_path)
+
+                config = {
+                    'rules': rules,
+                    'compile': do_compile,
+                }
+
+                with open(input_filepath) as f:
+                    jpart.rule.load_rules_and_apply_to_input_data_with_config(
+                        None,
+                        output_path,
+                        config,
+                        f)
+
+                tree = {}
+                for current_path, folders, filenames in os.walk(output_path):
+                    for filename in filenames:
+                        filepath = os.path.join(current_path, filename)
+                        rel_filepath = os.path.relpath(filepath, output_path)
+
+                        with open(filepath) as f:
+                            tree[rel_filepath] = f.read()
+
+                trees.append(tree)
+
+        uncompiled, compiled = trees
+
+        assert \
+            uncompiled, \
+            "Expected output."
+
+        assert \
+            compiled == uncompiled, \
+            "Compiled output not correct:\n{}\n{}".format(compiled, uncompiled)
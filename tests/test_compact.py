@@ -0,0 +1,206 @@
+import os
+
+import riu.utility
+
+import jpart.index
+import jpart.output
+import jpart.compact
+
+
+def _read_partition(base_filepath):
+
+    content = ''
+    segment = 0
+    while True:
+        filepath = jpart.output.get_segment_filepath(base_filepath, segment)
+        if os.path.exists(filepath) is False:
+            break
+
+        with open(filepath) as f:
+            content += f.read()
+
+        segment += 1
+
+    return content
+
+
+class Test(object):
+    def test_find_partitions(self):
+
+        with riu.utility.temp_path() as temp_path:
+            os.mkdir('rule1')
+
+            filenames = [
+                'aa.jsonl',
+                'aa-00001.jsonl',
+                'aa-00002.jsonl',
+
+                # Not a segment since there's no "bb.jsonl"
+                'bb-00001.jsonl',
+
+                # Hidden
+                '.aa.jsonl.compact-1',
+            ]
+
+            for filename in filenames:
+                with open(os.path.join('rule1', filename), 'w') as f:
+                    f.write('{}\n')
+
+            partitions = jpart.compact.find_partitions(temp_path)
+
+            actual = {
+                os.path.relpath(base_filepath, temp_path): [
+                    (segment, os.path.basename(filepath))
+                    for segment, filepath, _
+                    in files
+                ]
+                for base_filepath, files
+                in partitions.items()
+            }
+
+            expected = {
+                os.path.join('rule1', 'aa.jsonl'): [
+                    (0, 'aa.jsonl'),
+                    (1, 'aa-00001.jsonl'),
+                    (2, 'aa-00002.jsonl'),
+                ],
+                os.path.join('rule1', 'bb-00001.jsonl'): [
+                    (0, 'bb-00001.jsonl'),
+                ],
+            }
+
+            assert \
+                actual == expected, \
+                "Partitions not correct:\n{}".format(actual)
+
+    def test_plan_bins(self):
+
+        files = [
+            (0, 'a', 3),
+            (1, 'b', 3),
+            (2, 'c', 10),
+            (3, 'd', 2),
+            (4, 'e', 2),
+        ]
+
+        bins = jpart.compact.plan_bins(files, 6)
+
+        actual = [
+            [filepath for _, filepath, _ in bin_]
+            for bin_
+            in bins
+        ]
+
+        expected = [
+            ['a', 'b'],
+            ['c'],
+            ['d', 'e'],
+        ]
+
+        assert \
+            actual == expected, \
+            "Bins not correct: {}".format(actual)
+
+    def test_compact_output_path(self):
+
+        with riu.utility.temp_path() as temp_path:
+
+            # Write a rolled partition
+
+            base_filepath = os.path.join(temp_path, 'rule1', 'aa.jsonl')
+            os.mkdir('rule1')
+
+            f = jpart.output.PartitionFile(base_filepath, max_records=2)
+
+            for i in range(9):
+                f.write('{{"i": {}}}\n'.format(i))
+
+            f.close()
+
+            # A truncated record shouldn't run into the next file
+
+            with open(base_filepath, 'a') as f:
+                f.write('{"truncated"')
+
+            expected = _read_partition(base_filepath)
+            expected = expected.replace('"truncated"', '"truncated"\n')
+
+
+            # Compact
+
+            compacted, removed = \
+                jpart.compact.compact_output_path(
+                    temp_path,
+                    target_bytes=50,
+                    processes=1)
+
+            assert \
+                (compacted, removed) == (1, 3), \
+                "Counts not correct: ({}) ({})".format(compacted, removed)
+
+            actual = sorted(os.listdir(os.path.join(temp_path, 'rule1')))
+
+            assert \
+                actual == ['aa-00001.jsonl', 'aa.jsonl'], \
+                "Files not correct: {}".format(actual)
+
+            actual = _read_partition(base_filepath)
+
+            assert \
+                actual == expected, \
+                "Content not correct:\n{}".format(actual)
+
+
+            # Nothing left to do
+
+            compacted, removed = \
+                jpart.compact.compact_output_path(
+                    temp_path,
+                    target_bytes=50,
+                    processes=1)
+
+            assert \
+                (compacted, removed) == (0, 0), \
+                "Expected nothing to do: ({}) ({})".format(compacted, removed)
+
+    def test_compact_output_path__index(self):
+
+        with riu.utility.temp_path() as temp_path:
+
+            base_filepath = os.path.join(temp_path, 'aa.jsonl')
+
+            f = \
+                jpart.output.PartitionFile(
+                    base_filepath,
+                    max_records=3,
+                    index_stride=2)
+
+            for i in range(10):
+                f.write('{{"i": {}}}\n'.format(i))
+
+            f.close()
+
+            jpart.compact.compact_output_path(
+                temp_path,
+                target_bytes=1000,
+                processes=1)
+
+            actual = sorted(os.listdir(temp_path))
+
+            assert \
+                actual == ['aa.jsonl', 'aa.jsonl.idx'], \
+                "Files not correct: {}".format(actual)
+
+            # The merged file was reindexed with the same stride
+
+            record = jpart.index.get_record(base_filepath, 7)
+
+            assert \
+                record == {'i': 7}, \
+                "Record not correct: {}".format(record)
+
+            entries = jpart.index.load_index(base_filepath)
+
+            assert \
+                list(entries[0::2]) == [0, 2, 4, 6, 8], \
+                "Index not correct: {}".format(list(entries))
@@ -0,0 +1,169 @@
+import io
+
+import riu.journal
+
+import jpart.rule
+import jpart.dry_run
+
+
+class Test(object):
+    def test_plan_with_config(self):
+
+        config = {
+            'rules': {
+                'rule1': ['field1', 'field2'],
+                'rule2': ['field3'],
+            },
+        }
+
+        input_data = io.StringIO()
+        riu.journal.journalize(input_data, field1='aa', field2='bb', field3='cc')
+        riu.journal.journalize(input_data, field1='aa', field2='bb', field3='dd')
+        riu.journal.journalize(input_data, field1='ee', field2='ff')
+        riu.journal.journalize(input_data, field4='gg')
+
+        input_data.seek(0)
+
+        plan = \
+            jpart.dry_run.plan_with_config(
+                None,
+                config,
+                input_data,
+                descriptor_limit=1000)
+
+        assert \
+            plan.records == 4, \
+            "Record count not correct: ({})".format(plan.records)
+
+        estimate1 = plan.estimates[0]
+
+        actual = [
+            (estimate.rule_name, estimate.distinct, estimate.records)
+            for estimate
+            in plan.estimates
+        ]
+
+        expected = [
+            ('rule1', 2, 3),
+            ('rule2', 2, 2),
+        ]
+
+        assert \
+            actual == expected, \
+            "Estimates not correct: {}".format(actual)
+
+        heaviest = estimate1.get_heaviest(1)
+
+        assert \
+            [name for name, _, _ in heaviest] == ['aa-bb.jsonl'], \
+            "Heaviest partition not correct: {}".format(heaviest)
+
+        assert \
+            heaviest[0][1] == 2, \
+            "Heaviest partition record-count not correct: {}".format(heaviest)
+
+        assert \
+            plan.recommended_capacity == 4, \
+            "Recommended capacity not correct: ({})".format(
+                plan.recommended_capacity)
+
+        # Nothing here is written more than once or twice
+        assert \
+            plan.recommended_engine == jpart.rule.ENGINE__DIRECT, \
+            "Recommended engine not correct: [{}]".format(
+                plan.recommended_engine)
+
+        report = jpart.dry_run.format_plan(plan)
+
+        assert \
+            'Rule [rule1]:' in report, \
+            "Report not correct:\n{}".format(report)
+
+    def test_plan_with_config__sample(self):
+
+        config = {
+            'rules': {
+                'rule1': ['field1'],
+            },
+        }
+
+        input_data = io.StringIO()
+        for i in range(10):
+            riu.journal.journalize(input_data, field1='aa')
+
+        input_data.seek(0)
+
+        plan = \
+            jpart.dry_run.plan_with_config(
+                None,
+                config,
+                input_data,
+                sample_size=3,
+                descriptor_limit=1000)
+
+        assert \
+            plan.records == 3, \
+            "Sample not honored: ({})".format(plan.records)
+
+        assert \
+            plan.recommended_engine == jpart.rule.ENGINE__BATCH, \
+            "Recommended engine not correct: [{}]".format(
+                plan.recommended_engine)
+
+    def test_plan_with_config__bytes(self):
+
+        config = {
+            'rules': {
+                'rule1': ['field1'],
+            },
+        }
+
+        # Sizes are in bytes, not characters
+
+        line = '{"field1": "aa", "field2": "\u00e9\u00e9"}\n'
+
+        plan = \
+            jpart.dry_run.plan_with_config(
+                None,
+                config,
+                io.StringIO(line),
+                descriptor_limit=1000)
+
+        expected = len(line.encode('utf-8'))
+
+        assert \
+            plan.bytes == expected and plan.estimates[0].bytes == expected, \
+            "Bytes not correct: ({}) != ({})".format(plan.bytes, expected)
+
+    def test_rule_estimate__bounded(self):
+
+        estimate = jpart.dry_run.RuleEstimate('rule1', capacity=100)
+
+        # One heavy partition and many light ones
+
+        for i in range(5000):
+            estimate.add('heavy', 100)
+            estimate.add('light{}'.format(i), 1)
+
+
+        assert \
+            estimate.is_exact is False, \
+            "Expected the estimate to have become approximate."
+
+        assert \
+            len(estimate._partitions) <= 200, \
+            "Tracked partitions not bounded: ({})".format(
+                len(estimate._partitions))
+
+        # HyperLogLog is accurate to within a few percent at this precision
+        distinct = estimate.distinct
+
+        assert \
+            4800 <= distinct <= 5200, \
+            "Distinct estimate not close: ({})".format(distinct)
+
+        heaviest = estimate.get_heaviest(1)
+
+        assert \
+            heaviest == [('heavy', 5000, 500000)], \
+            "Heaviest partition not correct: {}".format(heaviest)
@@ -0,0 +1,147 @@
+import os
+import io
+
+import riu.journal
+import riu.utility
+
+import jpart.rule
+import jpart.output
+import jpart.durability
+
+
+class Test(object):
+    def test_periodic(self):
+
+        with riu.utility.temp_path() as temp_path:
+
+            syncer = \
+                jpart.durability.SyncCoordinator(
+                    jpart.durability.DURABILITY__PERIODIC,
+                    interval_bytes=25)
+
+            fault_cb = \
+                jpart.output.PartitionFaultHandler(
+                    temp_path,
+                    syncer=syncer)
+
+            f1 = fault_cb(os.path.join('rule1', 'aa.jsonl'))
+            f2 = fault_cb(os.path.join('rule1', 'bb.jsonl'))
+
+            f1.write('{"aa": 1}\n')
+            f2.write('{"aa": 2}\n')
+
+            assert \
+                syncer.stats['syncs'] == 0, \
+                "Synced too early: {}".format(syncer.stats)
+
+            # Crosses the threshold. Both dirty files, the new directory, and
+            # the path that it was created in are synced together.
+
+            f1.write('{"aa": 3}\n')
+
+            assert \
+                syncer.stats == { 'syncs': 1, 'fsyncs': 4 }, \
+                "Group sync not correct: {}".format(syncer.stats)
+
+            # A file that's closed while dirty is synced with the next group
+
+            f2.write('{"aa": 4}\n')
+            f2.close()
+            f1.close()
+
+            syncer.sync()
+
+            assert \
+                syncer.stats == { 'syncs': 2, 'fsyncs': 5 }, \
+                "Deferred sync not correct: {}".format(syncer.stats)
+
+    def test_periodic__nested(self):
+
+        with riu.utility.temp_path() as temp_path:
+
+            syncer = \
+                jpart.durability.SyncCoordinator(
+                    jpart.durability.DURABILITY__PERIODIC,
+                    interval_seconds=3600)
+
+            fault_cb = \
+                jpart.output.PartitionFaultHandler(
+                    temp_path,
+                    syncer=syncer)
+
+            f = fault_cb(os.path.join('rule1', 'a=x', 'b=y', 'aa.jsonl'))
+            f.write('{"aa": 1}\n')
+
+            syncer.sync()
+
+            # The file, and every new directory along with the one that it was
+            # created in
+
+            assert \
+                syncer.stats == { 'syncs': 1, 'fsyncs': 5 }, \
+                "Nested sync not correct: {}".format(syncer.stats)
+
+            f.close()
+
+    def test_close(self):
+
+        with riu.utility.temp_path() as temp_path:
+
+            syncer = \
+                jpart.durability.SyncCoordinator(
+                    jpart.durability.DURABILITY__CLOSE,
+                    do_sync_directories=False)
+
+            fault_cb = \
+                jpart.output.PartitionFaultHandler(
+                    temp_path,
+                    max_records=2,
+                    syncer=syncer)
+
+            f = fault_cb('aa.jsonl')
+
+            for i in range(5):
+                f.write('{{"aa": {}}}\n'.format(i))
+
+            # Every segment that we rolled away from was synced as it was
+            # closed
+
+            assert \
+                syncer.stats['fsyncs'] == 2, \
+                "Close syncs not correct: {}".format(syncer.stats)
+
+            f.close()
+
+            assert \
+                syncer.stats['fsyncs'] == 3, \
+                "Close syncs not correct: {}".format(syncer.stats)
+
+    def test_load_rules_and_apply_to_input_data_with_config(self):
+
+        input_data = io.StringIO()
+        riu.journal.journalize(input_data, field1='aa')
+        riu.journal.journalize(input_data, field1='bb')
+
+        with riu.utility.temp_path() as output_path:
+
+            config = {
+                'durability': {
+                    'mode': 'periodic',
+                    'interval_seconds': 3600,
+                },
+                'rules': {
+                    'rule1': ['field1'],
+                },
+            }
+
+            jpart.rule.load_rules_and_apply_to_input_data_with_config(
+                None,
+                output_path,
+                config,
+                input_data)
+
+            filenames = sorted(os.listdir('rule1'))
+
+            assert \
+                filenames == ['aa.jsonl', 'bb.jsonl'], \
+                "Written files not correct: {}".format(filenames)
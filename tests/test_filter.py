@@ -30,3 +30,354 @@ class TestBaseFilter(object):
             actual == 33, \
             "Expected value not correct (3): {}".format(actual)
 
+
+    def test_get_values(self):
+
+        class _TestFilter(jpart.filter.BaseFilter):
+            def get_value(self, name, record):
+                value = super().get_value(name, record)
+                if value == 'skip':
+                    raise jpart.filter.SkipRuleException(name, 'test')
+
+                return value
+
+            def does_qualify(self, name, value):
+                return value != 'bad'
+
+        tf = _TestFilter()
+
+        records = [
+            { 'aa': 'xx' },
+            { 'aa': 'skip' },
+            { 'aa': 'bad' },
+        ]
+
+        values = tf.get_values('aa', records)
+
+        # A skip comes back as the exception, which says why
+
+        e = values[1]
+
+        assert \
+            isinstance(e, jpart.filter.SkipRuleException) is True and \
+            (e.field_name, e.reason) == ('aa', 'test'), \
+            "Skip not correct: {}".format(values)
+
+        assert \
+            [values[0], values[2]] == ['xx', 'bad'], \
+            "Values not correct: {}".format(values)
+
+        qualifies = tf.does_qualify_batch('aa', ['xx', 'bad'])
+
+        assert \
+            qualifies == [True, False], \
+            "Qualifications not correct: {}".format(qualifies)
+
+
+class _CountingFilter(jpart.filter.BaseFilter):
+    def __init__(self):
+        self.value_calls = 0
+        self.qualify_calls = 0
+
+    def get_value(self, name, record):
+        self.value_calls += 1
+
+        value = super().get_value(name, record)
+        return value.lower()
+
+    def does_qualify(self, name, value):
+        self.qualify_calls += 1
+
+        return value != 'skip'
+
+
+class TestMemoizedFilter(object):
+    def test_does_qualify(self):
+
+        cf = _CountingFilter()
+        mf = jpart.filter.MemoizedFilter(cf, size=2)
+
+        for value in ('aa', 'aa', 'skip', 'aa', 'bb', 'cc', 'aa'):
+            expected = value != 'skip'
+            actual = mf.does_qualify('field1', value)
+
+            assert \
+                actual is expected, \
+                "Qualification not correct for [{}]: {}".format(value, actual)
+
+        # "aa" is hit twice and then evicted by "bb" and "cc"
+
+        assert \
+            cf.qualify_calls == 5, \
+            "Calls not correct: ({})".format(cf.qualify_calls)
+
+        stats = mf.stats['qualify']
+
+        assert \
+            (stats['hits'], stats['misses'], stats['size']) == (2, 5, 2), \
+            "Stats not correct: {}".format(stats)
+
+        # Unhashable values are passed through
+
+        actual = mf.does_qualify('field1', ['aa'])
+
+        assert \
+            actual is True, \
+            "Unhashable value not qualified."
+
+    def test_get_value(self):
+
+        cf = _CountingFilter()
+        mf = jpart.filter.MemoizedFilter(cf, do_memoize_value=True)
+
+        records = [
+            { 'field1': 'AA' },
+            { 'field1': 'AA', 'field2': 'xx' },
+            { 'field1': 'BB' },
+        ]
+
+        actual = [mf.get_value('field1', record) for record in records]
+
+        assert \
+            actual == ['aa', 'aa', 'bb'], \
+            "Values not correct: {}".format(actual)
+
+        assert \
+            cf.value_calls == 2, \
+            "Calls not correct: ({})".format(cf.value_calls)
+
+        # Missing fields are left to the filter
+
+        try:
+            mf.get_value('field1', {})
+
+        except KeyError:
+            pass
+
+        else:
+            raise Exception("Expected KeyError.")
+
+
+class TestTimeBucketFilter(object):
+    def test_get_bucket(self):
+
+        tbf = jpart.filter.TimeBucketFilter()
+        tbf.setup({ 'granularity': 'hour' })
+
+        cases = [
+
+            # Fast path
+            ('2024-03-05T13:45:10Z', '2024-03-05T13'),
+            ('2024-03-05 13:45:10.123', '2024-03-05T13'),
+            ('2024-03-05T13:45:10+00:00', '2024-03-05T13'),
+
+            # Offsets are converted
+            ('2024-03-05T23:45:10-02:00', '2024-03-06T01'),
+            ('2024-03-05T13:45:10+05:30', '2024-03-05T08'),
+            ('2024-03-05T13:45:10.123-05:00', '2024-03-05T18'),
+
+            # Offsets without seconds
+            ('2020-01-01T23:30-05:00', '2020-01-02T04'),
+            ('2020-01-01 23:30+05:30', '2020-01-01T18'),
+            ('2020-01-01T23:30Z', '2020-01-01T23'),
+            ('2020-01-01T23:30-00:00', '2020-01-01T23'),
+
+            # No time
+            ('2024-03-05', '2024-03-05T00'),
+
+            # Epoch
+            (1709646310, '2024-03-05T13'),
+            (1709646310.5, '2024-03-05T13'),
+
+            # Not times
+            ('yesterday', None),
+            ('2024-03-05Txx:45:10Z', None),
+            (True, None),
+            (None, None),
+        ]
+
+        for value, expected in cases:
+            actual = tbf.get_bucket(value)
+
+            assert \
+                actual == expected, \
+                "Bucket for [{}] not correct: [{}] != [{}]".format(
+                value, actual, expected)
+
+    def test_get_bucket__malformed(self):
+
+        tbf = jpart.filter.TimeBucketFilter()
+
+        cases = [
+            ('day', '1700000000'),
+            ('day', '2024--01-05'),
+            ('day', '2024-1-5-10xx'),
+            ('day', '2024-03-05T13:4'),
+            ('day', '2024-03-05T13:45:10.'),
+            ('month', '2024011'),
+            ('month', '202401-'),
+        ]
+
+        for granularity, value in cases:
+            tbf.setup({ 'granularity': granularity })
+
+            actual = tbf.get_bucket(value)
+
+            assert \
+                actual is None, \
+                "Expected [{}] to be rejected: [{}]".format(value, actual)
+
+        # Shapes that are fine but can't be sliced are still parsed
+
+        tbf.setup({ 'granularity': 'day' })
+
+        actual = tbf.get_bucket('20240305')
+
+        assert \
+            actual == '2024-03-05', \
+            "Basic format not correct: [{}]".format(actual)
+
+    def test_setup(self):
+
+        tbf = jpart.filter.TimeBucketFilter()
+
+        # Defaults to days
+
+        actual = tbf.get_bucket('2024-03-05T13:45:10Z')
+
+        assert \
+            actual == '2024-03-05', \
+            "Default bucket not correct: [{}]".format(actual)
+
+        tbf.setup({
+            'granularity': 'month',
+            'epoch_unit': 'ms',
+        })
+
+        actual = tbf.get_bucket(1709646310000)
+
+        assert \
+            actual == '2024-03', \
+            "Millisecond bucket not correct: [{}]".format(actual)
+
+        tbf.setup({
+            'granularity': 'day',
+            'format': '%Y%m%d',
+        })
+
+        actual = tbf.get_bucket('2024-03-05T13:45:10Z')
+
+        assert \
+            actual == '20240305', \
+            "Custom format not correct: [{}]".format(actual)
+
+        # A format that's finer than the granularity isn't mixed up by what's
+        # remembered
+
+        tbf.setup({
+            'granularity': 'day',
+            'format': '%Y%m%dT%H%M%S',
+        })
+
+        values = [
+            '2024-03-05T13:45:10Z',
+            '2024-03-05T13:45:11Z',
+            1709646310,
+            1709646311,
+        ]
+
+        actual = [tbf.get_bucket(value) for value in values]
+
+        expected = [
+            '20240305T134510',
+            '20240305T134511',
+            '20240305T134510',
+            '20240305T134511',
+        ]
+
+        assert \
+            actual == expected, \
+            "Fine custom format not correct: {}".format(actual)
+
+    def test_get_value(self):
+
+        tbf = jpart.filter.TimeBucketFilter()
+
+        actual = tbf.get_value('a.t', { 'a': { 't': '2024-03-05T13:45:10Z' } })
+
+        assert \
+            actual == '2024-03-05', \
+            "Value not correct: [{}]".format(actual)
+
+        cases = [
+            ({ 't': 'never' }, jpart.filter.SKIP_REASON_TIME__NOT_VALID),
+            ({ 'u': 'never' }, jpart.filter.SKIP_REASON_TIME__NOT_FOUND),
+        ]
+
+        for record, expected in cases:
+            try:
+                tbf.get_value('t', record)
+
+            except jpart.filter.SkipRuleException as e:
+                assert \
+                    e.reason == expected, \
+                    "Reason not correct: [{}]".format(e.reason)
+
+            else:
+                raise Exception("Expected SkipRuleException.")
+
+
+class TestHashBucketFilter(object):
+    def test_get_bucket(self):
+
+        hbf = jpart.filter.HashBucketFilter()
+        hbf.setup({ 'buckets': 100 })
+
+        # Stable across processes, so these can be pinned
+
+        actual = [hbf.get_bucket(value) for value in ('user1', 'user2', 12345)]
+
+        expected = [
+            '{:02d}'.format(jpart.filter.get_stable_hash('user1') % 100),
+            '{:02d}'.format(jpart.filter.get_stable_hash('user2') % 100),
+            '{:02d}'.format(jpart.filter.get_stable_hash('12345') % 100),
+        ]
+
+        assert \
+            actual == expected, \
+            "Buckets not correct: {}".format(actual)
+
+        assert \
+            jpart.filter.get_stable_hash('user1') == 2354152789, \
+            "Hash not stable: ({})".format(
+            jpart.filter.get_stable_hash('user1'))
+
+        # Bounded
+
+        buckets = set([hbf.get_bucket(i) for i in range(10000)])
+
+        assert \
+            len(buckets) == 100 and min(buckets) == '00' and max(buckets) == '99', \
+            "Buckets not bounded: ({})".format(len(buckets))
+
+    def test_get_value(self):
+
+        hbf = jpart.filter.HashBucketFilter()
+
+        actual = hbf.get_value('user', { 'user': 'user1' })
+        expected = '{:02d}'.format(jpart.filter.get_stable_hash('user1') % 16)
+
+        assert \
+            actual == expected, \
+            "Value not correct: [{}]".format(actual)
+
+        try:
+            hbf.get_value('user', { 'other': 'user1' })
+
+        except jpart.filter.SkipRuleException as e:
+            assert \
+                e.reason == jpart.filter.SKIP_REASON_HASH__NOT_FOUND, \
+                "Reason not correct: [{}]".format(e.reason)
+
+        else:
+            raise Exception("Expected SkipRuleException.")
@@ -0,0 +1,153 @@
+import os
+
+import riu.utility
+
+import jpart.index
+import jpart.output
+
+
+def _get_line(i):
+    return '{{"i": {}, "pad": "{}"}}\n'.format(i, 'x' * i)
+
+
+class Test(object):
+    def test_index_writer(self):
+
+        with riu.utility.temp_path() as temp_path:
+
+            f = jpart.output.PartitionFile('aa.jsonl', index_stride=3)
+
+            # One record at a time, and then several in one write
+
+            for i in range(4):
+                f.write(_get_line(i))
+
+            f.write(''.join(_get_line(i) for i in range(4, 10)))
+            f.close()
+
+
+            # Check entries
+
+            with open('aa.jsonl', 'rb') as f:
+                content = f.read()
+
+            offsets = []
+            position = 0
+            for line in content.splitlines(True):
+                offsets.append(position)
+                position += len(line)
+
+            entries = jpart.index.load_index('aa.jsonl')
+
+            expected = [
+                0, offsets[0],
+                3, offsets[3],
+                6, offsets[6],
+                9, offsets[9],
+            ]
+
+            assert \
+                list(entries) == expected, \
+                "Entries not correct: {}".format(list(entries))
+
+            # Building from scratch gives the same result
+
+            rebuilt = jpart.index.build_index('aa.jsonl', stride=3)
+
+            assert \
+                rebuilt == entries, \
+                "Rebuilt entries not correct: {}".format(list(rebuilt))
+
+    def test_get_record(self):
+
+        with riu.utility.temp_path() as temp_path:
+
+            f = jpart.output.PartitionFile('aa.jsonl', index_stride=4)
+
+            for i in range(10):
+                f.write(_get_line(i))
+
+            f.close()
+
+            record = jpart.index.get_record('aa.jsonl', 5)
+
+            assert \
+                record['i'] == 5, \
+                "Record not correct: {}".format(record)
+
+            records = jpart.index.iterate_records('aa.jsonl', 3, stop=9)
+            actual = [record['i'] for record in records]
+
+            assert \
+                actual == [3, 4, 5, 6, 7, 8], \
+                "Records not correct: {}".format(actual)
+
+            try:
+                jpart.index.get_record('aa.jsonl', 10)
+
+            except IndexError:
+                pass
+
+            else:
+                raise Exception("Expected IndexError.")
+
+    def test_append(self):
+
+        with riu.utility.temp_path() as temp_path:
+
+            # Each run gets its own fault-handler, like separate processes
+
+            for start, stop in ((0, 5), (5, 11)):
+                fault_cb = \
+                    jpart.output.PartitionFaultHandler(
+                        temp_path,
+                        index_stride=2)
+
+                f = fault_cb('aa.jsonl')
+
+                for i in range(start, stop):
+                    f.write(_get_line(i))
+
+                f.close()
+
+            entries = jpart.index.load_index('aa.jsonl')
+            rebuilt = jpart.index.build_index('aa.jsonl', stride=2)
+
+            assert \
+                entries == rebuilt, \
+                "Entries not correct after append: {}".format(list(entries))
+
+            for i in range(11):
+                record = jpart.index.get_record('aa.jsonl', i)
+
+                assert \
+                    record['i'] == i, \
+                    "Record ({}) not correct: {}".format(i, record)
+
+    def test_extend_index(self):
+
+        with riu.utility.temp_path() as temp_path:
+
+            f = jpart.output.PartitionFile('aa.jsonl', index_stride=3)
+
+            for i in range(7):
+                f.write(_get_line(i))
+
+            f.close()
+
+            records = jpart.index.count_records('aa.jsonl')
+            offset = os.path.getsize('aa.jsonl')
+
+            with open('aa.jsonl', 'a') as f:
+                for i in range(7, 15):
+                    f.write(_get_line(i))
+
+            jpart.index.extend_index('aa.jsonl', records, offset, stride=3)
+
+            entries = jpart.index.load_index('aa.jsonl')
+            rebuilt = jpart.index.build_index('aa.jsonl', stride=3)
+
+            assert \
+                entries == rebuilt, \
+                "Entries not correct after extending: {}".format(
+                list(entries))
@@ -0,0 +1,168 @@
+import io
+import os
+import json
+
+import riu.journal
+import riu.utility
+
+import jpart.rule
+import jpart.cache
+import jpart.filter
+import jpart.memory
+import jpart.output
+
+
+class _Buffer(object):
+    def __init__(self, events, memory_bytes):
+        self._events = events
+        self.memory_bytes = memory_bytes
+
+    def flush(self):
+        self._events.append('flush')
+        self.memory_bytes = 0
+
+
+class _IdentityFilter(jpart.filter.BaseFilter):
+    def does_qualify(self, name, value):
+        return True
+
+
+class Test(object):
+    def test_parse_size(self):
+
+        actual = [
+            jpart.memory.parse_size(text)
+            for text
+            in ('100', '4k', '1.5M', '2G')
+        ]
+
+        expected = [100, 4096, 1572864, 2147483648]
+
+        assert \
+            actual == expected, \
+            "Sizes not correct: {}".format(actual)
+
+    def test_check(self):
+
+        events = []
+
+        def fault_cb(name):
+            events.append('open')
+            return io.StringIO()
+
+        cached_resources = jpart.cache.CachedResources(fault_cb, capacity=32)
+        for i in range(32):
+            cached_resources.get_or_create(str(i))
+
+        filter_ = jpart.filter.MemoizedFilter(_IdentityFilter(), size=64)
+        for i in range(64):
+            filter_.does_qualify('field1', i)
+
+        buffer_ = _Buffer(events, 10000)
+
+        handles_bytes = 32 * jpart.output.HANDLE_BYTES
+
+        governor = jpart.memory.MemoryGovernor(handles_bytes + 100000)
+        governor.add_buffer(buffer_)
+        governor.add_cache(filter_)
+        governor.add_handles(cached_resources)
+
+        # Under the limit
+
+        assert \
+            governor.check() is False, \
+            "Expected nothing to be shed."
+
+
+        # Flushing is enough
+
+        buffer_.memory_bytes = 200000
+        del events[:]
+
+        governor.check()
+
+        assert \
+            events == ['flush'] and filter_.memory_bytes > 0, \
+            "Expected only a flush: {}".format(events)
+
+
+        # Shrinking the caches is enough
+
+        governor = jpart.memory.MemoryGovernor(handles_bytes + 2000)
+        governor.add_buffer(buffer_)
+        governor.add_cache(filter_)
+        governor.add_handles(cached_resources)
+
+        governor.check()
+
+        stats = governor.stats
+
+        assert \
+            stats['cache_shrinks'] > 0 and stats['handle_shrinks'] == 0, \
+            "Expected only the caches to shrink: {}".format(stats)
+
+        assert \
+            stats['held_bytes'] <= handles_bytes + 2000, \
+            "Still over the limit: {}".format(stats)
+
+
+        # Handles have to be closed
+
+        governor = jpart.memory.MemoryGovernor(handles_bytes // 3)
+        governor.add_cache(filter_)
+        governor.add_handles(cached_resources)
+
+        governor.check()
+
+        stats = governor.stats
+
+        assert \
+            stats['handle_shrinks'] == 2 and cached_resources.capacity == 8, \
+            "Expected the capacity to be halved twice: {} ({})".format(
+            stats, cached_resources.capacity)
+
+        assert \
+            len(cached_resources.index) == 8 and stats['overruns'] == 0, \
+            "Expected handles to be closed: {}".format(stats)
+
+    def test_memory_limit(self):
+
+        input_data = io.StringIO()
+        for i in range(200):
+            riu.journal.journalize(
+                input_data,
+                field1='aa{}'.format(i % 40),
+                field2=i)
+
+        with riu.utility.temp_path() as output_path:
+
+            config = {
+                'memory_limit': '{}'.format(jpart.output.HANDLE_BYTES * 10),
+                'batch_size': 50,
+                'index': True,
+                'rules': {
+                    'rule1': ['field1'],
+                },
+            }
+
+            with jpart.rule.Partitioner(None, output_path, config) as p:
+                p.feed(input_data)
+
+                stats = p.stats
+
+            assert \
+                stats['memory']['handle_shrinks'] > 0 and \
+                stats['memory']['overruns'] == 0, \
+                "Expected the handles to be limited: {}".format(stats)
+
+            records = 0
+            for filename in os.listdir('rule1'):
+                if filename.endswith('.jsonl') is False:
+                    continue
+
+                with open(os.path.join('rule1', filename)) as f:
+                    records += len([json.loads(line) for line in f])
+
+            assert \
+                records == 200, \
+                "Records lost: ({})".format(records)
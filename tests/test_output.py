@@ -0,0 +1,135 @@
+import os
+
+import riu.utility
+
+import jpart.output
+
+
+class Test(object):
+    def test_get_segment_filepath(self):
+
+        actual = jpart.output.get_segment_filepath('aa/bb.jsonl', 0)
+
+        assert \
+            actual == 'aa/bb.jsonl', \
+            "First segment not correct: [{}]".format(actual)
+
+        actual = jpart.output.get_segment_filepath('aa/bb.jsonl', 12)
+
+        assert \
+            actual == 'aa/bb-00012.jsonl', \
+            "Later segment not correct: [{}]".format(actual)
+
+    def test_partition_file__roll_records(self):
+
+        with riu.utility.temp_path() as temp_path:
+
+            f = jpart.output.PartitionFile('aa.jsonl', max_records=2)
+
+            for i in range(5):
+                f.write('{}\n'.format(i))
+
+            f.close()
+
+            actual = sorted(os.listdir(temp_path))
+
+            expected = [
+                'aa-00001.jsonl',
+                'aa-00002.jsonl',
+                'aa.jsonl',
+            ]
+
+            assert \
+                actual == expected, \
+                "Segments not correct: {}".format(actual)
+
+            with open('aa-00002.jsonl') as f:
+                actual = f.read()
+
+            assert \
+                actual == '4\n', \
+                "Last segment not correct: [{}]".format(actual)
+
+    def test_partition_file__roll_bytes__chunk(self):
+
+        with riu.utility.temp_path() as temp_path:
+
+            f = jpart.output.PartitionFile('aa.jsonl', max_bytes=5)
+
+            # Several records in one write are split on record boundaries
+            f.write('111\n22\n3\n4444\n')
+            f.close()
+
+            actual = []
+            for filename in ['aa.jsonl', 'aa-00001.jsonl']:
+                with open(filename) as f:
+                    actual.append(f.read())
+
+            expected = [
+                '111\n22\n',
+                '3\n4444\n',
+            ]
+
+            assert \
+                actual == expected, \
+                "Segment content not correct: {}".format(actual)
+
+            # The next segment is only opened once it's needed
+            assert \
+                os.path.exists('aa-00002.jsonl') is False, \
+                "Empty segment should not have been created."
+
+    def test_partition_fault_handler__continue(self):
+
+        with riu.utility.temp_path() as temp_path:
+
+            # First run
+
+            fault_cb = \
+                jpart.output.PartitionFaultHandler(
+                    temp_path,
+                    max_records=2)
+
+            f = fault_cb(os.path.join('rule1', 'aa.jsonl'))
+
+            for i in range(3):
+                f.write('{}\n'.format(i))
+
+            f.close()
+
+
+            # Second run continues the last segment and then numbers after it
+
+            fault_cb = \
+                jpart.output.PartitionFaultHandler(
+                    temp_path,
+                    max_records=2)
+
+            f = fault_cb(os.path.join('rule1', 'aa.jsonl'))
+
+            assert \
+                f.state.segment == 1 and f.state.records_written == 1, \
+                "State not recovered: ({}) ({})".format(
+                    f.state.segment, f.state.records_written)
+
+            for i in range(3, 6):
+                f.write('{}\n'.format(i))
+
+            f.close()
+
+            rule_path = os.path.join(temp_path, 'rule1')
+
+            actual = {}
+            for filename in os.listdir(rule_path):
+                with open(os.path.join(rule_path, filename)) as f:
+                    actual[filename] = f.read()
+
+            expected = {
+                'aa.jsonl': '0\n1\n',
+                'aa-00001.jsonl': '2\n3\n',
+                'aa-00002.jsonl': '4\n5\n',
+            }
+
+            assert \
+                actual == expected, \
+                "Segments not correct: {}".format(actual)
@@ -0,0 +1,109 @@
+import os
+
+import riu.utility
+
+import jpart.plan_cache
+
+
+_MODULE_SOURCE = """\
+import jpart.filter
+
+class LowerFilter(jpart.filter.BaseFilter):
+    def get_value(self, name, record):
+        return record[name].{}()
+"""
+
+_CONFIG = """\
+filter_mappings:
+  lower:
+    reference: filters.LowerFilter
+    memoize: true
+rules:
+  rule1:
+    - [field1, '!lower']
+"""
+
+
+class Test(object):
+    def test_load(self):
+
+        with riu.utility.temp_path() as temp_path:
+
+            module_path = os.path.join(temp_path, 'modules')
+            os.mkdir(module_path)
+
+            module_filepath = os.path.join(module_path, 'filters.py')
+            with open(module_filepath, 'w') as f:
+                f.write(_MODULE_SOURCE.format('lower'))
+
+            with open('config.yaml', 'w') as f:
+                f.write(_CONFIG)
+
+            plan_cache = \
+                jpart.plan_cache.PlanCache(
+                    os.path.join(temp_path, 'cache'))
+
+
+            # Miss, and then hit
+
+            results = []
+            for _ in range(2):
+                plan = plan_cache.load('config.yaml', module_path)
+
+                cls_ = plan.get_symbol(module_path, 'filters.LowerFilter')
+                value = cls_().get_value('field1', { 'field1': 'AA' })
+
+                results.append((plan.is_hit, plan.config, value))
+
+            (is_hit1, config1, value1), (is_hit2, config2, value2) = results
+
+            assert \
+                (is_hit1, is_hit2) == (False, True), \
+                "Hits not correct: ({}) ({})".format(is_hit1, is_hit2)
+
+            assert \
+                config1 == config2, \
+                "Cached config not correct:\n{}".format(config2)
+
+            assert \
+                config2['rules'] == { 'rule1': [['field1', '!lower']] }, \
+                "Config not correct:\n{}".format(config2)
+
+            assert \
+                value1 == value2 == 'aa', \
+                "Filter not correct: [{}] [{}]".format(value1, value2)
+
+
+            # A changed module invalidates the entry
+
+            with open(module_filepath, 'w') as f:
+                f.write(_MODULE_SOURCE.format('upper'))
+
+            plan = plan_cache.load('config.yaml', module_path)
+
+            assert \
+                plan.is_hit is False, \
+                "Expected a miss after the module changed."
+
+            cls_ = plan.get_symbol(module_path, 'filters.LowerFilter')
+            value = cls_().get_value('field1', { 'field1': 'aa' })
+
+            assert \
+                value == 'AA', \
+                "Filter not recompiled: [{}]".format(value)
+
+
+            # So does a changed config
+
+            with open('config.yaml', 'a') as f:
+                f.write("layout: hive\n")
+
+            plan = plan_cache.load('config.yaml', module_path)
+
+            assert \
+                plan.is_hit is False, \
+                "Expected a miss after the config changed."
+
+            assert \
+                plan.config['layout'] == 'hive', \
+                "Config not reparsed:\n{}".format(plan.config)
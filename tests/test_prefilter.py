@@ -0,0 +1,107 @@
+import json
+
+import jpart.rule
+import jpart.filter
+import jpart.prefilter
+
+
+class Test(object):
+    def test_get_field_needles(self):
+
+        actual = jpart.prefilter.get_field_needles('aa.bb')
+
+        assert \
+            actual == ['"aa"', '"bb"'], \
+            "Needles not correct: {}".format(actual)
+
+        # Could appear escaped or unescaped in the input
+
+        actual = jpart.prefilter.get_field_needles('café.x"y')
+
+        assert \
+            actual == [], \
+            "Expected no needles: {}".format(actual)
+
+        # List indices aren't in the line
+
+        actual = jpart.prefilter.get_field_needles('tags.0.name')
+
+        assert \
+            actual == ['"tags"', '"name"'], \
+            "Needles not correct: {}".format(actual)
+
+    def test_build_prefilter(self):
+
+        rule1 = jpart.rule.Rule({}, 'rule1', ['field1', 'field2.sub'])
+        rule2 = jpart.rule.Rule({}, 'rule2', ['field3'])
+
+        patterns = {
+            'rule2': [r'"field3": *"x'],
+        }
+
+        prefilter = \
+            jpart.prefilter.build_prefilter(
+                [rule1, rule2],
+                patterns_by_rule=patterns)
+
+        lines = [
+            '{"field1": "aa", "field2": {"sub": "bb"}}\n',
+            '{"field1": "aa", "field2": "bb"}\n',
+            '{"field3": "xx"}\n',
+            '{"field3": "yy"}\n',
+            '{"field4": "zz"}\n',
+        ]
+
+        actual = [prefilter.check(line) for line in lines]
+        expected = [True, False, True, False, False]
+
+        assert \
+            actual == expected, \
+            "Checks not correct: {}".format(actual)
+
+        stats = prefilter.stats
+
+        assert \
+            (stats['lines'], stats['passed']) == (5, 2), \
+            "Stats not correct: {}".format(stats)
+
+    def test_build_prefilter__index(self):
+
+        rule1 = jpart.rule.Rule({}, 'rule1', ['tags.0'])
+
+        prefilter = jpart.prefilter.build_prefilter([rule1])
+
+        line = '{"tags": ["aa", "bb"]}\n'
+
+        assert \
+            prefilter.check(line) is True, \
+            "Expected a line with an indexed field to pass."
+
+        assert \
+            rule1.apply(json.loads(line)) == ['aa'], \
+            "Expected the rule to match."
+
+    def test_build_prefilter__unconstrained(self):
+
+        class _TestFilter(jpart.filter.BaseFilter):
+            pass
+
+        filter_mappings = {
+            'test_filter': _TestFilter,
+        }
+
+        rule1 = jpart.rule.Rule({}, 'rule1', ['field1'])
+
+        rule2 = \
+            jpart.rule.Rule(
+                filter_mappings,
+                'rule2',
+                [('field2', '!test_filter')])
+
+        # The second rule's filter could match anything
+
+        prefilter = jpart.prefilter.build_prefilter([rule1, rule2])
+
+        assert \
+            prefilter is None, \
+            "Expected no prefilter."
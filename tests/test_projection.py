@@ -0,0 +1,81 @@
+import jpart.projection
+
+
+class Test(object):
+    def test_apply__include(self):
+
+        projection = \
+            jpart.projection.Projection(
+                include=['cc.dd', 'aa', 'cc.dd.ee', 'missing.xx'])
+
+        record = {
+            'aa': 1,
+            'bb': 2,
+            'cc': {
+                'dd': {'ee': 3},
+                'ff': 4,
+            },
+            'missing': 'not a dictionary',
+        }
+
+        actual = projection.apply(record)
+
+        expected = {
+            'aa': 1,
+            'cc': {
+                'dd': {'ee': 3},
+            },
+        }
+
+        assert \
+            actual == expected, \
+            "Projection not correct: {}".format(actual)
+
+        assert \
+            list(actual.keys()) == ['aa', 'cc'], \
+            "Order not kept: {}".format(list(actual.keys()))
+
+    def test_apply__exclude(self):
+
+        projection = \
+            jpart.projection.Projection(exclude=['bb', 'cc.dd', 'aa.xx'])
+
+        record = {
+            'aa': 1,
+            'bb': 2,
+            'cc': {
+                'dd': 3,
+                'ff': 4,
+            },
+        }
+
+        actual = projection.apply(record)
+
+        expected = {
+            'aa': 1,
+            'cc': {
+                'ff': 4,
+            },
+        }
+
+        assert \
+            actual == expected, \
+            "Projection not correct: {}".format(actual)
+
+        assert \
+            record['cc'] == {'dd': 3, 'ff': 4}, \
+            "Record was modified: {}".format(record)
+
+    def test_get_projection(self):
+
+        projection1 = jpart.projection.get_projection(include=['aa', 'bb'])
+        projection2 = jpart.projection.get_projection(include=['bb', 'aa'])
+        projection3 = jpart.projection.get_projection(exclude=['aa', 'bb'])
+
+        assert \
+            projection1 is projection2, \
+            "Expected the same projection."
+
+        assert \
+            projection1 is not projection3, \
+            "Expected different projections."
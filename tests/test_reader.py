@@ -0,0 +1,78 @@
+import os
+
+import riu.utility
+
+import jpart.rule
+import jpart.reader
+import jpart.prefilter
+
+
+class Test(object):
+    def test_iterate_lines(self):
+
+        with riu.utility.temp_path() as temp_path:
+
+            with open('input.jsonl', 'wb') as f:
+                f.write(b'{"aa": 1}\n{"aa": 2}\n{"aa": 3}')
+
+            mi = jpart.reader.MappedInput('input.jsonl')
+
+            lines = [line.tobytes() for line in mi.iterate_lines()]
+
+            expected = [
+                b'{"aa": 1}\n',
+                b'{"aa": 2}\n',
+                b'{"aa": 3}',
+            ]
+
+            assert \
+                lines == expected, \
+                "Lines not correct: {}".format(lines)
+
+            # The last line gets a newline when passed through
+
+            pairs = list(mi.iterate_records(do_keep_lines=True))
+
+            expected = [
+                ({'aa': 1}, b'{"aa": 1}\n'),
+                ({'aa': 2}, b'{"aa": 2}\n'),
+                ({'aa': 3}, b'{"aa": 3}\n'),
+            ]
+
+            assert \
+                pairs == expected, \
+                "Records not correct: {}".format(pairs)
+
+            # Empty files can't be mapped but still work
+
+            open('empty.jsonl', 'w').close()
+
+            mi = jpart.reader.MappedInput('empty.jsonl')
+            records = list(mi.iterate_records())
+
+            assert \
+                records == [], \
+                "Expected no records: {}".format(records)
+
+    def test_iterate_records__prefilter(self):
+
+        with riu.utility.temp_path() as temp_path:
+
+            with open('input.jsonl', 'wb') as f:
+                f.write(b'{"aa": 1}\n{"bb": 2}\n{"aa": 3, "cc": "x"}\n')
+
+            rule = jpart.rule.Rule({}, 'rule1', ['aa'])
+            prefilter = jpart.prefilter.build_prefilter([rule])
+
+            mi = jpart.reader.MappedInput('input.jsonl')
+            records = [record for record, _ in mi.iterate_records(prefilter)]
+
+            assert \
+                records == [{'aa': 1}, {'aa': 3, 'cc': 'x'}], \
+                "Records not correct: {}".format(records)
+
+            stats = prefilter.stats
+
+            assert \
+                (stats['lines'], stats['passed']) == (3, 2), \
+                "Stats not correct: {}".format(stats)
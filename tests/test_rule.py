@@ -2,12 +2,15 @@ import os
 import io
 import json
 import functools
+import threading
+import collections
 
 import riu.journal
 import riu.utility
 
 import jpart.rule
 import jpart.filter
+import jpart.reader
 
 
 class _MaskedRule(jpart.rule.Rule):
@@ -300,6 +303,127 @@ class Test(object):
             "Rule did not return None for irrelevant record as expected:\n" \
                 "{}".format(values)
 
+    def test_apply_batch(self):
+
+        calls = []
+
+        class _BatchFilter(jpart.filter.BaseFilter):
+            def get_values(self, name, records):
+                calls.append(len(records))
+
+                values = [
+                    record.get(name, jpart.filter.SKIP)
+                    for record
+                    in records
+                ]
+
+                return values
+
+            def does_qualify_batch(self, name, values):
+                calls.append(len(values))
+
+                return [value != 'no' for value in values]
+
+        filter_mappings = {
+            'batch_filter': _BatchFilter,
+        }
+
+        rule_raw = [
+            'field1',
+            ('field2', '!batch_filter'),
+        ]
+
+        rule = jpart.rule.Rule(filter_mappings, 'rule1', rule_raw)
+
+        records = [
+            { 'field1': 'aa', 'field2': 'bb' },
+            { 'field2': 'bb' },
+            { 'field1': 'aa' },
+            { 'field1': 'aa', 'field2': 'no' },
+            { 'field1': 'cc', 'field2': 11 },
+        ]
+
+        actual = rule.apply_batch(records)
+
+        expected = [
+            ['aa', 'bb'],
+            None,
+            None,
+            None,
+            ['cc', '11'],
+        ]
+
+        assert \
+            actual == expected, \
+            "Batch values not correct: {}".format(actual)
+
+        # The filter only saw the records that had the first field, and was
+        # only asked to qualify the values that it found
+
+        assert \
+            calls == [4, 3], \
+            "Batch calls not correct: {}".format(calls)
+
+    def test_apply__fan_out(self):
+
+        rule_raw = [
+            { 'field': 'tags', 'fan_out': True },
+            'field1',
+            { 'field': 'sizes', 'fan_out': True },
+        ]
+
+        rule = jpart.rule.Rule({}, 'rule1', rule_raw, fan_out_limit=4)
+
+        record = {
+            'tags': ['bb', 'aa', 'bb'],
+            'field1': 'xx',
+            'sizes': [1, 2],
+        }
+
+        values = rule.apply(record)
+
+        assert \
+            values == [('bb', 'aa'), 'xx', ('1', '2')], \
+            "Values not correct: {}".format(values)
+
+        actual = rule.expand(values)
+
+        expected = [
+            ['bb', 'xx', '1'],
+            ['bb', 'xx', '2'],
+            ['aa', 'xx', '1'],
+            ['aa', 'xx', '2'],
+        ]
+
+        assert \
+            actual == expected, \
+            "Combinations not correct: {}".format(actual)
+
+        # The batch equivalent agrees
+
+        actual = rule.apply_batch([record])
+
+        assert \
+            actual == [values], \
+            "Batch values not correct: {}".format(actual)
+
+        # Too many and too few
+
+        for tags in (['aa', 'bb', 'cc'], []):
+            record['tags'] = tags
+
+            values = rule.apply(record)
+
+            assert \
+                values is None, \
+                "Expected record to be skipped: {}".format(values)
+
+            actual = rule.apply_batch([record])
+
+            assert \
+                actual == [None], \
+                "Expected record to be skipped in batch: {}".format(actual)
+
     def test_write_record__inner(self):
 
         # Construct
@@ -568,6 +692,197 @@ class Test(object):
             actual == expected, \
             "Rules not correct:\nACTUAL:\n{}\n\nEXPECTED:\n{}".format(actual, expected)
 
+    def test_build_rules_with_config__project(self):
+
+        config = {
+            'rules': {
+                'rule1': {
+                    'parts': ['field1'],
+                    'project': {
+                        'include': ['field1', 'field2.sub'],
+                    },
+                },
+                'rule2': {
+                    'parts': ['field2'],
+                    'project': {
+                        'include': ['field2.sub', 'field1'],
+                    },
+                },
+                'rule3': ['field3'],
+            },
+        }
+
+        rule1, rule2, rule3 = \
+            jpart.rule._build_rules_with_config(None, config, None)
+
+        assert \
+            rule1._parts == ['field1'], \
+            "Parts not correct: {}".format(rule1._parts)
+
+        # Rules with the same projection share it, so they share its lines
+
+        assert \
+            rule1.projection is rule2.projection, \
+            "Projection not shared."
+
+        assert \
+            rule3.projection is None, \
+            "Expected no projection."
+
+        actual = rule1.serialize({'field1': 'aa', 'field2': {'sub': 1, 'x': 2}})
+
+        assert \
+            actual == '{"field1": "aa", "field2": {"sub": 1}}\n', \
+            "Serialization not correct: {}".format(actual)
+
+    def test_build_rules_with_config__memoize(self):
+
+        with riu.utility.temp_path() as module_path:
+
+            with open('filters.py', 'w') as f:
+                f.write("""\
+import jpart.filter
+
+class LowerFilter(jpart.filter.BaseFilter):
+    def get_value(self, name, record):
+        return record[name].lower()
+""")
+
+            config = {
+                'filter_mappings': {
+                    'lower': {
+                        'reference': 'filters.LowerFilter',
+                        'memoize': {
+                            'size': 10,
+                            'transform': True,
+                        },
+                    },
+                },
+                'rules': {
+                    'rule1': [['field1', '!lower'], 'field2'],
+                    'rule2': [['field2', '!lower']],
+                },
+            }
+
+            rule1, rule2 = \
+                jpart.rule._build_rules_with_config(
+                    module_path,
+                    config,
+                    None)
+
+            # Both rules share one memoized instance
+
+            filter1 = rule1._parts[0][1]
+            filter2 = rule2._parts[0][1]
+
+            assert \
+                filter1 is filter2, \
+                "Filter instances not shared."
+
+            assert \
+                isinstance(filter1, jpart.filter.MemoizedFilter) is True, \
+                "Filter not memoized: {}".format(filter1)
+
+            for _ in range(3):
+                values = rule1.apply({ 'field1': 'AA', 'field2': 'bb' })
+
+                assert \
+                    values == ['aa', 'bb'], \
+                    "Values not correct: {}".format(values)
+
+            stats = filter1.stats['value']
+
+            assert \
+                (stats['hits'], stats['misses']) == (2, 1), \
+                "Stats not correct: {}".format(stats)
+
+    def test_load_rules_and_apply_to_input_data_with_config__lifecycle(self):
+
+        with riu.utility.temp_path() as module_path:
+
+            with open('filters.py', 'w') as f:
+                f.write("""\
+import jpart.filter
+
+class LookupFilter(jpart.filter.BaseFilter):
+    def setup(self, config):
+        self._events = config['events']
+        self._events.append('setup')
+
+        self._table = config['table']
+
+    def teardown(self):
+        self._events.append('teardown')
+
+    def get_value(self, name, record):
+        self._events.append('get_value')
+        return self._table[record[name]]
+""")
+
+            events = []
+
+            config = {
+                'filter_mappings': {
+                    'lookup': {
+                        'reference': 'filters.LookupFilter',
+                        'config': {
+                            'events': events,
+                            'table': { 'a': 'xx', 'b': 'yy' },
+                        },
+                    },
+                },
+                'rules': {
+                    'rule1': [['field1', '!lookup']],
+                    'rule2': [['field1', '!lookup'], 'field2'],
+                },
+            }
+
+            input_data = io.StringIO()
+            riu.journal.journalize(input_data, field1='a', field2='cc')
+
+            input_data.seek(0)
+
+            with riu.utility.temp_path() as output_path:
+                jpart.rule.load_rules_and_apply_to_input_data_with_config(
+                    module_path,
+                    output_path,
+                    config,
+                    input_data)
+
+                assert \
+                    os.path.exists(os.path.join('rule2', 'xx-cc.jsonl')), \
+                    "Output not written."
+
+            # Built and set up once even though two rules use it
+
+            expected = ['setup', 'get_value', 'get_value', 'teardown']
+
+            assert \
+                events == expected, \
+                "Lifecycle not correct: {}".format(events)
+
+
+            # Filters are torn down even if the handles are kept
+
+            del events[:]
+
+            with riu.utility.temp_path() as output_path:
+                for _ in range(3):
+                    input_data.seek(0)
+
+                    jpart.rule.load_rules_and_apply_to_input_data_with_config(
+                        module_path,
+                        output_path,
+                        config,
+                        input_data,
+                        do_dispose=False)
+
+            expected = ['setup', 'get_value', 'get_value', 'teardown'] * 3
+
+            assert \
+                events == expected, \
+                "Lifecycle without disposal not correct: {}".format(events)
+
     def test_load_rules_and_apply_to_input_data_with_config(self):
 
         with riu.utility.temp_path() as module_path:
@@ -652,3 +967,639 @@ class Test(object):
                         "EXPECTED:\n" \
                         "{}".format(
                             entries, expected)
+
+    def test_load_rules_and_apply_to_input_data_with_config__hive(self):
+
+        with riu.utility.temp_path() as output_path:
+
+            config = {
+                'layout': 'hive',
+                'rules': {
+                    'rule1': ['field1', 'field2'],
+                },
+            }
+
+            input_data = io.StringIO()
+            riu.journal.journalize(input_data, field1='aa', field2='bb')
+            riu.journal.journalize(input_data, field1='aa', field2='cc')
+            riu.journal.journalize(input_data, field1='aa', field2='bb')
+
+            input_data.seek(0)
+
+            jpart.rule.load_rules_and_apply_to_input_data_with_config(
+                None,
+                output_path,
+                config,
+                input_data)
+
+
+            # Check written files
+
+            rel_filepaths = []
+            for path, folders, filenames in os.walk(output_path):
+                for filename in filenames:
+                    filepath = os.path.join(path, filename)
+                    rel_filepath = os.path.relpath(filepath, output_path)
+                    rel_filepaths.append(rel_filepath)
+
+            rel_filepaths.sort()
+
+            expected = [
+                os.path.join('rule1', 'field1=aa', 'field2=bb', 'part.jsonl'),
+                os.path.join('rule1', 'field1=aa', 'field2=cc', 'part.jsonl'),
+            ]
+
+            assert \
+                rel_filepaths == expected, \
+                "Written files not correct:\n{}".format(rel_filepaths)
+
+            with open(expected[0]) as f:
+                actual = riu.journal.parse_journal_stream_gen(f)
+                actual = [record['field2'] for record in actual]
+
+            assert \
+                actual == ['bb', 'bb'], \
+                "Partition content not correct: {}".format(actual)
+
+    def test_load_rules_and_apply_to_input_data_with_config__batch(self):
+
+        def _get_outputs(output_path):
+            outputs = {}
+            for path, folders, filenames in os.walk(output_path):
+                for filename in filenames:
+                    filepath = os.path.join(path, filename)
+                    rel_filepath = os.path.relpath(filepath, output_path)
+
+                    with open(filepath, 'rb') as f:
+                        outputs[rel_filepath] = f.read()
+
+            return outputs
+
+        input_data = io.StringIO()
+        for i in range(50):
+            riu.journal.journalize(
+                input_data,
+                field1='aa{}'.format(i % 3),
+                field2='bb{}'.format(i % 2),
+                field3=i)
+
+        results = []
+        for engine in (jpart.rule.ENGINE__CACHED, jpart.rule.ENGINE__BATCH):
+            with riu.utility.temp_path() as output_path:
+
+                config = {
+                    'engine': engine,
+                    'batch_size': 8,
+                    'rolling': {
+                        'max_records': 4,
+                    },
+                    'index': {
+                        'stride': 3,
+                    },
+                    'rules': {
+                        'rule1': ['field1', 'field2'],
+                        'rule2': ['field2'],
+                    },
+                }
+
+                jpart.rule.load_rules_and_apply_to_input_data_with_config(
+                    None,
+                    output_path,
+                    config,
+                    input_data)
+
+                results.append(_get_outputs(output_path))
+
+        cached_outputs, batch_outputs = results
+
+        assert \
+            len(cached_outputs) > 12, \
+            "Expected rolled and indexed files: {}".format(
+            sorted(cached_outputs))
+
+        assert \
+            batch_outputs == cached_outputs, \
+            "Batch output not identical:\n{}\n\n{}".format(
+            sorted(batch_outputs), sorted(cached_outputs))
+
+    def test_load_rules_and_apply_to_input_data_with_config__project(self):
+
+        input_data = io.StringIO()
+        for i in range(6):
+            riu.journal.journalize(
+                input_data,
+                field1='aa{}'.format(i % 2),
+                field2={'xx': i, 'yy': 'big'},
+                field3=i)
+
+        for engine in (jpart.rule.ENGINE__CACHED, jpart.rule.ENGINE__BATCH):
+            with riu.utility.temp_path() as output_path:
+
+                config = {
+                    'engine': engine,
+                    'passthrough': True,
+                    'rules': {
+                        'rule1': {
+                            'parts': ['field1'],
+                            'project': {
+                                'include': ['field1', 'field2.xx'],
+                            },
+                        },
+                        'rule2': {
+                            'parts': ['field1'],
+                            'project': {
+                                'include': ['field2.xx', 'field1'],
+                            },
+                        },
+                        'rule3': {
+                            'parts': ['field1'],
+                            'project': {
+                                'exclude': ['field2'],
+                            },
+                        },
+                        'rule4': ['field1'],
+                    },
+                }
+
+                jpart.rule.load_rules_and_apply_to_input_data_with_config(
+                    None,
+                    output_path,
+                    config,
+                    input_data)
+
+                with open(os.path.join(output_path, 'rule2', 'aa1.jsonl')) as f:
+                    records = [json.loads(line) for line in f]
+
+                expected = [
+                    {'field1': 'aa1', 'field2': {'xx': 1}},
+                    {'field1': 'aa1', 'field2': {'xx': 3}},
+                    {'field1': 'aa1', 'field2': {'xx': 5}},
+                ]
+
+                assert \
+                    records == expected, \
+                    "Projected records not correct ({}): {}".format(
+                    engine, records)
+
+                with open(os.path.join(output_path, 'rule3', 'aa0.jsonl')) as f:
+                    records = [json.loads(line) for line in f]
+
+                assert \
+                    'field2' not in records[0] and records[0]['field3'] == 0, \
+                    "Excluded record not correct ({}): {}".format(
+                    engine, records[0])
+
+                with open(os.path.join(output_path, 'rule4', 'aa0.jsonl')) as f:
+                    records = [json.loads(line) for line in f]
+
+                assert \
+                    records[0]['field2'] == {'xx': 0, 'yy': 'big'}, \
+                    "Whole record not written ({}): {}".format(
+                    engine, records[0])
+
+    def test_load_rules_and_apply_to_input_data_with_config__prefilter(self):
+
+        input_data = io.StringIO()
+        riu.journal.journalize(input_data, field1='aa', field2='bb')
+        riu.journal.journalize(input_data, field3='cc')
+        riu.journal.journalize(input_data, field1='aa', field3='dd')
+        riu.journal.journalize(input_data, field1='ee', field2='ff')
+
+        with riu.utility.temp_path() as output_path:
+
+            config = {
+                'prefilter': True,
+                'rules': {
+                    'rule1': ['field1', 'field2'],
+                },
+            }
+
+            jpart.rule.load_rules_and_apply_to_input_data_with_config(
+                None,
+                output_path,
+                config,
+                input_data)
+
+            filenames = sorted(os.listdir('rule1'))
+
+            assert \
+                filenames == ['aa-bb.jsonl', 'ee-ff.jsonl'], \
+                "Written files not correct: {}".format(filenames)
+
+    def test_load_rules_and_apply_to_input_data_with_config__passthrough(self):
+
+        # Unusual spacing so that reserializing would be noticed
+        input_data = \
+            b'{"field1":"aa","field2":"bb"}\n' \
+            b'{"field1":"cc"}\n' \
+            b'{"field1":"aa",  "field2":"dd"}'
+
+        for engine in (jpart.rule.ENGINE__CACHED, jpart.rule.ENGINE__BATCH):
+            with riu.utility.temp_path() as output_path:
+
+                with open('input.jsonl', 'wb') as f:
+                    f.write(input_data)
+
+                config = {
+                    'engine': engine,
+                    'passthrough': True,
+                    'rules': {
+                        'rule1': ['field1', 'field2'],
+                    },
+                }
+
+                f = jpart.reader.MappedInput('input.jsonl')
+
+                jpart.rule.load_rules_and_apply_to_input_data_with_config(
+                    None,
+                    output_path,
+                    config,
+                    f)
+
+                with open(os.path.join('rule1', 'aa-dd.jsonl'), 'rb') as f:
+                    actual = f.read()
+
+                assert \
+                    actual == b'{"field1":"aa",  "field2":"dd"}\n', \
+                    "Passed-through line not correct ({}): {}".format(
+                    engine, actual)
+
+                filenames = sorted(os.listdir('rule1'))
+
+                assert \
+                    filenames == ['aa-bb.jsonl', 'aa-dd.jsonl'], \
+                    "Written files not correct ({}): {}".format(
+                    engine, filenames)
+
+    def test_load_rules_and_apply_to_input_data_with_config__fan_out(self):
+
+        input_data = io.StringIO()
+        riu.journal.journalize(input_data, field1='aa', tags=['xx', 'yy', 'xx'])
+        riu.journal.journalize(input_data, field1='bb', tags='yy')
+        riu.journal.journalize(input_data, field1='cc', tags=[])
+
+        results = []
+        for engine in (jpart.rule.ENGINE__CACHED, jpart.rule.ENGINE__BATCH):
+            with riu.utility.temp_path() as output_path:
+
+                config = {
+                    'engine': engine,
+                    'rules': {
+                        'rule1': [
+                            { 'field': 'tags', 'fan_out': True },
+                            'field1',
+                        ],
+                    },
+                }
+
+                jpart.rule.load_rules_and_apply_to_input_data_with_config(
+                    None,
+                    output_path,
+                    config,
+                    input_data)
+
+                outputs = {}
+                for filename in os.listdir('rule1'):
+                    with open(os.path.join('rule1', filename)) as f:
+                        outputs[filename] = \
+                            [record['field1'] for record in map(json.loads, f)]
+
+                results.append(outputs)
+
+        expected = {
+            'xx-aa.jsonl': ['aa'],
+            'yy-aa.jsonl': ['aa'],
+            'yy-bb.jsonl': ['bb'],
+        }
+
+        for outputs in results:
+            assert \
+                outputs == expected, \
+                "Fan-out output not correct: {}".format(outputs)
+
+    def test_load_rules_and_apply_to_input_data_with_config__unmatched(self):
+
+        input_data = io.StringIO()
+        for i in range(7):
+            riu.journal.journalize(input_data, field2='xx{}'.format(i))
+
+        riu.journal.journalize(input_data, field1='aa', field2='bb')
+
+        for engine in (jpart.rule.ENGINE__CACHED, jpart.rule.ENGINE__BATCH):
+            with riu.utility.temp_path() as output_path:
+
+                config = {
+                    'engine': engine,
+                    'batch_size': 3,
+                    'unmatched': {
+                        'sample_every': 3,
+                    },
+                    'rules': {
+                        'rule1': ['field1', 'field2'],
+                    },
+                }
+
+                jpart.rule.load_rules_and_apply_to_input_data_with_config(
+                    None,
+                    output_path,
+                    config,
+                    input_data)
+
+                with open(jpart.rule.DEFAULT_UNMATCHED_FILENAME) as f:
+                    actual = [record['field2'] for record in map(json.loads, f)]
+
+                # The first of every three
+
+                assert \
+                    actual == ['xx0', 'xx3', 'xx6'], \
+                    "Unmatched records not correct ({}): {}".format(
+                    engine, actual)
+
+    def test_load_rules_and_apply_to_input_data_with_config__unmatched_prefilter(self):
+
+        input_data = io.StringIO()
+        riu.journal.journalize(input_data, field2='xx')
+        riu.journal.journalize(input_data, field1='aa', field2='bb')
+
+        with riu.utility.temp_path() as output_path:
+
+            config = {
+                'prefilter': True,
+                'unmatched': True,
+                'rules': {
+                    'rule1': ['field1', 'field2'],
+                },
+            }
+
+            jpart.rule.load_rules_and_apply_to_input_data_with_config(
+                None,
+                output_path,
+                config,
+                input_data)
+
+            with open(jpart.rule.DEFAULT_UNMATCHED_FILENAME) as f:
+                actual = [record['field2'] for record in map(json.loads, f)]
+
+            assert \
+                actual == ['xx'], \
+                "Unmatched records not correct: {}".format(actual)
+
+    def test_skips(self):
+
+        class _TestFilter(jpart.filter.BaseFilter):
+            def get_value(self, name, record):
+                value = record[name]
+                if value == 'bad':
+                    raise jpart.filter.SkipRuleException(name, 'test: bad')
+
+                return value
+
+            def does_qualify(self, name, value):
+                return value != 'no'
+
+        filter_mappings = {
+            'test_filter': _TestFilter,
+        }
+
+        rule_raw = [
+            'field1',
+            ('field2', '!test_filter'),
+        ]
+
+        records = [
+            { 'field2': 'bb' },
+            { 'field2': 'cc' },
+            { 'field1': 'aa', 'field2': 'no' },
+            { 'field1': 'aa', 'field2': 'bad' },
+            { 'field1': 'aa', 'field2': 'bb' },
+        ]
+
+        # The filter's own reasons are kept
+
+        expected = {
+            ('field1', jpart.rule.SKIP_REASON_DEFAULT__NOT_FOUND): 2,
+            ('field2', jpart.rule.SKIP_REASON_MODULE__NOT_QUALIFIED): 1,
+            ('field2', 'test: bad'): 1,
+        }
+
+        rule = jpart.rule.Rule(filter_mappings, 'rule1', rule_raw)
+        for record in records:
+            rule.apply(record)
+
+        assert \
+            rule.skips == expected, \
+            "Skips not correct: {}".format(rule.skips)
+
+        rule = jpart.rule.Rule(filter_mappings, 'rule1', rule_raw)
+        rule.apply_batch(records)
+
+        assert \
+            rule.skips == expected, \
+            "Batch skips not correct: {}".format(rule.skips)
+
+    def test_load_rules_and_apply_to_input_data_with_config__builtin_filter(self):
+
+        input_data = io.StringIO()
+        riu.journal.journalize(input_data, field1='aa', t='2024-03-05T13:45:10Z')
+        riu.journal.journalize(input_data, field1='aa', t=1709650000)
+        riu.journal.journalize(input_data, field1='bb', t='bad')
+
+        with riu.utility.temp_path() as output_path:
+
+            config = {
+                'filter_mappings': {
+                    'hour': {
+                        'reference': 'jpart.filter.TimeBucketFilter',
+                        'config': {
+                            'granularity': 'hour',
+                        },
+                    },
+                },
+                'rules': {
+                    'rule1': [['t', '!hour'], 'field1'],
+                },
+            }
+
+            # The module path isn't needed for built-in filters
+            jpart.rule.load_rules_and_apply_to_input_data_with_config(
+                None,
+                output_path,
+                config,
+                input_data)
+
+            filenames = sorted(os.listdir('rule1'))
+
+            assert \
+                filenames == ['2024-03-05T13-aa.jsonl', '2024-03-05T14-aa.jsonl'], \
+                "Written files not correct: {}".format(filenames)
+
+    def test_partitioner__direct(self):
+
+        # Rolling and indexing need the partition files of the cache
+
+        for key, value in (('rolling', { 'max_records': 2 }), ('index', True)):
+            config = {
+                'engine': jpart.rule.ENGINE__DIRECT,
+                key: value,
+                'rules': {
+                    'rule1': ['field1'],
+                },
+            }
+
+            with riu.utility.temp_path() as output_path:
+                try:
+                    jpart.rule.Partitioner(None, output_path, config)
+
+                except AssertionError:
+                    pass
+
+                else:
+                    raise Exception("Expected [{}] to be rejected.".format(
+                                    key))
+
+    def test_partitioner(self):
+
+        def _get_stream(i):
+            s = io.StringIO()
+            for j in range(4):
+                riu.journal.journalize(
+                    s,
+                    field1='aa{}'.format(j % 2),
+                    field2=i)
+
+            return s
+
+        with riu.utility.temp_path() as output_path:
+
+            config = {
+                'rules': {
+                    'rule1': ['field1'],
+                },
+            }
+
+            with jpart.rule.Partitioner(None, output_path, config) as p:
+                for i in range(3):
+                    p.feed(_get_stream(i))
+
+                # The handles stayed open across the streams
+
+                assert \
+                    p.stats['faults'] == 2 and p.stats['feeds'] == 3, \
+                    "Stats not correct: {}".format(p.stats)
+
+                p.flush()
+
+                with open(os.path.join('rule1', 'aa0.jsonl')) as f:
+                    records = [json.loads(line) for line in f]
+
+                assert \
+                    len(records) == 6, \
+                    "Flushed records not correct: {}".format(records)
+
+            assert \
+                p.stats['closes'] == 2, \
+                "Expected the handles to be closed: {}".format(p.stats)
+
+    def test_partitioner__memoize_stats(self):
+
+        input_data = io.StringIO()
+        for _ in range(3):
+            riu.journal.journalize(input_data, field1='aa')
+
+        with riu.utility.temp_path() as output_path:
+
+            config = {
+                'filter_mappings': {
+                    'bucket': {
+                        'reference': 'jpart.filter.HashBucketFilter',
+                        'memoize': True,
+                    },
+                },
+                'rules': {
+                    'rule1': [['field1', '!bucket']],
+                },
+            }
+
+            with jpart.rule.Partitioner(None, output_path, config) as p:
+                p.feed(input_data)
+
+                stats = p.stats['memoize']['bucket']['qualify']
+
+            assert \
+                (stats['hits'], stats['misses']) == (2, 1), \
+                "Memoize stats not correct: {}".format(stats)
+
+    def test_partitioner__idle(self):
+
+        with riu.utility.temp_path() as output_path:
+
+            config = {
+                'cache': {
+                    'idle_seconds': 0,
+                },
+                'rules': {
+                    'rule1': ['field1'],
+                },
+            }
+
+            with jpart.rule.Partitioner(None, output_path, config) as p:
+                for value in ('aa', 'bb', 'aa'):
+                    s = io.StringIO()
+                    riu.journal.journalize(s, field1=value)
+
+                    p.feed(s)
+
+                # Everything was idle before every stream after the first
+
+                assert \
+                    p.stats['idle_closes'] == 2 and p.stats['faults'] == 3, \
+                    "Stats not correct: {}".format(p.stats)
+
+            with open(os.path.join('rule1', 'aa.jsonl')) as f:
+                records = [json.loads(line) for line in f]
+
+            assert \
+                len(records) == 2, \
+                "Records not correct: {}".format(records)
+
+    def test_partitioner__threads(self):
+
+        def _feed(p, i):
+            s = io.StringIO()
+            for j in range(50):
+                riu.journal.journalize(s, field1='aa{}'.format(j % 5), field2=i)
+
+            p.feed(s)
+
+        with riu.utility.temp_path() as output_path:
+
+            config = {
+                'engine': jpart.rule.ENGINE__BATCH,
+                'batch_size': 7,
+                'rules': {
+                    'rule1': ['field1'],
+                },
+            }
+
+            with jpart.rule.Partitioner(None, output_path, config) as p:
+                threads = [
+                    threading.Thread(target=_feed, args=(p, i))
+                    for i
+                    in range(8)
+                ]
+
+                for thread in threads:
+                    thread.start()
+
+                for thread in threads:
+                    thread.join()
+
+            counts = collections.Counter()
+            for filename in os.listdir('rule1'):
+                with open(os.path.join('rule1', filename)) as f:
+                    for line in f:
+                        counts[json.loads(line)['field2']] += 1
+
+            assert \
+                counts == { i: 50 for i in range(8) }, \
+                "Records lost or duplicated: {}".format(counts)
@@ -0,0 +1,160 @@
+import io
+import json
+
+import riu.journal
+import riu.utility
+
+import jpart.rule
+import jpart.reader
+import jpart.sample
+
+
+def _get_lines(n):
+    lines = [
+        json.dumps({'i': i, 'padding': 'x' * (i % 7)}) + '\n'
+        for i
+        in range(n)
+    ]
+
+    return lines
+
+
+class Test(object):
+    def test_line_sampler(self):
+
+        s = io.StringIO(''.join(_get_lines(100)))
+
+        sampler = jpart.sample.LineSampler(10)
+        pairs = list(sampler.iterate_records(s, do_keep_lines=True))
+
+        actual = [record['i'] for record, _ in pairs]
+
+        assert \
+            actual == list(range(0, 100, 10)), \
+            "Sample not correct: {}".format(actual)
+
+        assert \
+            pairs[1][1] == _get_lines(100)[10], \
+            "Line not kept: {}".format(pairs[1][1])
+
+    def test_line_sampler__mapped(self):
+
+        with riu.utility.temp_path():
+            with open('input.jsonl', 'w') as f:
+                f.write(''.join(_get_lines(100)))
+
+            f = jpart.reader.MappedInput('input.jsonl')
+
+            sampler = jpart.sample.LineSampler(25)
+            actual = [record['i'] for record, _ in sampler.iterate_records(f)]
+
+        assert \
+            actual == [0, 25, 50, 75], \
+            "Sample not correct: {}".format(actual)
+
+    def test_byte_range_sampler(self):
+
+        lines = _get_lines(2000)
+        data = ''.join(lines).encode('utf-8')
+
+        s = io.BytesIO(data)
+
+        sampler = \
+            jpart.sample.ByteRangeSampler(
+                0.05,
+                range_bytes=500,
+                seed=1)
+
+        pairs = list(sampler.iterate_records(s, do_keep_lines=True))
+
+        # Only whole lines, each at most once
+
+        indices = [record['i'] for record, _ in pairs]
+
+        assert \
+            indices == sorted(set(indices)), \
+            "Lines repeated or out of order: {}".format(indices)
+
+        for record, line in pairs:
+            assert \
+                line == lines[record['i']].encode('utf-8'), \
+                "Line not whole: {}".format(line)
+
+        stats = sampler.stats
+
+        assert \
+            len(data) * 0.04 < stats['bytes'] < len(data) * 0.08, \
+            "Read share not correct: {} of ({})".format(stats, len(data))
+
+        # The same seed gives the same sample
+
+        sampler = \
+            jpart.sample.ByteRangeSampler(
+                0.05,
+                range_bytes=500,
+                seed=1)
+
+        actual = [record['i'] for record, _ in sampler.iterate_records(s)]
+
+        assert \
+            actual == indices, \
+            "Sample not repeatable: {}".format(actual)
+
+    def test_byte_range_sampler__whole(self):
+
+        s = io.StringIO(''.join(_get_lines(10)))
+
+        sampler = jpart.sample.ByteRangeSampler(0.5, range_bytes=1000)
+        actual = [record['i'] for record, _ in sampler.iterate_records(s)]
+
+        assert \
+            actual == list(range(10)), \
+            "Expected the whole input: {}".format(actual)
+
+    def test_partition_reservoir(self):
+
+        input_data = io.StringIO()
+        for i in range(300):
+            riu.journal.journalize(
+                input_data,
+                field1='aa{}'.format(i % 3),
+                field2=i)
+
+        for engine in (jpart.rule.ENGINE__CACHED, jpart.rule.ENGINE__BATCH):
+            with riu.utility.temp_path() as output_path:
+
+                config = {
+                    'engine': engine,
+                    'batch_size': 32,
+                    'sample': {
+                        'reservoir': 5,
+                        'seed': 3,
+                    },
+                    'rules': {
+                        'rule1': ['field1'],
+                    },
+                }
+
+                jpart.rule.load_rules_and_apply_to_input_data_with_config(
+                    None,
+                    output_path,
+                    config,
+                    input_data)
+
+                for j in range(3):
+                    filepath = 'rule1/aa{}.jsonl'.format(j)
+                    with open(filepath) as f:
+                        records = [json.loads(line) for line in f]
+
+                    values = [record['field2'] for record in records]
+
+                    assert \
+                        len(values) == 5 and \
+                        all(value % 3 == j for value in values), \
+                        "Sample not correct ({}): {}".format(engine, values)
+
+                    # Not just the first ones
+
+                    assert \
+                        max(values) > 15, \
+                        "Sample not spread ({}): {}".format(engine, values)
@@ -0,0 +1,298 @@
+import os
+import io
+import json
+import multiprocessing
+
+import riu.utility
+
+import jpart.rule
+import jpart.shard
+import jpart.catalog
+import jpart.index
+
+
+def _get_outputs(output_path):
+    outputs = {}
+    for path, folders, filenames in os.walk(output_path):
+        for filename in filenames:
+            if filename.endswith('.jsonl') is False:
+                continue
+
+            filepath = os.path.join(path, filename)
+            rel_filepath = os.path.relpath(filepath, output_path)
+
+            with open(filepath, 'rb') as f:
+                outputs[rel_filepath] = f.read()
+
+    return outputs
+
+
+def _run(arguments):
+    """Stands in for one node."""
+
+    output_path, config, input_filepath = arguments
+
+    f = jpart.reader.MappedInput(input_filepath)
+
+    jpart.rule.load_rules_and_apply_to_input_data_with_config(
+        None,
+        output_path,
+        config,
+        f)
+
+
+class Test(object):
+    def test_byte_range_shard(self):
+
+        lines = [
+            json.dumps({'i': i, 'padding': 'x' * (i % 11)}) + '\n'
+            for i
+            in range(500)
+        ]
+
+        data = ''.join(lines).encode('utf-8')
+
+        indices = []
+        for index in range(7):
+            shard = jpart.shard.ByteRangeShard(index, 7)
+
+            indices += [
+                record['i']
+                for record, _
+                in shard.iterate_records(io.BytesIO(data))
+            ]
+
+        assert \
+            indices == list(range(500)), \
+            "Every line must be read exactly once and in order: {}".format(
+            indices)
+
+    def test_merge_shards(self):
+
+        for by in (jpart.shard.SHARD_BY__BYTES, jpart.shard.SHARD_BY__KEY):
+            with riu.utility.temp_path() as path:
+
+                with open('input.jsonl', 'w') as f:
+                    for i in range(400):
+                        record = {
+                            'field1': 'aa{}'.format(i % 5),
+                            'field2': 'bb{}'.format(i % 3),
+                            'i': i,
+                        }
+
+                        f.write(json.dumps(record) + '\n')
+
+                config = {
+                    'catalog': True,
+                    'index': {
+                        'stride': 10,
+                    },
+                    'rules': {
+                        'rule1': ['field1', 'field2'],
+                        'rule2': ['field2'],
+                    },
+                }
+
+                os.mkdir('expected')
+                _run(('expected', config, 'input.jsonl'))
+                expected = _get_outputs('expected')
+
+
+                # Several processes standing in for nodes
+
+                work = []
+                for index in range(3):
+                    shard_config = dict(config)
+                    shard_config['shard'] = {
+                        'index': index,
+                        'count': 3,
+                        'by': by,
+                    }
+
+                    work.append(('sharded', shard_config, 'input.jsonl'))
+
+                with multiprocessing.Pool(3) as pool:
+                    pool.map(_run, work)
+
+                assert \
+                    sorted(os.listdir('sharded')) == [
+                        'shard-00000-of-00003',
+                        'shard-00001-of-00003',
+                        'shard-00002-of-00003',
+                    ], \
+                    "Shard subtrees not correct ({}): {}".format(
+                    by, os.listdir('sharded'))
+
+                shards, _ = jpart.shard.merge_shards('sharded')
+
+                assert \
+                    shards == 3, \
+                    "Expected three shards ({}): ({})".format(by, shards)
+
+                actual = _get_outputs('sharded')
+
+                assert \
+                    actual == expected, \
+                    "Merged output not identical ({}):\n{}\n\n{}".format(
+                    by, sorted(actual), sorted(expected))
+
+                assert \
+                    jpart.shard.find_shard_paths('sharded') == [], \
+                    "Shards not removed ({}).".format(by)
+
+
+                # The catalog and indexes cover the merged files
+
+                catalog_filepath = \
+                    jpart.catalog.get_catalog_filepath('sharded')
+
+                catalog = jpart.catalog.Catalog(catalog_filepath, 'sharded')
+
+                try:
+                    rows = catalog.find(rule_name='rule2')
+
+                finally:
+                    catalog.close()
+
+                actual = sorted(rows)
+
+                expected_rows = sorted([
+                    ('rule2/bb0.jsonl', 134, len(expected['rule2/bb0.jsonl'])),
+                    ('rule2/bb1.jsonl', 133, len(expected['rule2/bb1.jsonl'])),
+                    ('rule2/bb2.jsonl', 133, len(expected['rule2/bb2.jsonl'])),
+                ])
+
+                assert \
+                    actual == expected_rows, \
+                    "Catalog not correct ({}): {}".format(by, actual)
+
+                record = \
+                    jpart.index.get_record(
+                        os.path.join('sharded', 'rule2', 'bb1.jsonl'),
+                        100)
+
+                assert \
+                    record['i'] == 301, \
+                    "Index not correct ({}): {}".format(by, record)
+
+    def test_merge_shards__resume(self):
+
+        def interrupt(module, name, n):
+            """Fail the Nth call to a function."""
+
+            original = getattr(module, name)
+            calls = []
+
+            def wrapper(*args, **kwargs):
+                calls.append(None)
+                if len(calls) == n:
+                    raise IOError("test: interrupted")
+
+                return original(*args, **kwargs)
+
+            setattr(module, name, wrapper)
+
+            return original
+
+        # Interrupted after appending and after finishing a partition
+
+        stages = (
+            (jpart.index, 'extend_index'),
+            (jpart.shard, '_remove_partition_files'),
+        )
+
+        for module, name in stages:
+            with riu.utility.temp_path() as path:
+
+                with open('input.jsonl', 'w') as f:
+                    for i in range(400):
+                        record = {
+                            'field1': 'aa{}'.format(i % 5),
+                            'i': i,
+                        }
+
+                        f.write(json.dumps(record) + '\n')
+
+                config = {
+                    'catalog': True,
+                    'index': {
+                        'stride': 10,
+                    },
+                    'rules': {
+                        'rule1': ['field1'],
+                    },
+                }
+
+                os.mkdir('expected')
+                _run(('expected', config, 'input.jsonl'))
+                expected = _get_outputs('expected')
+
+                for index in range(2):
+                    shard_config = dict(config)
+                    shard_config['shard'] = {
+                        'index': index,
+                        'count': 2,
+                    }
+
+                    _run(('sharded', shard_config, 'input.jsonl'))
+
+                original = interrupt(module, name, 3)
+
+                try:
+                    jpart.shard.merge_shards('sharded')
+
+                except IOError:
+                    pass
+
+                else:
+                    raise Exception("Expected interruption ({}).".format(
+                                    name))
+
+                finally:
+                    setattr(module, name, original)
+
+                shards, files = jpart.shard.merge_shards('sharded')
+
+                assert \
+                    (shards, files) == (2, 10), \
+                    "Resumed merge not correct ({}): {}".format(
+                    name, (shards, files))
+
+                actual = _get_outputs('sharded')
+
+                assert \
+                    actual == expected, \
+                    "Resumed output not identical ({}):\n{}\n\n{}".format(
+                    name, sorted(actual), sorted(expected))
+
+                assert \
+                    jpart.shard.find_shard_paths('sharded') == [], \
+                    "Shards not removed ({}).".format(name)
+
+
+                # The catalog and indexes cover the merged files once
+
+                catalog_filepath = \
+                    jpart.catalog.get_catalog_filepath('sharded')
+
+                catalog = jpart.catalog.Catalog(catalog_filepath, 'sharded')
+
+                try:
+                    rows = catalog.find(rule_name='rule1')
+
+                finally:
+                    catalog.close()
+
+                assert \
+                    sorted(row[1] for row in rows) == [80] * 5, \
+                    "Catalog not correct ({}): {}".format(name, rows)
+
+                for rel_filepath in actual:
+                    filepath = os.path.join('sharded', rel_filepath)
+                    entries = jpart.index.load_index(filepath)
+                    rebuilt = jpart.index.build_index(filepath, stride=10)
+
+                    assert \
+                        entries == rebuilt, \
+                        "Index not correct ({}): [{}]".format(
+                        name, rel_filepath)
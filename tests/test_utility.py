@@ -1,3 +1,6 @@
+import os
+
+import riu.utility
 
 import jpart.utility
 
@@ -12,3 +15,69 @@ class Test(object):
         assert \
             filename == expected, \
             "Filename not correct: [{}]".format(filename)
+
+    def test_construct_output_rel_filepath(self):
+        field_names = ['f1', 'f2.sub']
+        phrases = ['aa', 'bb']
+
+        rel_filepath = \
+            jpart.utility.construct_output_rel_filepath(
+                field_names,
+                phrases)
+
+        assert \
+            rel_filepath == 'aa-bb.jsonl', \
+            "Flat filepath not correct: [{}]".format(rel_filepath)
+
+        rel_filepath = \
+            jpart.utility.construct_output_rel_filepath(
+                field_names,
+                phrases,
+                layout=jpart.utility.LAYOUT__HIVE)
+
+        expected = os.path.join('f1=aa', 'f2.sub=bb', 'part.jsonl')
+
+        assert \
+            rel_filepath == expected, \
+            "Hive filepath not correct: [{}]".format(rel_filepath)
+
+        pairs = jpart.utility.parse_hive_rel_filepath(rel_filepath)
+
+        expected = [
+            ('f1', 'aa'),
+            ('f2.sub', 'bb'),
+        ]
+
+        assert \
+            pairs == expected, \
+            "Parsed pairs not correct: {}".format(pairs)
+
+    def test_created_paths(self):
+
+        with riu.utility.temp_path() as temp_path:
+            created_paths = jpart.utility.CreatedPaths()
+
+            path = os.path.join(temp_path, 'aa', 'bb')
+
+            actual = created_paths.ensure(path)
+            expected = [path, os.path.dirname(path)]
+
+            assert \
+                actual == expected, \
+                "Created paths not correct: {}".format(actual)
+
+            assert \
+                os.path.isdir(path) is True, \
+                "Path does not exist."
+
+            assert \
+                path in created_paths, \
+                "Path not remembered."
+
+            # Remembered paths aren't checked again
+
+            os.rmdir(path)
+
+            assert \
+                created_paths.ensure(path) == [], \
+                "Expected path to be remembered."